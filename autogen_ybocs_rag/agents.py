@@ -1,41 +1,160 @@
 import asyncio
+import logging
 import os
+import time
 from pathlib import Path
 
 from autogen_agentchat.agents import AssistantAgent, UserProxyAgent
 from autogen_agentchat.teams import RoundRobinGroupChat
-from autogen_agentchat.messages import TextMessage, ToolCallExecutionEvent, ToolCallRequestEvent, UserInputRequestedEvent
+from autogen_agentchat.messages import ModelClientStreamingChunkEvent, TextMessage, ToolCallExecutionEvent, ToolCallRequestEvent, UserInputRequestedEvent
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_ext.models.ollama import OllamaChatCompletionClient
-from autogen_ext.memory.chromadb import ChromaDBVectorMemory, PersistentChromaDBVectorMemoryConfig, SentenceTransformerEmbeddingFunctionConfig
 # from autogen_agentchat.ui import Console
 
-from autogen_ybocs_rag.indexer import SimpleDocumentIndexer
+import telemetry
+from autogen_ybocs_rag.answer_cache import has_history, retarget_state
+from registry import shared
 from system_prompt import BASIC_PROMPT
 
+logger = logging.getLogger(__name__)
+
 DOCS_PATH = r"data\documents"
 MAX_TURNS = 20
+PERSISTENCE_PATH = os.path.join(str(Path.home()), ".chromadb_ocd")
+MANIFEST_PATH = os.path.join(PERSISTENCE_PATH, "ocd_docs_manifest.json")
+CHAT_MODEL = "llama3.2:1b"
+HYBRID_RETRIEVAL = True  # fuse BM25 and dense results, helps with exact item numbers and scale terms
+CONTEXT_TOKEN_BUDGET = 1000  # max tokens of document chunks injected into the agent's context per turn
+RERANK = True  # rescore over-fetched chunks with a CPU cross-encoder, inject only the clearly relevant ones
+RERANK_CANDIDATES = 12
+EMBED_MODEL = "all-MiniLM-L6-v2"
+EMBED_BACKEND = os.getenv("YBOCS_EMBED_BACKEND", "torch")  # "torch", "torch-int8", "onnx" or "onnx-int8"
+# serve retrieval read-only from a snapshot file (see export_ocd_docs_snapshot) instead of ChromaDB
+OCD_DOCS_SNAPSHOT = os.getenv("OCD_DOCS_SNAPSHOT")
+ANSWER_CACHE = True  # replay answers to paraphrases of earlier questions instead of running the team again
+ANSWER_CACHE_THRESHOLD = 0.92  # min cosine similarity between task embeddings for a cache hit
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 3600.0  # seconds
+
+# Shared embedding function: the vector memory and the answer cache embed with the same model instance
+@shared("ocd_docs_embedding")
+def get_embedding_function():
+    from autogen_ybocs_rag.embeddings import cached_sentence_transformer
+
+    # SentenceTransformer behind the shared on-disk embedding cache, so re-indexing only embeds new text
+    return cached_sentence_transformer(model_name=EMBED_MODEL, backend=EMBED_BACKEND)
+
+# Shared, lazily created vector memory: built once per process on first use, not at import time
+@shared("ocd_docs_memory")
+def get_rag_memory():
+    # chromadb and the embedding model are only imported/loaded when memory is first needed
+    from autogen_ext.memory.chromadb import ChromaDBVectorMemory, PersistentChromaDBVectorMemoryConfig, CustomEmbeddingFunctionConfig
 
-# Initialize vector memory
-rag_memory = ChromaDBVectorMemory(
-    config=PersistentChromaDBVectorMemoryConfig(
-        collection_name="ocd_docs",
-        persistence_path=os.path.join(str(Path.home()), ".chromadb_ocd"),
-        k=3,  # Return top k results
-        score_threshold=0.3,  # Minimum similarity score
-        embedding_function_config=SentenceTransformerEmbeddingFunctionConfig(
-                model_name="all-MiniLM-L6-v2"  # Use default model for testing
-            ),
+    return ChromaDBVectorMemory(
+        config=PersistentChromaDBVectorMemoryConfig(
+            collection_name="ocd_docs",
+            persistence_path=PERSISTENCE_PATH,
+            k=3,  # Return top k results
+            score_threshold=0.3,  # Minimum similarity score
+            embedding_function_config=CustomEmbeddingFunctionConfig(function=get_embedding_function, params={}),
+        )
     )
-)
+
+# Memory the agent and indexers use: the vector memory, optionally wrapped with BM25 + RRF fusion
+@shared("ocd_docs_retrieval_memory")
+def get_retrieval_memory():
+    from context_packing import ContextPacker
+    from reranking import AdaptiveReranker
+
+    # near-duplicate chunks are dropped and the rest held to the token budget, at most 3 injected
+    packer = ContextPacker(max_tokens=CONTEXT_TOKEN_BUDGET, max_chunks=3)
+    reranker = AdaptiveReranker(candidates=RERANK_CANDIDATES) if RERANK else None
+    if OCD_DOCS_SNAPSHOT:
+        from autogen_ybocs_rag.memory import SnapshotMemory
+
+        return SnapshotMemory(OCD_DOCS_SNAPSHOT, get_embedding_function(), k=3, packer=packer, reranker=reranker)
+    if not HYBRID_RETRIEVAL:
+        return get_rag_memory()
+    from autogen_ybocs_rag.memory import HybridMemory
+
+    return HybridMemory(
+        get_rag_memory(),
+        bm25_path=os.path.join(PERSISTENCE_PATH, "ocd_docs_bm25.json"),
+        k=3,
+        packer=packer,
+        reranker=reranker,
+    )
+
+# Semantic answer cache in front of the team, invalidated when the document collection changes
+@shared("answer_cache")
+def get_answer_cache():
+    from autogen_ybocs_rag.answer_cache import SemanticAnswerCache, memory_fingerprint
+
+    return SemanticAnswerCache(
+        embed_fn=get_embedding_function(),
+        fingerprint_fn=lambda: memory_fingerprint(get_retrieval_memory()),
+        threshold=ANSWER_CACHE_THRESHOLD,
+        max_entries=ANSWER_CACHE_SIZE,
+        ttl=ANSWER_CACHE_TTL,
+    )
+
+# Shared model client, reused by every team instead of one client per teamConfig() call
+@shared("chat_model_client")
+def get_model_client():
+    return OllamaChatCompletionClient(model=CHAT_MODEL)
+
+def __getattr__(name):
+    # keeps `from autogen_ybocs_rag.agents import rag_memory` working without loading it at import time
+    if name == "rag_memory":
+        return get_rag_memory()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Index OCD documentation
 async def index_ocd_docs() -> None:
-    indexer = SimpleDocumentIndexer(memory=rag_memory)
+    from autogen_ybocs_rag.indexer import SimpleDocumentIndexer
+
+    indexer = SimpleDocumentIndexer(memory=get_retrieval_memory())
     sources = [os.path.join(DOCS_PATH, file) for file in os.listdir(DOCS_PATH) if file.endswith('.pdf')]
-    print(sources)
-    chunks: int = await indexer.index_documents(sources)
-    print(f"Indexed {chunks} chunks from {len(sources)} documents in {DOCS_PATH} path")
+    stats = await indexer.index_documents_pipelined(sources)
+    logger.info(f"Indexed {stats.chunks} chunks from {len(sources)} documents in {DOCS_PATH} path")
+
+# Refresh OCD documentation: only new/changed files are embedded, removed files are dropped
+async def refresh_ocd_docs() -> None:
+    from autogen_ybocs_rag.indexer import IncrementalDocumentIndexer
+
+    indexer = IncrementalDocumentIndexer(memory=get_retrieval_memory(), manifest_path=MANIFEST_PATH)
+    sources = [os.path.join(DOCS_PATH, file) for file in os.listdir(DOCS_PATH) if file.endswith('.pdf')]
+    await indexer.reindex(sources)
+
+# Snapshot of the collection (chunks, metadata and embeddings in one checksummed file) for other nodes:
+# import it into their ChromaDB, or serve it read-only with OCD_DOCS_SNAPSHOT, without re-embedding
+async def export_ocd_docs_snapshot(path: str, dtype: str = "float32") -> None:
+    from snapshots import export_collection
+
+    memory = get_rag_memory()
+    memory._ensure_initialized()
+    info = await asyncio.to_thread(export_collection, memory._collection, path, get_embedding_function().cache.model_id, dtype)
+    logger.info(f"Exported {info.summary()}")
+
+async def import_ocd_docs_snapshot(path: str) -> None:
+    from autogen_ybocs_rag.memory import HybridMemory
+    from snapshots import Snapshot, import_collection
+
+    snapshot = Snapshot.open(path, verify=True)
+    try:
+        snapshot.check_model(get_embedding_function().cache.model_id)
+        memory = get_retrieval_memory()
+        if isinstance(memory, HybridMemory):
+            rows = await memory.import_snapshot(snapshot)
+        else:
+            get_rag_memory()._ensure_initialized()
+            rows = await asyncio.to_thread(import_collection, snapshot, get_rag_memory()._collection)
+    finally:
+        snapshot.close()
+    logger.info(f"Imported {rows} chunks from {path}")
+
+class StreamChunk(str):
+    """Partial model output yielded by orchestrate(stream=True); the full TextMessage follows once the model is done."""
 
 # # define a "tool"
 # def tool():
@@ -43,9 +162,8 @@ async def index_ocd_docs() -> None:
 
 # define team Config
 def teamConfig():
-    model = OllamaChatCompletionClient(
-        model="llama3.2:1b"
-    )
+    # agents and team are cheap to build; the model client and memory behind them are shared
+    model = get_model_client()
 
     # define user proxy to get feedback on responses. Maybe not necessary? Esp for literature review method
     user = UserProxyAgent("user_proxy", input_func=input)
@@ -55,7 +173,8 @@ def teamConfig():
         name="chatbot",
         system_message=(BASIC_PROMPT),
         model_client=model,
-        memory=[rag_memory]
+        memory=[get_retrieval_memory()],
+        model_client_stream=True,  # emit tokens as they are generated, see orchestrate(stream=True)
      )
 
     # define team for agents to work together
@@ -68,32 +187,60 @@ def teamConfig():
     return team
 
 # co-routine for AI agents
-async def orchestrate(team, task):
+async def orchestrate(team, task, stream=False, use_cache=True):
     # await rag_memory.clear()  # Clear existing memory
     # await index_ocd_docs()
-    async for msg in team.run_stream(task=task):
-        print("--" * 20)
+    # await refresh_ocd_docs()  # or: only re-embed documents that changed since the last run
+    # a paraphrase of an earlier task replays that run's events; otherwise the team runs and its events are recorded
+    cache = get_answer_cache() if use_cache and ANSWER_CACHE else None
+    if cache is not None and has_history(await team.save_state()):
+        # a follow-up depends on the conversation so far, which the cache key does not capture
+        cache = None
+    cached = await cache.lookup(task) if cache is not None else None
+    events = cache.replay(cached, task) if cached is not None else team.run_stream(task=task)
+    recorded = [] if cache is not None and cached is None else None
+    # a model call starts after the last non-streaming event (the task, or the memory query result)
+    call_start, first_token = time.perf_counter(), False
+    async for msg in events:
+        if recorded is not None:
+            recorded.append(msg)
+        if isinstance(msg, ModelClientStreamingChunkEvent):
+            if not first_token and cached is None:
+                first_token = True
+                telemetry.record_stage("llm_ttft", time.perf_counter() - call_start, pipeline="autogen")
+            if stream:
+                yield StreamChunk(msg.content)
+            continue
+        if isinstance(msg, (TextMessage, ToolCallRequestEvent)) and msg.source != "user" and cached is None:
+            telemetry.record_stage("llm_total", time.perf_counter() - call_start, pipeline="autogen")
+            if msg.models_usage is not None:
+                telemetry.count("llm_tokens_total", msg.models_usage.prompt_tokens, pipeline="autogen", kind="prompt")
+                telemetry.count("llm_tokens_total", msg.models_usage.completion_tokens, pipeline="autogen", kind="completion")
+        call_start, first_token = time.perf_counter(), False
         if isinstance(msg, TextMessage):
-            print(message:=f"{msg.source}: {msg.content}")
-            yield message
+            yield f"{msg.source}: {msg.content}"
         elif isinstance(msg, ToolCallRequestEvent):
-            print(message:=msg.to_text())
-            yield message
+            yield msg.to_text()
         elif isinstance(msg, ToolCallExecutionEvent):
-            print(message:=msg.to_text())
-            yield message
+            yield msg.to_text()
         elif isinstance(msg, UserInputRequestedEvent):
-            print(msg)
-            print(message:=msg.to_text())
-            yield message
+            logger.debug(msg)
+            yield msg.to_text()
+    if cached is not None:
+        # the replayed question and answer become the team's history, as if the team had run
+        await team.load_state(retarget_state(cached.state, cached.task, task))
+    if recorded is not None:
+        await cache.store(task, recorded, await team.save_state())
     # await rag_memory.close() # close memory when done
 
 # main co-routine
 async def main(task):
     team = teamConfig()
     async for message in orchestrate(team, task):
-        pass
+        print("--" * 20)
+        print(message)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     task = "Based on documents in your memory, what is Y-BOCS?" # example question
     asyncio.run(main(task))
\ No newline at end of file
@@ -0,0 +1,216 @@
+import re
+import copy
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, List, Mapping, Optional, Sequence
+
+import numpy as np
+from autogen_agentchat.messages import TextMessage, ToolCallRequestEvent, UserInputRequestedEvent
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_FINGERPRINTS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()  # plain memory -> CollectionFingerprint
+
+
+def memory_fingerprint(memory) -> str:
+    """Changes whenever the content of the memory's collection changes.
+
+    HybridMemory and SnapshotMemory provide their own fingerprint; for a plain
+    ChromaDBVectorMemory the digest of the collection's chunk IDs is used, cached as
+    described in CollectionFingerprint.
+    """
+    from autogen_ybocs_rag.memory import CollectionFingerprint
+
+    fingerprint = getattr(memory, "fingerprint", None)
+    if fingerprint is not None:
+        return fingerprint()
+    memory._ensure_initialized()
+    if memory not in _FINGERPRINTS:
+        _FINGERPRINTS[memory] = CollectionFingerprint()
+    return _FINGERPRINTS[memory](memory._collection)
+
+
+def has_history(team_state: Any) -> bool:
+    """Whether a saved team state holds any messages, i.e. a conversation is in progress."""
+    if isinstance(team_state, Mapping):
+        return any(
+            (key in ("message_thread", "messages") and isinstance(value, list) and bool(value)) or has_history(value)
+            for key, value in team_state.items()
+        )
+    if isinstance(team_state, list):
+        return any(has_history(item) for item in team_state)
+    return False
+
+
+def retarget_state(team_state: Any, cached_task: str, task: str) -> Any:
+    """A copy of a cached run's team state with the cached task message replaced by `task`."""
+    if isinstance(team_state, Mapping):
+        state = {key: retarget_state(value, cached_task, task) for key, value in team_state.items()}
+        if state.get("source") == "user" and state.get("content") == cached_task:
+            state["content"] = task
+        return state
+    if isinstance(team_state, list):
+        return [retarget_state(item, cached_task, task) for item in team_state]
+    return copy.deepcopy(team_state)
+
+
+@dataclass
+class CachedAnswer:
+    task: str
+    vector: np.ndarray
+    events: list  # the team's events after the task message, as yielded by run_stream
+    state: Mapping  # the team's saved state after the run, loaded into the team on replay
+    stored_at: float
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    """Answers of earlier team runs, looked up by embedding similarity of the task.
+
+    A task whose embedding has cosine similarity of at least `threshold` with a cached task
+    (and mentions the same numbers, so "item 3" never answers "item 4") is answered by
+    replaying the cached run's events, without calling the model. Entries expire after
+    `ttl` seconds, the least recently used are evicted beyond `max_entries`, and the whole
+    cache is cleared when the memory's fingerprint changes (documents added or removed).
+
+    Only complete text answers are stored; runs that asked for user input or called tools
+    are not. Entries hold the team's state after the run, so a replayed answer can be put
+    into the team's history (see retarget_state). Only the first question of a conversation
+    should be looked up or stored: follow-ups depend on the history, which is not in the key.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+        fingerprint_fn: Optional[Callable[[], str]] = None,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        ttl: Optional[float] = 3600.0,
+    ) -> None:
+        self.embed_fn = embed_fn
+        self.fingerprint_fn = fingerprint_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None  # rows in _entries order, rebuilt after changes
+        self._keys: List[str] = []
+        self._fingerprint: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _embed(self, task: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn([task])[0], dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _check_fingerprint(self) -> None:
+        if self.fingerprint_fn is None:
+            return
+        fingerprint = self.fingerprint_fn()
+        with self._lock:
+            if self._fingerprint is not None and fingerprint != self._fingerprint:
+                logger.info("Document collection changed, invalidating semantic answer cache")
+                self._entries.clear()
+                self._matrix = None
+            self._fingerprint = fingerprint
+
+    def _expire(self) -> None:
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry.stored_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _search(self, vector: np.ndarray, task: str) -> Optional[CachedAnswer]:
+        with self._lock:
+            self._expire()
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([self._entries[key].vector for key in self._keys])
+            scores = self._matrix @ vector
+            numbers = _NUMBER.findall(task)
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    return None
+                entry = self._entries[self._keys[i]]
+                if _NUMBER.findall(entry.task) == numbers:
+                    self._entries.move_to_end(self._keys[i])
+                    entry.hits += 1
+                    return entry
+            return None
+
+    async def lookup(self, task: str) -> Optional[CachedAnswer]:
+        with telemetry.span("answer_cache_lookup", pipeline="autogen") as span:
+            await asyncio.to_thread(self._check_fingerprint)
+            vector = await asyncio.to_thread(self._embed, task)
+            entry = self._search(vector, task)
+            span.set(hit=entry is not None)
+        telemetry.cache_lookup("semantic_answer", hit=entry is not None)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.debug(f"Semantic cache hit for {task!r}: answered as {entry.task!r}")
+        return entry
+
+    @staticmethod
+    def cacheable(events: list) -> bool:
+        answered = any(isinstance(event, TextMessage) and event.source != "user" for event in events)
+        return answered and not any(isinstance(event, (UserInputRequestedEvent, ToolCallRequestEvent)) for event in events)
+
+    async def store(self, task: str, events: list, team_state: Mapping) -> bool:
+        """Cache a finished run's events (the task message itself is left out) and the team's state
+        after it; returns whether it was stored."""
+        events = [event for event in events if hasattr(event, "source") and event.source != "user"]
+        if not self.cacheable(events):
+            return False
+        await asyncio.to_thread(self._check_fingerprint)
+        vector = await asyncio.to_thread(self._embed, task)
+        with self._lock:
+            self._entries[uuid.uuid4().hex] = CachedAnswer(task, vector, events, team_state, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+        return True
+
+    @staticmethod
+    async def replay(entry: CachedAnswer, task: str) -> AsyncIterator:
+        """The cached run's events, preceded by the new task message, as team.run_stream would yield them."""
+        yield TextMessage(source="user", content=task)
+        for event in entry.events:
+            yield event
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
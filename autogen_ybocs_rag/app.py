@@ -1,9 +1,58 @@
 import streamlit as st
 import asyncio
+import queue
+import threading
 import re
 import os
+import json
+import uuid
 
-from autogen_ybocs_rag.agents import teamConfig, orchestrate
+from autogen_ybocs_rag.agents import StreamChunk, teamConfig, orchestrate
+from registry import shared
+
+_DONE = object()
+# when set, this page is a thin client of autogen_ybocs_rag.server, which holds the session state
+SERVER_URL = os.environ.get("YBOCS_SERVER_URL")
+
+@shared("app_event_loop")
+def getEventLoop():
+    # one long-lived loop per server process: the shared model client and memory hold connections
+    # bound to the loop they were first used on, so every rerun must run on the same loop
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-loop", daemon=True).start()
+    return loop
+
+def iterOnLoop(agen):
+    """Run an async generator on the shared loop and yield its items here, in the script thread."""
+    items = queue.Queue()
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(_DONE)
+    asyncio.run_coroutine_threadsafe(pump(), getEventLoop())
+    while (item := items.get()) is not _DONE:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def iterRemote(session_id, task):
+    """Stream one turn from the chat service, turning its NDJSON lines back into messages and chunks."""
+    import httpx
+    with httpx.stream("POST", f"{SERVER_URL}/chat", json={"session_id": session_id, "message": task}, timeout=None) as response:
+        if response.status_code == 503:
+            raise RuntimeError("The assistant is busy right now, please try again in a moment.")
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "error":
+                raise RuntimeError(event["content"])
+            yield StreamChunk(event["content"]) if event["type"] == "chunk" else event["content"]
 
 def getFileName(msg):
     match = re.search(r'GENERATED:([^\s]+\.png)', msg)
@@ -11,11 +60,23 @@ def getFileName(msg):
         return match.group(1)
     return None
 
-def showMessage(container, msg):
+def showMessage(container, msg, live=None):
+    # `live` holds the in-progress streamed reply for the current turn: its placeholder and the text so far
     with container:
-        if msg.startswith('chatbot'):
-            with st.chat_message("ai"):
-                st.markdown(msg[54:])
+        if isinstance(msg, StreamChunk):
+            if "placeholder" not in live:
+                with st.chat_message("ai"):
+                    live["placeholder"] = st.empty()
+                live["text"] = ""
+            live["text"] += msg
+            live["placeholder"].markdown(live["text"] + "▌")
+        elif msg.startswith('chatbot'):
+            if live and "placeholder" in live:
+                # swap the streamed draft for the final message
+                live.pop("placeholder").markdown(msg[54:])
+            else:
+                with st.chat_message("ai"):
+                    st.markdown(msg[54:])
             if filename:=getFileName(msg):
                 st.image(os.path.join("temp", filename), caption=filename)
         elif msg.startswith('CodeExecutor'):
@@ -66,15 +127,26 @@ chat_container = st.container()
 
 ## using method from talkwithyourdataset
 if desc:
-    async def main():
+    # runs on the shared loop, so it must not touch st.*; the last item it yields is the team state
+    async def main(team_state):
         team = teamConfig()
-        if "team_state" in st.session_state:
-            await team.load_state(st.session_state["team_state"])
-        async for message in orchestrate(team, desc):
-            st.session_state["messages"].append(message) # store the new response in session state
-            showMessage(chat_container, message)
-        st.session_state["team_state"] = await team.save_state()
+        if team_state is not None:
+            await team.load_state(team_state)
+        async for message in orchestrate(team, desc, stream=True):
+            yield message
+        yield await team.save_state()
+    if SERVER_URL:
+        messages = iterRemote(st.session_state.setdefault("session_id", uuid.uuid4().hex), desc)
+    else:
+        messages = iterOnLoop(main(st.session_state.get("team_state")))
     with st.spinner("Finding your answer..."):
-        asyncio.run(main())
+        live = {}
+        for message in messages:
+            if isinstance(message, dict):
+                st.session_state["team_state"] = message
+                continue
+            if not isinstance(message, StreamChunk):
+                st.session_state["messages"].append(message) # store the new response in session state
+            showMessage(chat_container, message, live)
     # st.success("Done!")
     # st.balloons()
\ No newline at end of file
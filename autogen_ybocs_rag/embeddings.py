@@ -0,0 +1,43 @@
+from typing import Optional
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from embedding_backends import DEFAULT_BACKEND, DEFAULT_THREADS, EmbeddingBackend, get_backend
+from embedding_cache import DEFAULT_CACHE_DIR, EmbeddingCache
+
+
+class BackendEmbeddingFunction(EmbeddingFunction[Documents]):
+    """ChromaDB embedding function running one of the CPU backends in embedding_backends.py."""
+
+    def __init__(self, backend: EmbeddingBackend) -> None:
+        self.backend = backend
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return list(self.backend.embed(list(input)))
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """ChromaDB embedding function that only embeds text missing from the shared EmbeddingCache."""
+
+    def __init__(self, embedding_function: EmbeddingFunction, cache: EmbeddingCache) -> None:
+        self.embedding_function = embedding_function
+        self.cache = cache
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.cache.embed(list(input), self.embedding_function)
+
+
+def cached_sentence_transformer(
+    model_name: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    backend: str = DEFAULT_BACKEND,
+    threads: Optional[int] = DEFAULT_THREADS,
+    cache_dtype: str = "float32",
+) -> CachedEmbeddingFunction:
+    """Factory for CustomEmbeddingFunctionConfig: a sentence-transformers model on the chosen
+    backend ("torch", "torch-int8", "onnx" or "onnx-int8"), wrapped in the embedding cache."""
+    embedder = get_backend(f"sentence-transformers/{model_name}", backend, threads=threads)
+    return CachedEmbeddingFunction(
+        BackendEmbeddingFunction(embedder),
+        EmbeddingCache(model_id=embedder.model_id, cache_dir=cache_dir, dtype=cache_dtype),
+    )
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiofiles
+import aiohttp
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(str(Path.home()), ".cache", "ybocs_http")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int  # status of the last response (304 when the cached body was revalidated)
+    body_path: str  # the body lives on disk, so large pages are never held in memory twice
+    from_cache: bool
+    content_type: str = ""
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        async with aiofiles.open(self.body_path, "r", encoding=encoding, errors="replace") as f:
+            return await f.read()
+
+
+@dataclass
+class FetchStats:
+    requests: int = 0
+    downloaded: int = 0
+    not_modified: int = 0  # revalidated with a 304, body served from the cache
+    retries: int = 0
+    failed: List[str] = field(default_factory=list)
+
+
+class HttpCache:
+    """On-disk cache of response bodies with their ETag / Last-Modified validators."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def body_path(self, url: str) -> Path:
+        return self.cache_dir / f"{self._key(url)}.body"
+
+    def get(self, url: str) -> Optional[dict]:
+        meta_path = self.cache_dir / f"{self._key(url)}.json"
+        if not meta_path.exists() or not self.body_path(url).exists():
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for a cached URL."""
+        meta = self.get(url)
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def put(self, url: str, response: aiohttp.ClientResponse) -> None:
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type", ""),
+            "fetched_at": time.time(),
+        }
+        meta_path = self.cache_dir / f"{self._key(url)}.json"
+        tmp_path = meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+
+class Fetcher:
+    """Concurrent HTTP fetching over one pooled session, with retries and a conditional-request cache.
+
+    At most `concurrency` requests are in flight, and at most `per_host` of them to one host.
+    Bodies are streamed to the on-disk cache; on the next fetch of the same URL its ETag and
+    Last-Modified are sent back, so an unchanged page costs a 304 and is read from disk.
+    Connection errors, timeouts, 429 and 5xx responses are retried `retries` times with
+    exponential backoff and jitter (honouring Retry-After), each wait capped at `max_delay`
+    seconds and spent without holding a concurrency slot. Any URL works, including a local
+    test server such as http://127.0.0.1:8000/.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        concurrency: int = 8,
+        per_host: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_delay: float = 30.0,
+        timeout: float = 30.0,
+        block_size: int = 1 << 16,
+    ) -> None:
+        self.cache = HttpCache(cache_dir) if cache_dir else None
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.block_size = block_size
+        self.stats = FetchStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tmp_dir = Path(cache_dir or os.path.join(str(Path.home()), ".cache", "ybocs_http_tmp"))
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    def _retry_delay(self, attempt: int, response: Optional[aiohttp.ClientResponse] = None) -> float:
+        """Seconds to wait before the next attempt, never more than `max_delay`."""
+        delay = self.backoff * 2**attempt * (0.5 + random.random())
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+        # a server asking for an hour's pause should fail the URL, not stall the whole crawl
+        return min(max(0.0, delay), self.max_delay)
+
+    async def _download(self, url: str, response: aiohttp.ClientResponse) -> Path:
+        """Stream the body to a temporary file, then move it into place."""
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+        target = self.cache.body_path(url) if self.cache else self._tmp_dir / f"{hashlib.sha256(url.encode()).hexdigest()[:32]}.body"
+        tmp_path = target.with_suffix(f".{os.getpid()}.{id(response)}.part")
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for block in response.content.iter_chunked(self.block_size):
+                await f.write(block)
+        os.replace(tmp_path, target)
+        return target
+
+    async def fetch(self, url: str) -> FetchResult:
+        session = self._get_session()
+        headers = self.cache.validators(url) if self.cache else {}
+        for attempt in range(self.retries + 1):
+            self.stats.requests += 1
+            try:
+                # hold a slot only while a request is in flight, never while backing off
+                async with self._slots:
+                    with telemetry.span("fetch", url=url, attempt=attempt) as span:
+                        async with session.get(url, headers=headers) as response:
+                            span.set(status=response.status)
+                            if response.status == 304:
+                                meta = self.cache.get(url) if self.cache else None
+                                if meta is None:
+                                    # nothing to revalidate against: not a body we can return
+                                    raise aiohttp.ClientResponseError(
+                                        response.request_info,
+                                        response.history,
+                                        status=304,
+                                        message="Not Modified without a cached body",
+                                        headers=response.headers,
+                                    )
+                                self.stats.not_modified += 1
+                                telemetry.cache_lookup("http", hit=True)
+                                return FetchResult(url, 304, str(self.cache.body_path(url)), True, meta.get("content_type", ""))
+                            if response.status in RETRY_STATUSES and attempt < self.retries:
+                                delay = self._retry_delay(attempt, response)
+                            else:
+                                response.raise_for_status()
+                                path = await self._download(url, response)
+                                if self.cache:
+                                    self.cache.put(url, response)
+                                    telemetry.cache_lookup("http", hit=False)
+                                self.stats.downloaded += 1
+                                return FetchResult(url, response.status, str(path), False, response.headers.get("Content-Type", ""))
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    self.stats.failed.append(url)
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.debug(f"Retrying {url} in {delay:.1f}s after {e!r}")
+            except aiohttp.ClientResponseError:
+                self.stats.failed.append(url)
+                raise
+            self.stats.retries += 1
+            await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def fetch_many(self, urls: List[str]) -> Dict[str, FetchResult]:
+        """Fetch URLs concurrently; failed URLs are logged and left out of the result."""
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        fetched = {}
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error fetching {url}: {result!r}")
+            else:
+                fetched[url] = result
+        return fetched
+
+    async def iter_bytes(self, url: str) -> AsyncIterator[bytes]:
+        """Fetch a URL (or revalidate it) and stream its body from disk in blocks."""
+        result = await self.fetch(url)
+        async with aiofiles.open(result.body_path, "rb") as f:
+            while block := await f.read(self.block_size):
+                yield block
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self) -> "Fetcher":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
@@ -1,39 +1,230 @@
+import os
+import io
 import re
+import codecs
+import json
+import time
+import hashlib
+import uuid
+import asyncio
 import logging
 import pathlib
-from typing import List
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from tqdm import tqdm
 
 import pymupdf
 import pymupdf4llm
 import aiofiles
-import aiohttp
 from autogen_core.memory import Memory, MemoryContent, MemoryMimeType
 from langchain.text_splitter import MarkdownTextSplitter
 
+import telemetry
+from autogen_ybocs_rag.fetcher import Fetcher
+
 logger = logging.getLogger(__name__)
 
+CHUNK_OVERLAP = 20
+STREAM_BLOCK_SIZE = 1 << 16  # bytes read at a time from streamed files and HTTP responses
+_TAG = re.compile(r"<[^>]*>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _parse_pdf(pdf_file: str, chunk_size: int) -> Tuple[List[str], float]:
+    """Extract markdown chunks from a PDF. Runs in a worker process, so it lives at module level."""
+    start = time.perf_counter()
+    md_text = pymupdf4llm.to_markdown(pdf_file)
+    pathlib.Path(f"{pdf_file}.md").write_bytes(md_text.encode())
+    splitter = MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=CHUNK_OVERLAP)
+    chunks = [text.page_content for text in splitter.create_documents([md_text])]
+    return chunks, time.perf_counter() - start
+
+
+def _pdf_page_count(pdf_file: str) -> int:
+    with pymupdf.open(pdf_file) as doc:
+        return doc.page_count
+
+
+def _parse_pdf_pages(pdf_file: str, start: int, stop: int) -> Tuple[str, float]:
+    """Markdown for pages [start, stop) only, so a worker never holds a whole large document."""
+    t0 = time.perf_counter()
+    with pymupdf.open(pdf_file) as doc:
+        md_text = pymupdf4llm.to_markdown(doc, pages=list(range(start, stop)), show_progress=False)
+    return md_text, time.perf_counter() - t0
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 2**20
+
+
+@dataclass
+class IngestStats:
+    """Throughput statistics for a pipelined ingest run."""
+
+    documents: int = 0
+    chunks: int = 0
+    batches: int = 0
+    parse_seconds: float = 0.0  # summed over workers, so can exceed wall time
+    write_seconds: float = 0.0  # embedding + vector store write
+    wall_seconds: float = 0.0
+    first_write_seconds: Optional[float] = None  # time until the first chunk was stored
+    memory_waits: int = 0  # times parsing paused because RSS was above the ceiling
+    chunks_by_source: Dict[str, int] = field(default_factory=dict)  # chunks actually written
+    failed_sources: List[str] = field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return len(self.failed_sources)
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.documents / self.wall_seconds if self.wall_seconds else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.wall_seconds if self.wall_seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.documents} docs ({self.failed} failed), {self.chunks} chunks in {self.batches} batches, "
+            f"{self.wall_seconds:.1f}s wall | {self.docs_per_second:.2f} docs/s, {self.chunks_per_second:.1f} chunks/s | "
+            f"parse {self.parse_seconds:.1f}s, embed+write {self.write_seconds:.1f}s"
+            + (f", first chunk after {self.first_write_seconds:.1f}s" if self.first_write_seconds is not None else "")
+        )
+
+
 class SimpleDocumentIndexer:
     """Basic document indexer with Memory."""
 
-    def __init__(self, memory: Memory, chunk_size: int = 1500) -> None:
+    def __init__(self, memory: Memory, chunk_size: int = 1500, fetcher: Optional[Fetcher] = None) -> None:
         self.memory = memory
         self.chunk_size = chunk_size
+        self._fetcher = fetcher
+        self._owns_fetcher = fetcher is None
+
+    @property
+    def fetcher(self) -> Fetcher:
+        """Pooled, caching HTTP fetcher for URL sources; created on first use unless one was passed in."""
+        if self._fetcher is None:
+            self._fetcher = Fetcher()
+        return self._fetcher
+
+    async def close(self) -> None:
+        """Close the HTTP session if this indexer created it (it is reopened on the next fetch)."""
+        if self._owns_fetcher and self._fetcher is not None:
+            await self._fetcher.close()
 
     async def _fetch_content(self, source: str) -> str:
         """Fetch content from URL or file."""
         if source.startswith(("http://", "https://")):
-            async with aiohttp.ClientSession() as session:
-                async with session.get(source) as response:
-                    return await response.text()
+            return await (await self.fetcher.fetch(source)).text()
         else:
             async with aiofiles.open(source, "r", encoding="utf-8") as f:
                 return await f.read()
 
+    async def _local_path(self, source: str) -> str:
+        """A file holding the source's content: the source itself, or a URL's body in the fetcher's cache."""
+        if source.startswith(("http://", "https://")):
+            return (await self.fetcher.fetch(source)).body_path
+        return source
+
+    @staticmethod
+    def _has_tags(path: str) -> bool:
+        """Whether the file contains both '<' and '>', the test index_documents applies to decide it is HTML."""
+        seen_lt = seen_gt = False
+        with open(path, "rb") as f:
+            while not (seen_lt and seen_gt) and (block := f.read(STREAM_BLOCK_SIZE)):
+                seen_lt, seen_gt = seen_lt or b"<" in block, seen_gt or b">" in block
+        return seen_lt and seen_gt
+
+    async def _iter_content(self, path: str) -> AsyncIterator[str]:
+        """Stream a text file in decoded blocks of about STREAM_BLOCK_SIZE bytes, newlines translated as open() does."""
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="replace"), translate=True)
+        async with aiofiles.open(path, "rb") as f:
+            while block := await f.read(STREAM_BLOCK_SIZE):
+                yield decoder.decode(block)
+        if tail := decoder.decode(b"", final=True):
+            yield tail
+
+    @staticmethod
+    def _strip_complete_tags(text: str) -> Tuple[str, str]:
+        """Split streamed HTML into (text with its closed tags replaced by spaces, unclosed tag left over).
+
+        Everything after the last '>' holds no tag end, so its first '<' may open a tag that
+        closes in the next block; tags before it are replaced as _strip_html would replace them.
+        """
+        open_at = text.find("<", text.rfind(">") + 1)
+        if open_at < 0:
+            return _TAG.sub(" ", text), ""
+        return _TAG.sub(" ", text[:open_at]), text[open_at:]
+
+    async def _iter_text_chunks(self, source: str) -> AsyncIterator[str]:
+        """The non-empty chunks _split_text would produce for the source, without holding the whole text.
+
+        As in index_documents, a source containing '<' and '>' goes through _strip_html first;
+        tags are stripped and whitespace collapsed as the text streams past, and chunks are cut
+        at the same offsets of the stripped text.
+        """
+        path = await self._local_path(source)
+        is_html = await asyncio.to_thread(self._has_tags, path)
+        text = ""  # stripped text not yet cut into chunks
+        pending = ""  # HTML from an unclosed '<' on, which may still turn out to be a tag
+        after_space = True  # the stripped text so far ends in a space (or is empty: a leading space is dropped)
+        async for block in self._iter_content(path):
+            if is_html:
+                block, pending = self._strip_complete_tags(pending + block)
+                block = _WHITESPACE.sub(" ", block)
+                if after_space and block.startswith(" "):
+                    block = block[1:]
+                if block:
+                    after_space = block.endswith(" ")
+            text += block
+            # with more text behind them, these characters are never removed by the final strip()
+            while len(text) > self.chunk_size:
+                chunk, text = text[: self.chunk_size].strip(), text[self.chunk_size :]
+                if chunk:
+                    yield chunk
+        if is_html:
+            # no '>' follows, so a leftover '<' is literal text
+            pending = _WHITESPACE.sub(" ", pending)
+            text = (text + (pending[1:] if after_space and pending.startswith(" ") else pending)).rstrip()
+        for chunk in self._split_text(text):
+            if chunk:
+                yield chunk
+
+    async def _iter_pdf_chunks(
+        self, pdf_file: str, page_count: int, pool: Executor, pages_per_range: int, prefetch: int
+    ) -> AsyncIterator[Tuple[List[str], float]]:
+        """Parse a PDF a page range at a time and yield each range's chunks as soon as it is ready.
+
+        Up to `prefetch` ranges are parsed ahead in the pool while earlier chunks are embedded.
+        The last chunk of a range is held back and re-split with the next range, so chunks
+        still flow across range boundaries.
+        """
+        loop = asyncio.get_running_loop()
+        splitter = MarkdownTextSplitter(chunk_size=self.chunk_size, chunk_overlap=CHUNK_OVERLAP)
+        ranges = deque((start, min(start + pages_per_range, page_count)) for start in range(0, page_count, pages_per_range))
+        in_flight: deque = deque()
+        carry = ""
+        while ranges or in_flight:
+            while ranges and len(in_flight) < prefetch:
+                start, stop = ranges.popleft()
+                in_flight.append(loop.run_in_executor(pool, _parse_pdf_pages, pdf_file, start, stop))
+            md_text, seconds = await in_flight.popleft()
+            chunks = splitter.split_text(carry + md_text)
+            carry = chunks.pop() if chunks and (ranges or in_flight) else ""
+            yield chunks, seconds
+
     def _strip_html(self, text: str) -> str:
         """Remove HTML tags and normalize whitespace."""
-        text = re.sub(r"<[^>]*>", " ", text)
-        text = re.sub(r"\s+", " ", text)
+        text = _TAG.sub(" ", text)
+        text = _WHITESPACE.sub(" ", text)
         return text.strip()
 
     def _split_text(self, text: str) -> List[str]:
@@ -74,16 +265,18 @@ class SimpleDocumentIndexer:
 
     def _extract_text_from_pdf(self, pdf_file: str):
         """Extract text and images from a PDF file into markdown format."""
-        md_text = pymupdf4llm.to_markdown(pdf_file)
-        print("Len of md_text", len(md_text))
+        with telemetry.span("parse", source=pdf_file):
+            md_text = pymupdf4llm.to_markdown(pdf_file)
+        logger.debug(f"Extracted {len(md_text)} characters of markdown from {pdf_file}")
 
         # write the text to some file in UTF8-encoding
         pathlib.Path(f"{pdf_file}.md").write_bytes(md_text.encode())
 
         # split the markdown file
-        splitter = MarkdownTextSplitter(chunk_size=self.chunk_size, chunk_overlap=20)
-        texts = splitter.create_documents([md_text])
-        print("Len of texts", len(texts))
+        with telemetry.span("chunk", source=pdf_file) as span:
+            splitter = MarkdownTextSplitter(chunk_size=self.chunk_size, chunk_overlap=CHUNK_OVERLAP)
+            texts = splitter.create_documents([md_text])
+            span.set(chunks=len(texts))
         # print(texts[1:4])
 
         return texts
@@ -91,6 +284,9 @@ class SimpleDocumentIndexer:
     async def index_documents(self, sources: List[str]) -> int:
         """Index documents into memory."""
         total_chunks = 0
+        # fetch every URL up front, concurrently, instead of one at a time inside the loop
+        urls = [source for source in sources if source.startswith(("http://", "https://"))]
+        prefetched = await self.fetcher.fetch_many(urls) if urls else {}
 
         for source in sources:
             try:
@@ -117,7 +313,10 @@ class SimpleDocumentIndexer:
                     ## print(chunks) # will print way too many things
 
                 else:
-                    content = await self._fetch_content(source)
+                    if source in prefetched:
+                        content = await prefetched[source].text()
+                    else:
+                        content = await self._fetch_content(source)
                     # images = []
 
                     # Strip HTML if content appears to be HTML
@@ -126,21 +325,366 @@ class SimpleDocumentIndexer:
 
                     chunks = self._split_text(content)
 
-                print("length of chunks",len(chunks))
-                for i, chunk in tqdm(enumerate(chunks)):
-                    metadata = {"source": source, "chunk_index": i}
-                    # if images:
-                    #     metadata["images"] = images
-                    await self.memory.add(
-                        MemoryContent(
-                            content=chunk, mime_type=MemoryMimeType.MARKDOWN, metadata=metadata
+                logger.info(f"Indexing {len(chunks)} chunks from {source}")
+                with telemetry.span("vector_write", source=source, chunks=len(chunks)):
+                    for i, chunk in tqdm(enumerate(chunks)):
+                        metadata = {"source": source, "chunk_index": i}
+                        # if images:
+                        #     metadata["images"] = images
+                        await self.memory.add(
+                            MemoryContent(
+                                content=chunk, mime_type=MemoryMimeType.MARKDOWN, metadata=metadata
+                            )
                         )
-                    )
 
                 total_chunks += len(chunks)
-                print(total_chunks)
 
             except Exception as e:
                 logger.error(f"Error indexing {source}: {e}")
 
-        return total_chunks
\ No newline at end of file
+        await self.close()
+        return total_chunks
+
+    def _get_collection(self):
+        """Return the ChromaDB collection behind the memory, or None for other Memory types."""
+        if hasattr(self.memory, "_ensure_initialized"):
+            self.memory._ensure_initialized()
+        return getattr(self.memory, "_collection", None)
+
+    def _chunk_id(self, source: str, chunk_index: int) -> str:
+        """ID under which a chunk is stored in the vector store."""
+        return str(uuid.uuid4())
+
+    async def _add_batch(self, contents: List[MemoryContent], ids: Optional[List[str]] = None) -> None:
+        """Write a batch of chunks, as one bulk embed+write when the memory is backed by ChromaDB."""
+        with telemetry.span("vector_write", chunks=len(contents)):
+            await self._write_batch(contents, ids)
+
+    async def _write_batch(self, contents: List[MemoryContent], ids: Optional[List[str]]) -> None:
+        if hasattr(self.memory, "add_batch"):
+            # e.g. HybridMemory, which also has to update its BM25 index
+            await self.memory.add_batch(contents, ids)
+            return
+        collection = self._get_collection()
+        if collection is None:
+            # generic Memory: no bulk API, fall back to one add per chunk
+            for content in contents:
+                await self.memory.add(content)
+            return
+
+        # same document/metadata layout as ChromaDBVectorMemory.add, but a single call so the
+        # embedding function sees the whole batch at once
+        documents = [str(c.content) for c in contents]
+        metadatas = [{**(c.metadata or {}), "mime_type": str(c.mime_type)} for c in contents]
+        ids = ids or [str(uuid.uuid4()) for _ in contents]
+        # upsert so that re-writing a deterministic ID (see IncrementalDocumentIndexer) replaces it
+        await asyncio.to_thread(collection.upsert, documents=documents, metadatas=metadatas, ids=ids)
+
+    async def index_documents_pipelined(
+        self,
+        sources: List[str],
+        batch_size: int = 256,
+        parse_workers: Optional[int] = None,
+        queue_size: int = 8,
+        stream_pages_over: int = 200,
+        pages_per_range: int = 16,
+        prefetch_ranges: int = 2,
+        max_rss_mb: Optional[float] = None,
+    ) -> IngestStats:
+        """Index documents in stages: parallel parsing -> batching -> bulk embed and write.
+
+        PDFs are parsed in a process pool, chunks are grouped into batches of `batch_size` and each
+        batch is embedded and written in one call. The queues between stages hold at most
+        `queue_size` items, so parsing pauses when embedding falls behind.
+
+        PDFs with more than `stream_pages_over` pages are parsed `pages_per_range` pages at a
+        time (`prefetch_ranges` ranges ahead) and their chunks flow into the batches as each
+        range finishes; text files and URLs are always streamed. With `max_rss_mb` set (and
+        psutil installed), parsing also waits while the process is above that RSS until the
+        queued batches have been written.
+        """
+        stats = IngestStats()
+        workers = parse_workers or os.cpu_count() or 1
+        parsed: asyncio.Queue = asyncio.Queue(maxsize=queue_size)  # (source, chunks, first chunk index, last part?)
+        batches: asyncio.Queue = asyncio.Queue(maxsize=queue_size)  # lists of MemoryContent
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # at most one queued document per worker on top of the ones being parsed
+            slots = asyncio.Semaphore(workers * 2)
+
+            async def wait_for_memory() -> None:
+                while max_rss_mb and not batches.empty() and (_rss_mb() or 0) > max_rss_mb:
+                    stats.memory_waits += 1
+                    await asyncio.sleep(0.05)
+
+            async def emit(source: str, chunks: List[str], seconds: float, first_index: int, last: bool) -> None:
+                stats.parse_seconds += seconds
+                # parsing and chunking happen together, in a worker process for PDFs
+                telemetry.record_stage("parse", seconds, source=source, chunks=len(chunks))
+                await wait_for_memory()
+                # blocks while the batcher is behind, which keeps this slot (and the pool) busy
+                await parsed.put((source, chunks, first_index, last))
+
+            async def parse_streaming(source: str, page_count: Optional[int]) -> None:
+                index = 0
+                if page_count is not None:
+                    parts = self._iter_pdf_chunks(source, page_count, pool, pages_per_range, prefetch_ranges)
+                    async for chunks, seconds in parts:
+                        await emit(source, chunks, seconds, index, False)
+                        index += len(chunks)
+                else:
+                    t0, chunks = time.perf_counter(), []
+                    async for chunk in self._iter_text_chunks(source):
+                        chunks.append(chunk)
+                        if len(chunks) >= batch_size:
+                            await emit(source, chunks, time.perf_counter() - t0, index, False)
+                            index += len(chunks)
+                            t0, chunks = time.perf_counter(), []
+                    await emit(source, chunks, time.perf_counter() - t0, index, False)
+                    index += len(chunks)
+                await parsed.put((source, [], index, True))
+
+            async def parse(source: str) -> None:
+                async with slots:
+                    try:
+                        if not source.endswith(".pdf"):
+                            await parse_streaming(source, None)
+                            return
+                        page_count = await loop.run_in_executor(pool, _pdf_page_count, source)
+                        if page_count > stream_pages_over:
+                            await parse_streaming(source, page_count)
+                            return
+                        chunks, seconds = await loop.run_in_executor(pool, _parse_pdf, source, self.chunk_size)
+                    except Exception as e:
+                        logger.error(f"Error indexing {source}: {e}")
+                        stats.failed_sources.append(source)
+                        # close the document for the batcher; chunks already queued are still written
+                        await parsed.put((source, [], 0, True))
+                        return
+                    await emit(source, chunks, seconds, 0, True)
+
+            async def produce() -> None:
+                await asyncio.gather(*(parse(source) for source in sources))
+                await parsed.put(None)
+
+            async def batch() -> None:
+                pending: List[MemoryContent] = []
+                pending_ids: List[str] = []
+                while (item := await parsed.get()) is not None:
+                    source, chunks, first_index, last = item
+                    if last and source not in stats.failed_sources:
+                        stats.documents += 1
+                    for i, chunk in enumerate(chunks, first_index):
+                        metadata = {"source": source, "chunk_index": i}
+                        pending.append(MemoryContent(content=chunk, mime_type=MemoryMimeType.MARKDOWN, metadata=metadata))
+                        pending_ids.append(self._chunk_id(source, i))
+                        if len(pending) >= batch_size:
+                            await batches.put((pending, pending_ids))
+                            pending, pending_ids = [], []
+                if pending:
+                    await batches.put((pending, pending_ids))
+                await batches.put(None)
+
+            async def write() -> None:
+                while (item := await batches.get()) is not None:
+                    contents, ids = item
+                    t0 = time.perf_counter()
+                    try:
+                        await self._add_batch(contents, ids)
+                    except Exception as e:
+                        logger.error(f"Error writing batch of {len(contents)} chunks: {e}")
+                        stats.failed_sources.extend({c.metadata["source"] for c in contents} - set(stats.failed_sources))
+                        continue
+                    finally:
+                        stats.write_seconds += time.perf_counter() - t0
+                    if stats.first_write_seconds is None:
+                        stats.first_write_seconds = time.perf_counter() - start
+                    stats.chunks += len(contents)
+                    stats.batches += 1
+                    for content in contents:
+                        source = content.metadata["source"]
+                        stats.chunks_by_source[source] = stats.chunks_by_source.get(source, 0) + 1
+
+            try:
+                await asyncio.gather(produce(), batch(), write())
+            finally:
+                await self.close()
+
+        stats.wall_seconds = time.perf_counter() - start
+        logger.info(stats.summary())
+        return stats
+
+
+@dataclass
+class ReindexReport:
+    """What an incremental re-index run did."""
+
+    new: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    deleted_chunks: int = 0
+    ingest: Optional[IngestStats] = None
+
+    def summary(self) -> str:
+        text = (
+            f"{len(self.new)} new, {len(self.changed)} changed, {len(self.removed)} removed, "
+            f"{self.unchanged} unchanged, {self.deleted_chunks} stale chunks deleted"
+        )
+        if self.ingest is not None:
+            text += f" | {self.ingest.summary()}"
+        return text
+
+
+class IncrementalDocumentIndexer(SimpleDocumentIndexer):
+    """Document indexer that only re-embeds new or changed sources.
+
+    Keeps a JSON manifest of every indexed source with its content hash, the chunking
+    parameters used and the IDs of its chunks. Unchanged sources are skipped (files whose
+    size and mtime match are not even re-hashed), changed sources have their old chunks
+    replaced once the new ones are written and sources missing from the run have their
+    chunks deleted. A source that fails to re-index keeps its old chunks and manifest entry.
+    Needs a ChromaDB-backed memory, since chunks are deleted by ID.
+    """
+
+    MANIFEST_VERSION = 1
+
+    def __init__(
+        self, memory: Memory, manifest_path: str, chunk_size: int = 1500, fetcher: Optional[Fetcher] = None
+    ) -> None:
+        super().__init__(memory=memory, chunk_size=chunk_size, fetcher=fetcher)
+        self.manifest_path = manifest_path
+        self.manifest: Dict[str, dict] = self._load_manifest()
+        self._hashes: Dict[str, str] = {}  # source -> content hash for the current run
+        self._file_stats: Dict[str, Tuple[int, float]] = {}  # source -> (size, mtime) when it was checked
+        self._written: Dict[str, List[str]] = {}  # source -> IDs of the chunks written in the current run
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != self.MANIFEST_VERSION:
+            logger.warning(f"Ignoring manifest {self.manifest_path} with unknown version {data.get('version')}")
+            return {}
+        return data["sources"]
+
+    def _save_manifest(self) -> None:
+        # write to a temp file and swap, so a crash never leaves a half-written manifest
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.MANIFEST_VERSION, "sources": self.manifest}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _chunking(self) -> dict:
+        return {"chunk_size": self.chunk_size, "chunk_overlap": CHUNK_OVERLAP}
+
+    def _chunk_id(self, source: str, chunk_index: int) -> str:
+        # deterministic, so a re-run after a crash overwrites instead of duplicating; keyed on the
+        # chunking too, so re-chunking unchanged content never overwrites the chunks it replaces
+        chunking = json.dumps(self._chunking(), sort_keys=True)
+        key = hashlib.sha1(f"{source}\0{self._hashes[source]}\0{chunking}".encode()).hexdigest()[:16]
+        return f"{key}-{chunk_index}"
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    async def _content_hash(self, source: str) -> str:
+        if source.startswith(("http://", "https://")):
+            # a 304 revalidation is enough when the page has not changed; the body comes from the HTTP cache
+            result = await self.fetcher.fetch(source)
+            return await asyncio.to_thread(self._hash_file, result.body_path)
+        return await asyncio.to_thread(self._hash_file, source)
+
+    async def _is_unchanged(self, source: str) -> bool:
+        """Check a source against the manifest, hashing it only if its file stats changed."""
+        entry = self.manifest.get(source)
+        same_chunking = entry is not None and entry["chunking"] == self._chunking()
+        if not source.startswith(("http://", "https://")):
+            stat = os.stat(source)
+            self._file_stats[source] = (stat.st_size, stat.st_mtime)
+            if same_chunking and (entry["size"], entry["mtime"]) == self._file_stats[source]:
+                return True
+        self._hashes[source] = await self._content_hash(source)
+        if same_chunking and entry["hash"] == self._hashes[source]:
+            # touched but not modified: remember the new stats so the next run skips the hash
+            entry["size"], entry["mtime"] = self._file_stats.get(source, (None, None))
+            return True
+        return False
+
+    async def _add_batch(self, contents: List[MemoryContent], ids: Optional[List[str]] = None) -> None:
+        await super()._add_batch(contents, ids)
+        for content, chunk_id in zip(contents, ids or []):
+            self._written.setdefault(content.metadata["source"], []).append(chunk_id)
+
+    async def _delete_chunks(self, ids: List[str]) -> None:
+        if hasattr(self.memory, "delete_ids"):
+            await self.memory.delete_ids(ids)
+            return
+        collection = self._get_collection()
+        if collection is None:
+            raise TypeError("IncrementalDocumentIndexer needs a ChromaDB-backed memory to delete chunks")
+        if ids:
+            await asyncio.to_thread(collection.delete, ids=ids)
+
+    async def reindex(self, sources: List[str], **pipeline_kwargs) -> ReindexReport:
+        """Bring the memory in line with `sources`; keyword arguments go to index_documents_pipelined."""
+        report = ReindexReport()
+        self._hashes, self._file_stats, self._written = {}, {}, {}
+        to_index: List[str] = []
+
+        for source in sources:
+            try:
+                if await self._is_unchanged(source):
+                    report.unchanged += 1
+                    continue
+            except Exception as e:
+                logger.error(f"Error checking {source}: {e}")
+                continue
+            (report.changed if source in self.manifest else report.new).append(source)
+            to_index.append(source)
+
+        current = set(sources)
+        report.removed = [source for source in self.manifest if source not in current]
+        for source in report.removed:
+            ids = self.manifest[source]["chunk_ids"]
+            await self._delete_chunks(ids)
+            report.deleted_chunks += len(ids)
+            del self.manifest[source]
+        self._save_manifest()
+
+        if to_index:
+            # a changed source's old chunks stay searchable until its new ones are written; chunk IDs
+            # derive from the content hash, so a crash here leaves the old entry to be replaced next run
+            report.ingest = await self.index_documents_pipelined(to_index, **pipeline_kwargs)
+            for source in to_index:
+                old_ids = set(self.manifest.get(source, {}).get("chunk_ids", []))
+                new_ids = self._written.get(source, [])
+                if source in report.ingest.failed_sources:
+                    # drop what was written of the new version and keep serving the old one
+                    await self._delete_chunks([i for i in new_ids if i not in old_ids])
+                    continue
+                stale = list(old_ids.difference(new_ids))
+                await self._delete_chunks(stale)
+                report.deleted_chunks += len(stale)
+                size, mtime = self._file_stats.get(source, (None, None))
+                self.manifest[source] = {
+                    "hash": self._hashes[source],
+                    "size": size,
+                    "mtime": mtime,
+                    "chunking": self._chunking(),
+                    "chunk_ids": new_ids,
+                }
+            self._save_manifest()
+
+        await self.close()
+        logger.info(report.summary())
+        return report
@@ -0,0 +1,403 @@
+import os
+import time
+import uuid
+import hashlib
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from autogen_core import CancellationToken
+from autogen_core.memory import Memory, MemoryContent, MemoryMimeType, MemoryQueryResult, UpdateContextResult
+from autogen_core.model_context import ChatCompletionContext
+from autogen_core.models import SystemMessage
+from autogen_ext.memory.chromadb import ChromaDBVectorMemory
+
+from context_packing import ContextPacker
+from reranking import AdaptiveReranker
+from hybrid_retrieval import BM25Index, hybrid_search
+from snapshots import ReadOnlySnapshotError, Snapshot, import_collection
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def collection_fingerprint(collection) -> str:
+    """Digest of a ChromaDB collection's chunk IDs.
+
+    The indexers derive chunk IDs from the source's content hash (or draw fresh UUIDs on a
+    full re-index), so this changes whenever the indexed content does, whichever process
+    wrote it. Only IDs are read, no documents or embeddings.
+    """
+    ids = sorted(collection.get(include=[])["ids"])
+    return hashlib.sha1("\0".join(ids).encode()).hexdigest()[:16]
+
+
+class CollectionFingerprint:
+    """collection_fingerprint, recomputed only when it may have changed.
+
+    Reading every ID is O(collection), too much to pay on each chat turn. The digest is
+    reused while the collection's count() and the caller's `version` (e.g. a write counter)
+    are unchanged, and recomputed at least every `max_age` seconds, so a same-size
+    re-index by another process is noticed within that time.
+    """
+
+    def __init__(self, max_age: float = 30.0) -> None:
+        self.max_age = max_age
+        self._key: Optional[Tuple[int, int]] = None
+        self._digest = ""
+        self._computed_at = 0.0
+
+    def __call__(self, collection, version: int = 0) -> str:
+        key = (collection.count(), version)
+        if key != self._key or time.monotonic() - self._computed_at > self.max_age:
+            self._digest = collection_fingerprint(collection)
+            self._key, self._computed_at = key, time.monotonic()
+        return self._digest
+
+
+class RetrievalMemory(Memory):
+    """Shared query path of the memories below: retrieve, optionally rerank, then pack the context.
+
+    Subclasses implement `_query(query_text, k)`. With a `reranker`, `reranker.candidates`
+    chunks are fetched and rescored by its cross-encoder, and between one and `k` of them
+    are kept, cut where the scores drop off. With a `packer`, the context injected into the
+    agent is deduplicated and held to the packer's token budget; twice `k` chunks are
+    fetched so near-duplicates can be replaced (cap the injected chunks with the packer's
+    `max_chunks`).
+
+    `query_batch()` and `context_batch()` serve batch jobs: the queries are embedded and
+    searched together (subclasses override `_query_batch`), then reranked and packed one by one.
+    """
+
+    k: int
+    packer: Optional[ContextPacker] = None
+    reranker: Optional[AdaptiveReranker] = None
+
+    async def _query(self, query_text: str, k: int) -> MemoryQueryResult:
+        raise NotImplementedError
+
+    async def query(
+        self,
+        query: str | MemoryContent,
+        cancellation_token: CancellationToken | None = None,
+        **kwargs: Any,
+    ) -> MemoryQueryResult:
+        query_text = query if isinstance(query, str) else str(query.content)
+        k = kwargs.get("k", self.k)
+        fetch_k = max(k, self.reranker.candidates) if self.reranker is not None else k
+        with telemetry.span("retrieve", pipeline="autogen", top_k=fetch_k) as span:
+            results = await self._query(query_text, fetch_k)
+            span.set(results=len(results.results))
+        return await self._rerank(query_text, results, k)
+
+    async def _query_batch(self, query_texts: List[str], k: int) -> List[MemoryQueryResult]:
+        return list(await asyncio.gather(*(self._query(text, k) for text in query_texts)))
+
+    async def query_batch(self, query_texts: List[str], k: Optional[int] = None) -> List[MemoryQueryResult]:
+        """query() for many queries, retrieved together."""
+        k = k or self.k
+        fetch_k = max(k, self.reranker.candidates) if self.reranker is not None else k
+        with telemetry.span("retrieve_batch", pipeline="autogen", queries=len(query_texts), top_k=fetch_k):
+            results = await self._query_batch(list(query_texts), fetch_k)
+        return [await self._rerank(text, result, k) for text, result in zip(query_texts, results)]
+
+    async def _rerank(self, query_text: str, results: MemoryQueryResult, k: int) -> MemoryQueryResult:
+        if self.reranker is None or not results.results:
+            return results
+        with telemetry.span("rerank", pipeline="autogen") as span:
+            reranked = await asyncio.to_thread(
+                self.reranker.rerank, query_text, results.results, lambda memory: str(memory.content), k
+            )
+            span.set(**reranked.stats())
+        return MemoryQueryResult(results=[
+            memory.model_copy(update={"metadata": {**(memory.metadata or {}), "score": score}})
+            for memory, score in zip(reranked.items, reranked.scores)
+        ])
+
+    def _pack(self, candidates: MemoryQueryResult) -> Tuple[MemoryQueryResult, List[str]]:
+        with telemetry.span("context_build", pipeline="autogen") as span:
+            packed = self.packer.pack(
+                candidates.results, lambda memory: str(memory.content), score=lambda memory: memory.metadata.get("score")
+            )
+            span.set(**packed.stats())
+        telemetry.count("context_tokens_total", packed.tokens, pipeline="autogen")
+        logger.debug(f"Memory context: {packed.stats()}")
+        return MemoryQueryResult(results=packed.items), packed.texts
+
+    @staticmethod
+    def format_context(contents: List[str]) -> str:
+        """The system message injected into the agent's context (empty when nothing was retrieved)."""
+        if not contents:
+            return ""
+        memory_strings = [f"{i}. {content}" for i, content in enumerate(contents, 1)]
+        return "\nRelevant memory content:\n" + "\n".join(memory_strings)
+
+    async def context_batch(self, query_texts: List[str]) -> List[Tuple[MemoryQueryResult, List[str]]]:
+        """The memories and chunk texts update_context() would inject for each query, retrieved together."""
+        if self.packer is None:
+            results = await self.query_batch(query_texts)
+            return [(result, [str(memory.content) for memory in result.results]) for result in results]
+        return [self._pack(candidates) for candidates in await self.query_batch(query_texts, k=self.k * 2)]
+
+    async def update_context(self, model_context: ChatCompletionContext) -> UpdateContextResult:
+        # same context injection as ChromaDBVectorMemory, with our results
+        messages = await model_context.get_messages()
+        if not messages:
+            return UpdateContextResult(memories=MemoryQueryResult(results=[]))
+        last_message = messages[-1]
+        query_text = last_message.content if isinstance(last_message.content, str) else str(last_message)
+        if self.packer is None:
+            query_results = await self.query(query_text)
+            contents = [str(memory.content) for memory in query_results.results]
+        else:
+            query_results, contents = self._pack(await self.query(query_text, k=self.k * 2))
+        if contents:
+            await model_context.add_message(SystemMessage(content=self.format_context(contents)))
+        return UpdateContextResult(memories=query_results)
+
+
+class HybridMemory(RetrievalMemory):
+    """ChromaDB vector memory plus a BM25 index over the same chunks, fused with reciprocal-rank fusion.
+
+    Dense and lexical search run concurrently, each fetching `candidate_k` candidates, and the
+    `k` best fused chunks are returned. Dense candidates scoring below the wrapped memory's
+    `score_threshold` are dropped before fusion, as its own query() would drop them; BM25 hits
+    have no comparable score and are kept on their rank. The BM25 index is persisted to `bm25_path`, updated as
+    chunks are added or deleted through this memory, and re-synced against the collection
+    whenever their sizes disagree (e.g. after another process wrote to the collection).
+    Reranking and context packing work as described in RetrievalMemory.
+    """
+
+    def __init__(
+        self,
+        memory: ChromaDBVectorMemory,
+        bm25_path: str,
+        k: int = 3,
+        candidate_k: int = 20,
+        rrf_k: int = 60,
+        packer: Optional[ContextPacker] = None,
+        reranker: Optional[AdaptiveReranker] = None,
+    ) -> None:
+        self.memory = memory
+        self.bm25_path = bm25_path
+        self.k = k
+        self.candidate_k = candidate_k
+        self.rrf_k = rrf_k
+        self.packer = packer
+        self.reranker = reranker
+        self._bm25: Optional[BM25Index] = None
+        self._bm25_lock = asyncio.Lock()
+        self._dirty = False
+        self._writes = 0
+        self._fingerprint = CollectionFingerprint()
+
+    def _get_collection(self):
+        self.memory._ensure_initialized()
+        return self.memory._collection
+
+    def _sync_bm25(self, bm25: BM25Index) -> bool:
+        """Diff BM25 against the collection's IDs and fetch only the missing chunks."""
+        collection = self._get_collection()
+        ids = set(collection.get(include=[])["ids"])
+        stale = [doc_id for doc_id in bm25.ids() if doc_id not in ids]
+        for doc_id in stale:
+            bm25.remove(doc_id)
+        missing = [doc_id for doc_id in ids if doc_id not in bm25]
+        for start in range(0, len(missing), 1000):
+            batch = collection.get(ids=missing[start : start + 1000], include=["documents"])
+            bm25.add_many(zip(batch["ids"], batch["documents"]))
+        if stale or missing:
+            logger.info(f"BM25 index synced: {len(missing)} chunks added, {len(stale)} removed")
+        return bool(stale or missing)
+
+    async def _ensure_bm25(self) -> BM25Index:
+        async with self._bm25_lock:
+            if self._bm25 is None:
+                self._bm25 = BM25Index.load(self.bm25_path) if os.path.exists(self.bm25_path) else BM25Index()
+                self._dirty = await asyncio.to_thread(self._sync_bm25, self._bm25)
+            elif await asyncio.to_thread(self._get_collection().count) != len(self._bm25):
+                self._dirty = await asyncio.to_thread(self._sync_bm25, self._bm25) or self._dirty
+            if self._dirty:
+                await asyncio.to_thread(self.save)
+            return self._bm25
+
+    def fingerprint(self) -> str:
+        """Changes whenever the indexed content changes; used to invalidate answer caches.
+
+        Derived from the collection's chunk IDs (see CollectionFingerprint), so re-indexing by
+        another process is noticed too; writes through this memory also bump a counter, which
+        covers chunks upserted again under the same ID.
+        """
+        return f"{self._fingerprint(self._get_collection(), self._writes)}:{self._writes}"
+
+    def save(self) -> None:
+        if self._bm25 is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.bm25_path)), exist_ok=True)
+            self._bm25.save(self.bm25_path)
+            self._dirty = False
+
+    async def _query(self, query_text: str, k: int) -> MemoryQueryResult:
+        bm25 = await self._ensure_bm25()
+        collection = self._get_collection()
+        found: Dict[str, tuple] = {}  # id -> (document, metadata), filled by the dense search
+
+        async def dense_search(text: str) -> List[str]:
+            n_results = min(self.candidate_k, collection.count()) or 1
+            result = await asyncio.to_thread(
+                collection.query, query_texts=[text], n_results=n_results, include=["documents", "metadatas", "distances"]
+            )
+            ids = self._above_threshold(result["ids"][0], result["distances"][0])
+            for doc_id, document, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0]):
+                if doc_id in ids:
+                    found[doc_id] = (document, metadata)
+            return ids
+
+        return await self._fused(query_text, bm25, dense_search, found, k)
+
+    async def _query_batch(self, query_texts: List[str], k: int) -> List[MemoryQueryResult]:
+        """All queries embedded in one call and searched in one collection query, then fused with BM25 one by one."""
+        bm25 = await self._ensure_bm25()
+        collection = self._get_collection()
+        n_results = min(self.candidate_k, await asyncio.to_thread(collection.count)) or 1
+        result = await asyncio.to_thread(
+            collection.query, query_texts=query_texts, n_results=n_results, include=["documents", "metadatas", "distances"]
+        )
+        found: Dict[str, tuple] = {}
+        dense: Dict[str, List[str]] = {}
+        rows = zip(query_texts, result["ids"], result["documents"], result["metadatas"], result["distances"])
+        for text, ids, documents, metadatas, distances in rows:
+            dense[text] = self._above_threshold(ids, distances)
+            found.update((doc_id, row) for doc_id, row in zip(ids, zip(documents, metadatas)) if doc_id in dense[text])
+
+        async def dense_search(text: str) -> List[str]:
+            return dense[text]
+
+        return [await self._fused(text, bm25, dense_search, found, k) for text in query_texts]
+
+    def _above_threshold(self, ids: List[str], distances: List[float]) -> List[str]:
+        """Dense hits scoring at least the wrapped memory's score_threshold, as its own query() would keep."""
+        threshold = self.memory._config.score_threshold
+        if threshold is None:
+            return ids
+        return [doc_id for doc_id, distance in zip(ids, distances) if self.memory._calculate_score(distance) >= threshold]
+
+    async def _fused(
+        self,
+        query_text: str,
+        bm25: BM25Index,
+        dense_search: Callable[[str], Awaitable[List[str]]],
+        found: Dict[str, tuple],
+        k: int,
+    ) -> MemoryQueryResult:
+        fused = await hybrid_search(query_text, bm25, dense_search, top_k=k, candidate_k=self.candidate_k, rrf_k=self.rrf_k)
+        lexical_only = [doc_id for doc_id, _ in fused if doc_id not in found]
+        if lexical_only:
+            result = await asyncio.to_thread(self._get_collection().get, ids=lexical_only, include=["documents", "metadatas"])
+            found.update((doc_id, (document, metadata)) for doc_id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"]))
+
+        results = []
+        for doc_id, score in fused:
+            if doc_id not in found:
+                continue
+            document, metadata = found[doc_id]
+            metadata = dict(metadata or {})
+            mime_type = metadata.pop("mime_type", MemoryMimeType.TEXT)
+            results.append(MemoryContent(content=document, mime_type=mime_type, metadata={**metadata, "id": doc_id, "score": score}))
+        return MemoryQueryResult(results=results)
+
+    async def add_batch(self, contents: List[MemoryContent], ids: Optional[List[str]] = None) -> None:
+        """Embed and write a batch in one call, keeping the BM25 index in step."""
+        ids = ids or [str(uuid.uuid4()) for _ in contents]
+        documents = [str(c.content) for c in contents]
+        metadatas = [{**(c.metadata or {}), "mime_type": str(c.mime_type)} for c in contents]
+        await asyncio.to_thread(self._get_collection().upsert, documents=documents, metadatas=metadatas, ids=ids)
+        self._writes += 1
+        if self._bm25 is not None:
+            self._bm25.add_many(zip(ids, documents))
+            self._dirty = True
+
+    async def add(self, content: MemoryContent, cancellation_token: CancellationToken | None = None) -> None:
+        await self.add_batch([content])
+
+    async def delete_ids(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        await asyncio.to_thread(self._get_collection().delete, ids=ids)
+        self._writes += 1
+        if self._bm25 is not None:
+            for doc_id in ids:
+                self._bm25.remove(doc_id)
+            self._dirty = True
+
+    async def clear(self) -> None:
+        await self.memory.clear()
+        self._writes += 1
+        self._bm25 = BM25Index()
+        self.save()
+
+    async def import_snapshot(self, snapshot: Snapshot) -> int:
+        """Bulk-load a snapshot's chunks with their embeddings into the collection; nothing is re-embedded."""
+        rows = await asyncio.to_thread(import_collection, snapshot, self._get_collection())
+        self._writes += 1
+        async with self._bm25_lock:
+            # reloaded and synced against the collection on the next query
+            self._bm25 = None
+        return rows
+
+    async def close(self) -> None:
+        if self._dirty:
+            self.save()
+        await self.memory.close()
+
+
+class SnapshotMemory(RetrievalMemory):
+    """Read-only memory served straight from a memory-mapped snapshot file.
+
+    For replicas that only answer questions: queries are embedded with `embedding_function`
+    (the model the snapshot was exported with) and searched exactly over the mapped vectors,
+    without loading ChromaDB or re-embedding anything. Dense search only; reranking and
+    context packing work as in RetrievalMemory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function,
+        k: int = 3,
+        packer: Optional[ContextPacker] = None,
+        reranker: Optional[AdaptiveReranker] = None,
+        verify: bool = True,
+    ) -> None:
+        self.snapshot = Snapshot.open(path, verify=verify)
+        self.embedding_function = embedding_function
+        self.k = k
+        self.packer = packer
+        self.reranker = reranker
+        logger.info(f"Serving memory from snapshot {self.snapshot.info.summary()}")
+
+    def fingerprint(self) -> str:
+        return self.snapshot.fingerprint()
+
+    async def _query(self, query_text: str, k: int) -> MemoryQueryResult:
+        vector = (await asyncio.to_thread(self.embedding_function, [query_text]))[0]
+        return self._results(self.snapshot.search(vector, k))
+
+    async def _query_batch(self, query_texts: List[str], k: int) -> List[MemoryQueryResult]:
+        vectors = await asyncio.to_thread(self.embedding_function, query_texts)
+        return [self._results(hits) for hits in self.snapshot.search_batch(vectors, k)]
+
+    def _results(self, hits: List[Tuple[int, float]]) -> MemoryQueryResult:
+        results = []
+        for (doc_id, document, metadata), (_, score) in zip(self.snapshot.rows([row for row, _ in hits]), hits):
+            mime_type = metadata.pop("mime_type", MemoryMimeType.TEXT)
+            results.append(MemoryContent(content=document, mime_type=mime_type, metadata={**metadata, "id": doc_id, "score": score}))
+        return MemoryQueryResult(results=results)
+
+    async def add(self, content: MemoryContent, cancellation_token: CancellationToken | None = None) -> None:
+        raise ReadOnlySnapshotError("SnapshotMemory is read-only; import the snapshot into a ChromaDB memory to modify it")
+
+    async def clear(self) -> None:
+        raise ReadOnlySnapshotError("SnapshotMemory is read-only; import the snapshot into a ChromaDB memory to modify it")
+
+    async def close(self) -> None:
+        self.snapshot.close()
@@ -0,0 +1,211 @@
+"""Long-lived async chat service for the Y-BOCS agent team.
+
+One process holds a single shared Ollama model client (with its pooled HTTP connections) and a
+single shared vector memory. Each chat session gets its own team, rebuilt per request from the
+state saved after its previous turn. Concurrent model runs are capped and excess requests wait
+in a bounded queue; when the queue is full the service answers 503.
+
+    python -m autogen_ybocs_rag.server --port 8765 --max-concurrent 4 --max-queue 32
+
+POST /chat {"session_id": ..., "message": ...} streams NDJSON lines (session IDs are 1-64
+letters, digits, "_" or "-"):
+    {"type": "chunk", "content": ...}    partial model output
+    {"type": "message", "content": ...}  a complete message, as yielded by orchestrate()
+    {"type": "error", "content": ...}
+
+GET /health reports queue and concurrency counters, GET /metrics the telemetry (see telemetry.py).
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+from typing import Any, Mapping, Optional
+
+from aiohttp import web
+
+import telemetry
+from autogen_ybocs_rag.agents import ANSWER_CACHE, StreamChunk, get_answer_cache, get_model_client, get_retrieval_memory, orchestrate, teamConfig
+
+logger = logging.getLogger(__name__)
+
+# session IDs name files under --sessions-dir, so they must not carry path separators or dots
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def _check_session_id(session_id: Any) -> str:
+    if not isinstance(session_id, str) or not SESSION_ID.fullmatch(session_id):
+        raise web.HTTPBadRequest(text="session_id must be 1-64 letters, digits, '_' or '-'")
+    return session_id
+
+
+class SessionStore:
+    """Saved team state per session: an LRU in memory, optionally mirrored to JSON files."""
+
+    def __init__(self, max_sessions: int = 1000, persist_dir: Optional[str] = None) -> None:
+        self.max_sessions = max_sessions
+        self.persist_dir = persist_dir
+        self._states: "OrderedDict[str, Mapping[str, Any]]" = OrderedDict()
+        self._locks: dict = {}
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.persist_dir, f"{session_id}.json")
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Turns within one session run one at a time."""
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    def get(self, session_id: str) -> Optional[Mapping[str, Any]]:
+        if session_id in self._states:
+            self._states.move_to_end(session_id)
+            return self._states[session_id]
+        if self.persist_dir and os.path.exists(self._path(session_id)):
+            with open(self._path(session_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def put(self, session_id: str, state: Mapping[str, Any]) -> None:
+        self._states[session_id] = state
+        self._states.move_to_end(session_id)
+        while len(self._states) > self.max_sessions:
+            evicted, _ = self._states.popitem(last=False)
+            if not self.lock(evicted).locked():
+                self._locks.pop(evicted, None)
+        if self.persist_dir:
+            with open(self._path(session_id), "w", encoding="utf-8") as f:
+                json.dump(state, f, default=str)
+
+    def delete(self, session_id: str) -> None:
+        self._states.pop(session_id, None)
+        self._locks.pop(session_id, None)
+        if self.persist_dir and os.path.exists(self._path(session_id)):
+            os.remove(self._path(session_id))
+
+
+class ChatService:
+    """Runs team turns with bounded concurrency on top of the shared client and memory."""
+
+    def __init__(self, sessions: SessionStore, max_concurrent: int = 4, max_queue: int = 32) -> None:
+        self.sessions = sessions
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+
+    def is_full(self) -> bool:
+        return self.waiting >= self.max_queue
+
+    async def run_turn(self, session_id: str, message: str):
+        """Yield the messages of one team turn for a session, waiting for a free slot first."""
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            async with self.sessions.lock(session_id):
+                team = teamConfig()
+                state = self.sessions.get(session_id)
+                if state is not None:
+                    await team.load_state(state)
+                async for item in orchestrate(team, message, stream=True):
+                    yield item
+                self.sessions.put(session_id, await team.save_state())
+            self.completed += 1
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+
+async def chat(request: web.Request) -> web.StreamResponse:
+    service: ChatService = request.app["service"]
+    body = await request.json()
+    if not isinstance(body, dict) or not body.get("session_id") or not body.get("message"):
+        raise web.HTTPBadRequest(text="session_id and message are required")
+    session_id, message = _check_session_id(body["session_id"]), body["message"]
+    if service.is_full():
+        raise web.HTTPServiceUnavailable(text="Too many queued requests, try again shortly")
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    try:
+        async for item in service.run_turn(session_id, message):
+            kind = "chunk" if isinstance(item, StreamChunk) else "message"
+            await response.write((json.dumps({"type": kind, "content": str(item)}) + "\n").encode())
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        logger.exception(f"Error in session {session_id}")
+        await response.write((json.dumps({"type": "error", "content": str(e)}) + "\n").encode())
+    await response.write_eof()
+    return response
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    request.app["service"].sessions.delete(_check_session_id(request.match_info["session_id"]))
+    return web.Response(status=204)
+
+
+async def health(request: web.Request) -> web.Response:
+    service: ChatService = request.app["service"]
+    return web.json_response({
+        "active": service.active,
+        "waiting": service.waiting,
+        "completed": service.completed,
+        "max_concurrent": service.max_concurrent,
+        "max_queue": service.max_queue,
+        "answer_cache": get_answer_cache().stats() if ANSWER_CACHE else None,
+    })
+
+
+async def metrics(request: web.Request) -> web.Response:
+    # Prometheus text format; empty unless YBOCS_TELEMETRY=1
+    return web.Response(text=telemetry.prometheus_text(), content_type="text/plain")
+
+
+async def _warm_up(app: web.Application) -> None:
+    # create the shared client and memory once, before the first request pays for it
+    get_model_client()
+    get_retrieval_memory()
+    if ANSWER_CACHE:
+        get_answer_cache()
+
+
+async def _shutdown(app: web.Application) -> None:
+    await get_retrieval_memory().close()
+    await get_model_client().close()
+
+
+def create_app(max_concurrent: int = 4, max_queue: int = 32, persist_dir: Optional[str] = None) -> web.Application:
+    app = web.Application()
+    app["service"] = ChatService(SessionStore(persist_dir=persist_dir), max_concurrent=max_concurrent, max_queue=max_queue)
+    app.router.add_post("/chat", chat)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(_warm_up)
+    app.on_cleanup.append(_shutdown)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the Y-BOCS agent team over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-concurrent", type=int, default=4, help="model runs in flight at once")
+    parser.add_argument("--max-queue", type=int, default=32, help="requests allowed to wait for a slot")
+    parser.add_argument("--sessions-dir", help="also persist session state as JSON files here")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(args.max_concurrent, args.max_queue, args.sessions_dir), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""Answer a JSONL file of questions in bulk with either pipeline.
+
+    python batch_qa.py questions.jsonl answers.jsonl --pipeline llm_pdf --concurrency 4
+
+Each input line is a JSON object with a "question" and optionally an "id" (the hash of the
+question text otherwise); its other fields are copied to the output line. Questions are
+processed in batches: a batch is embedded in one call and searched in one vectorized pass,
+questions that retrieved the same chunks are grouped so their context is packed once and
+sent to the model back to back (the shared prompt prefix stays in Ollama's cache), and at
+most `--concurrency` model calls are in flight. Retrieval of the next batch overlaps with
+the model calls of the current one.
+
+Answers are appended to the output file as soon as they arrive and flushed to disk, one
+JSON line each. Rerunning the same command skips the questions already answered, so a
+crashed or interrupted run resumes where it stopped; questions that failed are retried.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Sequence, Set
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+PIPELINES = ("llm_pdf", "autogen")
+
+
+@dataclass
+class Question:
+    id: str
+    text: str
+    record: dict  # the input line, copied to the output
+
+
+def load_questions(path: str) -> List[Question]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = record.get("question")
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError(f"{path}:{line_number}: expected a non-empty \"question\" field")
+            question_id = str(record.get("id") or hashlib.sha256(text.encode()).hexdigest()[:16])
+            questions.append(Question(question_id, text, record))
+    return questions
+
+
+class ResultWriter:
+    """Append-only JSONL output that knows which question IDs it already holds.
+
+    A torn last line (the process died mid-write) is cut off when the file is opened, and
+    every record is flushed and fsynced, so the file only ever holds complete answers.
+    """
+
+    def __init__(self, path: str, fsync: bool = True) -> None:
+        self.path = path
+        self.fsync = fsync
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            self._recover()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _recover(self) -> None:
+        valid = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    self.done.add(str(json.loads(line)["id"]))
+                except (ValueError, KeyError):
+                    break
+                valid += len(line)
+        if valid < os.path.getsize(self.path):
+            logger.warning(f"Truncating {self.path} after its last complete answer ({len(self.done)} answers)")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid)
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.done.add(str(record["id"]))
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def group_by_context(keys: Sequence[Hashable]) -> List[List[int]]:
+    """Indices of equal keys grouped together, groups in order of first appearance."""
+    groups: Dict[Hashable, List[int]] = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+
+@dataclass
+class BatchStats:
+    questions: int = 0
+    skipped: int = 0  # already in the output file
+    answered: int = 0
+    failed: List[str] = field(default_factory=list)
+    groups: int = 0
+    retrieval_s: float = 0.0
+    wall_s: float = 0.0
+
+    def summary(self) -> dict:
+        return {
+            "questions": self.questions,
+            "skipped": self.skipped,
+            "answered": self.answered,
+            "failed": len(self.failed),
+            "groups": self.groups,
+            "retrieval_s": round(self.retrieval_s, 3),
+            "wall_s": round(self.wall_s, 3),
+            "answers_per_s": round(self.answered / self.wall_s, 3) if self.wall_s else 0.0,
+        }
+
+
+class BatchPipeline:
+    """What run_batch() needs from a pipeline.
+
+    `retrieve` returns one retrieval result per question, for the whole batch at once;
+    questions whose results have the same `context_key` share the context built by
+    `prepare`; `answer` returns the fields written to the output for one question.
+    """
+
+    async def retrieve(self, questions: List[str]) -> List[Any]:
+        raise NotImplementedError
+
+    def context_key(self, retrieved: Any) -> Hashable:
+        raise NotImplementedError
+
+    async def prepare(self, retrieved: Any) -> Any:
+        return retrieved
+
+    async def answer(self, question: str, context: Any, retrieved: Any) -> dict:
+        raise NotImplementedError
+
+
+class LlmPdfPipeline(BatchPipeline):
+    """Batch path through a MultimodalQueryEngine (see llm-multimodal-rag/llm_pdf.py)."""
+
+    def __init__(self, engine) -> None:
+        self.engine = engine
+
+    async def retrieve(self, questions: List[str]) -> List[Any]:
+        return await asyncio.to_thread(self.engine.retrieve_batch, questions)
+
+    def context_key(self, retrieved: Any) -> Hashable:
+        nodes, _ = retrieved
+        return frozenset(n.node.node_id for n in nodes)
+
+    async def prepare(self, retrieved: Any) -> Any:
+        nodes, _ = retrieved
+        return await self.engine.aprepare(nodes)
+
+    async def answer(self, question: str, context: Any, retrieved: Any) -> dict:
+        response = await self.engine.aanswer(question, context, retrieval_hit=retrieved[1])
+        return {
+            "answer": response.response,
+            "sources": [
+                {"file_name": n.metadata.get("file_name"), "page": n.metadata.get("page_num"), "score": n.score}
+                for n in response.source_nodes
+            ],
+            "cache": response.metadata["cache"],
+            "prompt_tokens": response.metadata["context"]["prompt_tokens"],
+        }
+
+
+class AutogenPipeline(BatchPipeline):
+    """Batch path over the autogen retrieval memory (see autogen_ybocs_rag/agents.py).
+
+    Each question gets the same system prompt and injected memory context as the chatbot
+    agent's first turn, answered in a single model call instead of a team run.
+    """
+
+    def __init__(self, memory, model_client, system_message: str) -> None:
+        self.memory = memory
+        self.model_client = model_client
+        self.system_message = system_message
+
+    async def retrieve(self, questions: List[str]) -> List[Any]:
+        if hasattr(self.memory, "context_batch"):
+            return await self.memory.context_batch(questions)
+        # a plain ChromaDBVectorMemory: one query per question
+        results = await asyncio.gather(*(self.memory.query(question) for question in questions))
+        return [(result, [str(memory.content) for memory in result.results]) for result in results]
+
+    def context_key(self, retrieved: Any) -> Hashable:
+        _, contents = retrieved
+        return tuple(contents)
+
+    async def answer(self, question: str, context: Any, retrieved: Any) -> dict:
+        from autogen_core.models import SystemMessage, UserMessage
+        from autogen_ybocs_rag.memory import RetrievalMemory
+
+        memories, contents = retrieved
+        messages = [SystemMessage(content=self.system_message), UserMessage(content=question, source="user")]
+        if contents:
+            messages.append(SystemMessage(content=RetrievalMemory.format_context(contents)))
+        with telemetry.span("llm_total", pipeline="autogen"):
+            result = await self.model_client.create(messages)
+        telemetry.count("llm_tokens_total", result.usage.prompt_tokens, pipeline="autogen", kind="prompt")
+        telemetry.count("llm_tokens_total", result.usage.completion_tokens, pipeline="autogen", kind="completion")
+        return {
+            "answer": str(result.content).replace("TERMINATE", "").strip(),
+            "sources": [
+                {"source": (memory.metadata or {}).get("source"), "score": (memory.metadata or {}).get("score")}
+                for memory in memories.results
+            ],
+            "prompt_tokens": result.usage.prompt_tokens,
+        }
+
+
+async def run_batch(
+    questions: Sequence[Question],
+    pipeline: BatchPipeline,
+    writer: ResultWriter,
+    batch_size: int = 64,
+    concurrency: int = 4,
+    max_group: int = 8,
+) -> BatchStats:
+    """Answer the questions not yet in `writer`, writing each answer as soon as it arrives.
+
+    Questions of a context group run one after another on one model slot, in runs of at
+    most `max_group`, so a large group does not serialize the whole batch.
+    """
+    stats = BatchStats(questions=len(questions))
+    pending, seen = [], set(writer.done)
+    for question in questions:
+        if question.id in seen:
+            stats.skipped += 1
+        else:
+            seen.add(question.id)
+            pending.append(question)
+    if stats.skipped:
+        logger.info(f"Resuming: {stats.skipped} of {len(questions)} questions already answered in {writer.path}")
+
+    slots = asyncio.Semaphore(concurrency)
+    previous: List[asyncio.Task] = []
+    start = time.perf_counter()
+
+    async def answer_run(run: List[Question], context: Any, retrieved: List[Any]) -> None:
+        async with slots:
+            for question, result in zip(run, retrieved):
+                t = time.perf_counter()
+                try:
+                    fields = await pipeline.answer(question.text, context, result)
+                except Exception as e:
+                    # left out of the output, so the next run retries it
+                    logger.error(f"Question {question.id} failed: {e!r}")
+                    stats.failed.append(question.id)
+                    continue
+                writer.write({**question.record, "id": question.id, **fields, "latency_s": round(time.perf_counter() - t, 3)})
+                stats.answered += 1
+
+    async def answer_group(group: List[Question], retrieved: List[Any]) -> None:
+        try:
+            context = await pipeline.prepare(retrieved[0])
+        except Exception as e:
+            logger.error(f"Building the context of {len(group)} questions failed: {e!r}")
+            stats.failed.extend(question.id for question in group)
+            return
+        await asyncio.gather(*(
+            answer_run(group[i : i + max_group], context, retrieved[i : i + max_group])
+            for i in range(0, len(group), max_group)
+        ))
+
+    for batch_start in range(0, len(pending), batch_size):
+        batch = pending[batch_start : batch_start + batch_size]
+        t = time.perf_counter()
+        try:
+            with telemetry.span("batch_retrieve", questions=len(batch)):
+                retrieved = await pipeline.retrieve([question.text for question in batch])
+        except Exception as e:
+            # like a failed answer: the batch is left out of the output and retried on the next run
+            logger.error(f"Retrieval for questions {batch_start + 1}-{batch_start + len(batch)} failed: {e!r}")
+            stats.failed.extend(question.id for question in batch)
+            continue
+        finally:
+            stats.retrieval_s += time.perf_counter() - t
+        groups = group_by_context([pipeline.context_key(result) for result in retrieved])
+        stats.groups += len(groups)
+        current = [
+            asyncio.create_task(answer_group([batch[i] for i in group], [retrieved[i] for i in group])) for group in groups
+        ]
+        # the next batch is retrieved while this one is answered, never further ahead
+        await asyncio.gather(*previous)
+        previous = current
+        logger.info(f"Retrieved {batch_start + len(batch)}/{len(pending)} questions, {stats.answered} answered")
+    await asyncio.gather(*previous)
+    stats.wall_s = time.perf_counter() - start
+    return stats
+
+
+def get_pipeline(name: str) -> BatchPipeline:
+    if name == "llm_pdf":
+        sys.path.insert(0, str(Path(__file__).resolve().parent / "llm-multimodal-rag"))
+        import llm_pdf
+
+        return LlmPdfPipeline(llm_pdf.get_query_engine())
+    if name == "autogen":
+        from autogen_ybocs_rag import agents
+        from system_prompt import BASIC_PROMPT
+
+        return AutogenPipeline(agents.get_retrieval_memory(), agents.get_model_client(), BASIC_PROMPT)
+    raise ValueError(f"Unknown pipeline {name!r}, expected one of {PIPELINES}")
+
+
+async def run(args) -> BatchStats:
+    questions = load_questions(args.questions)
+    pipeline = get_pipeline(args.pipeline)
+    with ResultWriter(args.output, fsync=not args.no_fsync) as writer:
+        return await run_batch(questions, pipeline, writer, args.batch_size, args.concurrency, args.max_group)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="JSONL file, one {\"question\": ..., \"id\": ...} object per line")
+    parser.add_argument("output", help="JSONL file the answers are appended to; rerun to resume")
+    parser.add_argument("--pipeline", choices=PIPELINES, default="llm_pdf")
+    parser.add_argument("--batch-size", type=int, default=64, help="questions retrieved together")
+    parser.add_argument("--concurrency", type=int, default=4, help="model calls in flight")
+    parser.add_argument("--max-group", type=int, default=8, help="questions sharing a context answered back to back")
+    parser.add_argument("--no-fsync", action="store_true", help="only flush after each answer")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    stats = asyncio.run(run(args))
+    print(json.dumps(stats.summary(), indent=2))
+    if stats.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Synthetic Y-BOCS-like corpus with a labeled query set, for the benchmarks.
+
+Every page describes a few made-up symptom items. Each item has a unique code (e.g. `YB-0042`)
+and a unique combination of topic words; its query paraphrases the topic words and asks for
+the code's item, so a retrieved chunk is relevant exactly when it contains that code.
+
+    python -m benchmarks.corpus --out bench_corpus --docs 20 --pages 5
+"""
+import os
+import json
+import random
+import argparse
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+OBJECTS = [
+    "doorknobs", "stove dials", "window latches", "light switches", "car locks", "bank receipts", "bathroom taps",
+    "school bags", "kitchen knives", "garden gates", "email drafts", "medicine bottles", "bus tickets", "phone chargers",
+    "handwritten notes", "laundry piles", "bookshelves", "shoe racks", "coffee cups", "calendar entries",
+]
+ACTIONS = [
+    "checking", "counting", "washing", "arranging", "rereading", "tapping", "repeating", "hoarding",
+    "confessing", "reassurance seeking", "touching", "ordering", "retracing", "rewriting", "cleaning",
+]
+FEARS = [
+    "contamination", "fire", "burglary", "harming others", "making mistakes", "bad luck", "illness",
+    "losing control", "forgetting", "offending someone", "imperfection", "blasphemy",
+]
+FILLER = (
+    "Clinicians rate the time occupied, interference, distress, resistance and degree of control for this item. "
+    "Patients often describe the behaviour as excessive or unreasonable, although insight varies between individuals. "
+    "Severity is scored from zero (none) to four (extreme) and summed with the other items of the scale. "
+)
+
+
+@dataclass
+class LabeledQuery:
+    query: str
+    code: str  # a chunk is relevant when it contains this code
+    doc: str
+    page: int
+
+
+@dataclass
+class Corpus:
+    root: str
+    markdown_files: List[str] = field(default_factory=list)
+    pdf_files: List[str] = field(default_factory=list)
+    queries: List[LabeledQuery] = field(default_factory=list)
+
+
+def _item(rng: random.Random, code: str, used: set):
+    while True:
+        combo = (rng.choice(ACTIONS), rng.choice(OBJECTS), rng.choice(FEARS))
+        if combo not in used:
+            used.add(combo)
+            break
+    action, obj, fear = combo
+    text = (
+        f"### Item {code}: {action.capitalize()} {obj}\n\n"
+        f"Item {code} covers repeated {action} of {obj}, driven by a fear of {fear}. "
+        + FILLER * rng.randint(1, 3)
+        + "\n\n| Rating | Description |\n|---|---|\n"
+        + "".join(f"| {score} | {label} {action} of {obj} |\n" for score, label in enumerate(["No", "Mild", "Moderate", "Severe", "Extreme"]))
+    )
+    query = f"Which item describes {action} {obj} because of a fear of {fear}?"
+    return text, query
+
+
+def generate_pages(doc_index: int, pages: int, items_per_page: int, rng: random.Random, used: set):
+    """Markdown pages of one document, plus the labeled queries they answer."""
+    page_texts, queries = [], []
+    for page in range(1, pages + 1):
+        parts = [f"## Section {doc_index + 1}.{page}\n"]
+        for i in range(items_per_page):
+            code = f"YB-{doc_index:03d}{page:02d}{i}"
+            text, query = _item(rng, code, used)
+            parts.append(text)
+            queries.append(LabeledQuery(query=query, code=code, doc=f"doc{doc_index:03d}", page=page))
+        # horizontal rules inside a page, as in real scale documents
+        page_texts.append("\n\n---\n\n".join(parts))
+    return page_texts, queries
+
+
+def _write_pdf(path: str, pages: List[str]) -> None:
+    import pymupdf
+
+    doc = pymupdf.open()
+    for text in pages:
+        page = doc.new_page()
+        y = 50
+        for paragraph in text.split("\n\n"):
+            is_heading = paragraph.startswith("#")
+            paragraph = paragraph.lstrip("# ").replace("|", " ")
+            fontsize = 13 if is_heading else 8
+            rect = pymupdf.Rect(50, y, page.rect.width - 50, page.rect.height - 40)
+            spare = page.insert_textbox(rect, paragraph, fontsize=fontsize)
+            if spare < 0:  # page full
+                break
+            y = rect.y1 - spare + 6
+    doc.save(path)
+    doc.close()
+
+
+def generate_corpus(
+    out_dir: str, docs: int = 20, pages: int = 5, items_per_page: int = 3, seed: int = 0, pdf: bool = True
+) -> Corpus:
+    """Write `docs` markdown (and PDF) documents and `queries.jsonl` into `out_dir`."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    used: set = set()
+    corpus = Corpus(root=out_dir)
+    for d in range(docs):
+        page_texts, queries = generate_pages(d, pages, items_per_page, rng, used)
+        md_path = os.path.join(out_dir, f"doc{d:03d}.md")
+        with open(md_path, "w", encoding="utf-8") as f:
+            # form feeds mark page boundaries for load_markdown_pages()
+            f.write("\n\f\n".join(page_texts))
+        corpus.markdown_files.append(md_path)
+        if pdf:
+            pdf_path = os.path.join(out_dir, f"doc{d:03d}.pdf")
+            _write_pdf(pdf_path, page_texts)
+            corpus.pdf_files.append(pdf_path)
+        corpus.queries += queries
+    with open(os.path.join(out_dir, "queries.jsonl"), "w", encoding="utf-8") as f:
+        for query in corpus.queries:
+            f.write(json.dumps(asdict(query)) + "\n")
+    return corpus
+
+
+def load_markdown_pages(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().split("\n\f\n")
+
+
+def load_queries(path: str) -> List[LabeledQuery]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [LabeledQuery(**json.loads(line)) for line in f if line.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark corpus")
+    parser.add_argument("--out", default="bench_corpus")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--items-per-page", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-pdf", action="store_true", help="markdown only")
+    args = parser.parse_args()
+    corpus = generate_corpus(args.out, args.docs, args.pages, args.items_per_page, args.seed, pdf=not args.no_pdf)
+    print(f"Wrote {len(corpus.markdown_files)} documents and {len(corpus.queries)} labeled queries to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
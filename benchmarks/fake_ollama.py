@@ -0,0 +1,170 @@
+"""A local stand-in for the Ollama HTTP API, with configurable latency and token rate.
+
+Serves /api/chat and /api/generate (streaming and not), plus /api/show, /api/tags and
+/api/version, which is enough for llama-index's Ollama LLM and autogen's Ollama client.
+Every reply is the same canned answer, sent after `latency` seconds (time to first token)
+at `tokens_per_second`; the reply ends with TERMINATE so agent teams stop after one turn.
+
+    python -m benchmarks.fake_ollama --port 11435 --latency 0.3 --tokens-per-second 40
+"""
+import json
+import time
+import asyncio
+import argparse
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from aiohttp import web
+
+DEFAULT_REPLY = (
+    "Based on the documents, this item describes a compulsion that is rated on time occupied, "
+    "interference, distress, resistance and control. TERMINATE"
+)
+
+
+class FakeOllama:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.2,
+        tokens_per_second: float = 50.0,
+        reply: str = DEFAULT_REPLY,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.requests = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _tokens(self):
+        words = self.reply.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def _final(self, body: dict, chat: bool, started: float) -> dict:
+        prompt = json.dumps(body.get("messages") or body.get("prompt") or "")
+        final = {
+            "model": body.get("model", "fake"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "prompt_eval_count": len(prompt) // 4,
+            "eval_count": len(self._tokens()),
+        }
+        return {**final, "message": {"role": "assistant", "content": ""}} if chat else {**final, "response": ""}
+
+    async def _generate(self, request: web.Request, chat: bool) -> web.StreamResponse:
+        started = time.perf_counter()
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        tokens = self._tokens()
+        delay = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        if not body.get("stream", True):
+            await asyncio.sleep(delay * len(tokens))
+            final = self._final(body, chat, started)
+            if chat:
+                final["message"]["content"] = self.reply
+            else:
+                final["response"] = self.reply
+            return web.json_response(final)
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for token in tokens:
+            part = {"model": body.get("model", "fake"), "created_at": datetime.now(timezone.utc).isoformat(), "done": False}
+            part.update({"message": {"role": "assistant", "content": token}} if chat else {"response": token})
+            await response.write((json.dumps(part) + "\n").encode())
+            await asyncio.sleep(delay)
+        await response.write((json.dumps(self._final(body, chat, started)) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        return await self._generate(request, chat=True)
+
+    async def _completion(self, request: web.Request) -> web.StreamResponse:
+        return await self._generate(request, chat=False)
+
+    async def _show(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "modelfile": "",
+            "parameters": "",
+            "template": "",
+            "details": {"family": "llama", "format": "gguf", "parameter_size": "1B", "quantization_level": "Q4_0"},
+            "model_info": {"general.architecture": "llama", "llama.context_length": 8192},
+            "capabilities": ["completion", "vision", "tools"],
+        })
+
+    async def _tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": []})
+
+    async def _version(self, request: web.Request) -> web.Response:
+        return web.json_response({"version": "0.0.0-fake"})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/chat", self._chat)
+        app.router.add_post("/api/generate", self._completion)
+        app.router.add_post("/api/show", self._show)
+        app.router.add_get("/api/tags", self._tags)
+        app.router.add_get("/api/version", self._version)
+        return app
+
+    def start(self) -> "FakeOllama":
+        """Serve from a background thread; returns once the server is listening."""
+        ready = threading.Event()
+
+        async def serve():
+            self._runner = web.AppRunner(self.app())
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            ready.set()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(serve(), self._loop)
+        ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+    def __enter__(self) -> "FakeOllama":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    args = parser.parse_args()
+    server = FakeOllama(args.host, args.port, args.latency, args.tokens_per_second)
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
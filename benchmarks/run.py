@@ -0,0 +1,387 @@
+"""Retrieval and end-to-end latency benchmarks for both pipelines.
+
+Generates a synthetic corpus (see benchmarks/corpus.py), starts a fake Ollama server
+(benchmarks/fake_ollama.py) and measures:
+
+    index          SimpleDocumentIndexer.index_documents and index_documents_pipelined (autogen, ChromaDB)
+    memory         HybridMemory / ChromaDB queries, with recall@k (autogen)
+    retrievers     dense and hybrid llama-index retrievers, with recall@k (llm_pdf)
+    custom_query   MultimodalQueryEngine.custom_query against the fake model (llm_pdf)
+    batch          the same queries through batch_qa.run_batch, --batch-concurrency model calls at once (llm_pdf)
+    orchestrate    agents.orchestrate for one turn against the fake model (autogen)
+
+Each scenario reports p50/p95 latency, throughput and the process's peak RSS so far;
+--stages adds the mean time of every pipeline stage recorded by telemetry.py.
+With --baseline, metrics that got worse by more than --tolerance are flagged and the
+exit status is 1. Run from the repository root:
+
+    python -m benchmarks.run --scenarios all --save baseline.json
+    python -m benchmarks.run --scenarios all --baseline baseline.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import statistics
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "llm-multimodal-rag"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from benchmarks.corpus import Corpus, LabeledQuery, generate_corpus, load_markdown_pages  # noqa: E402
+from benchmarks.fake_ollama import FakeOllama  # noqa: E402
+
+SCENARIOS = ["index", "memory", "retrievers", "custom_query", "batch", "orchestrate"]
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+    except ImportError:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 2**20
+
+
+def latency_stats(samples: Sequence[float], wall: float) -> dict:
+    ordered = sorted(samples)
+    pct = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000
+    return {
+        "n": len(ordered),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "throughput_per_s": len(ordered) / wall if wall else 0.0,
+    }
+
+
+def recall_at_k(retrieved: List[List[str]], queries: Sequence[LabeledQuery]) -> float:
+    """Share of queries with at least one retrieved chunk containing the query's item code."""
+    hits = sum(any(q.code in text for text in texts) for texts, q in zip(retrieved, queries))
+    return hits / len(queries) if queries else 0.0
+
+
+def timed(calls: Sequence[Callable[[], object]]):
+    """Run the calls one by one; returns their results, per-call latencies and wall time."""
+    results, samples = [], []
+    start = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        results.append(call())
+        samples.append(time.perf_counter() - t)
+    return results, samples, time.perf_counter() - start
+
+
+async def atimed(calls):
+    results, samples = [], []
+    start = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        results.append(await call())
+        samples.append(time.perf_counter() - t)
+    return results, samples, time.perf_counter() - start
+
+
+# -- autogen pipeline ----------------------------------------------------------------------------
+
+def _autogen_memory(workdir: str, args):
+    from autogen_ext.memory.chromadb import ChromaDBVectorMemory, PersistentChromaDBVectorMemoryConfig, CustomEmbeddingFunctionConfig
+    from autogen_ybocs_rag.embeddings import cached_sentence_transformer
+    from autogen_ybocs_rag.memory import HybridMemory
+    from context_packing import ContextPacker
+
+    chroma = ChromaDBVectorMemory(
+        config=PersistentChromaDBVectorMemoryConfig(
+            collection_name="bench_docs",
+            persistence_path=os.path.join(workdir, "chroma"),
+            k=5,
+            score_threshold=0.0,
+            embedding_function_config=CustomEmbeddingFunctionConfig(
+                function=cached_sentence_transformer,
+                # a cache per run, so indexing times include the embedding work
+                params={"model_name": "all-MiniLM-L6-v2", "cache_dir": os.path.join(workdir, "embeddings"), "backend": args.embed_backend},
+            ),
+        )
+    )
+    reranker = None
+    if args.rerank:
+        from reranking import AdaptiveReranker
+
+        reranker = AdaptiveReranker(candidates=20, max_k=5)
+    return HybridMemory(chroma, bm25_path=os.path.join(workdir, "bm25.json"), k=5, packer=ContextPacker(max_chunks=3), reranker=reranker)
+
+
+async def bench_index(corpus: Corpus, workdir: str, args) -> dict:
+    from autogen_ybocs_rag.indexer import SimpleDocumentIndexer
+
+    results = {}
+    for label, pipelined in (("index_documents", False), ("index_documents_pipelined", True)):
+        memory = _autogen_memory(os.path.join(workdir, label), args)
+        indexer = SimpleDocumentIndexer(memory=memory)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if pipelined:
+                chunks = (await indexer.index_documents_pipelined(corpus.pdf_files)).chunks
+            else:
+                chunks = await indexer.index_documents(corpus.pdf_files)
+        wall = time.perf_counter() - start
+        await memory.close()
+        results[label] = {
+            "wall_s": wall,
+            "chunks": chunks,
+            "docs_per_s": len(corpus.pdf_files) / wall,
+            "chunks_per_s": chunks / wall,
+        }
+    return results
+
+
+async def bench_memory(corpus: Corpus, workdir: str, args) -> dict:
+    memory = _autogen_memory(os.path.join(workdir, "index_documents_pipelined"), args)
+    queries = corpus.queries[: args.queries]
+    results, samples, wall = await atimed([lambda q=q: memory.query(q.query, k=args.k) for q in queries])
+    await memory.close()
+    retrieved = [[str(r.content) for r in result.results] for result in results]
+    return {"hybrid": {**latency_stats(samples, wall), f"recall@{args.k}": recall_at_k(retrieved, queries)}}
+
+
+async def bench_orchestrate(corpus: Corpus, workdir: str, args, fake: FakeOllama) -> dict:
+    from autogen_ext.models.ollama import OllamaChatCompletionClient
+    from autogen_ybocs_rag import agents
+    from registry import registry
+
+    # the shared client and memory that teamConfig() picks up, pointed at the fake model and bench corpus
+    registry.reset("chat_model_client")
+    registry.reset("ocd_docs_retrieval_memory")
+    registry.get_or_create("chat_model_client", lambda: OllamaChatCompletionClient(model=agents.CHAT_MODEL, host=fake.url))
+    registry.get_or_create("ocd_docs_retrieval_memory", lambda: _autogen_memory(os.path.join(workdir, "index_documents_pipelined"), args))
+
+    async def turn(task: str):
+        # the templated queries are near-paraphrases; measure real turns, not semantic cache hits
+        async for _ in agents.orchestrate(agents.teamConfig(), task, stream=True, use_cache=False):
+            pass
+
+    queries = corpus.queries[: args.llm_queries]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, samples, wall = await atimed([lambda q=q: turn(q.query) for q in queries])
+    await agents.get_retrieval_memory().close()
+    registry.reset("chat_model_client")
+    registry.reset("ocd_docs_retrieval_memory")
+    return {"turn": latency_stats(samples, wall)}
+
+
+# -- llama-index pipeline ------------------------------------------------------------------------
+
+def _llm_pdf_index(corpus: Corpus, workdir: str, args):
+    from llama_index.core import StorageContext, VectorStoreIndex
+    from chunking import MarkdownChunker
+    from embedding_backends import get_backend
+    from llm_pdf_functions import BackendEmbedding, CachedEmbedding, iter_text_nodes
+    from parsing import ParsedDocument, ParsedPage
+    from vector_store import MmapVectorStore
+
+    # markdown pages straight from the generator: measures chunking and retrieval, not PDF parsing
+    parsed = [
+        ParsedDocument(path, "", "synthetic", [ParsedPage(i, text, text) for i, text in enumerate(load_markdown_pages(path), 1)])
+        for path in corpus.markdown_files
+    ]
+    start = time.perf_counter()
+    nodes = list(iter_text_nodes(parsed, MarkdownChunker()))
+    chunk_s = time.perf_counter() - start
+    embed_model = CachedEmbedding(BackendEmbedding(get_backend(args.embed_model, args.embed_backend)), cache_dir=os.path.join(workdir, "embeddings"))
+    vector_store = MmapVectorStore(os.path.join(workdir, "llm_pdf_vectors"), backend=args.vector_backend, dtype=args.vector_dtype)
+    start = time.perf_counter()
+    index = VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults(vector_store=vector_store), embed_model=embed_model)
+    build_s = time.perf_counter() - start
+    return index, {"nodes": len(nodes), "chunk_s": chunk_s, "build_s": build_s}
+
+
+async def bench_retrievers(corpus: Corpus, workdir: str, args, state: dict) -> dict:
+    from hybrid_retrieval import BM25Index
+    from retrievers import HybridRetriever, sync_bm25
+
+    index, build = _llm_pdf_index(corpus, workdir, args)
+    bm25 = BM25Index()
+    sync_bm25(bm25, index)
+    state["index"], state["bm25"] = index, bm25
+    queries = corpus.queries[: args.queries]
+    results = {"build": build}
+    for label, retriever in (
+        ("dense", index.as_retriever(similarity_top_k=args.k)),
+        ("hybrid", HybridRetriever(index, bm25, similarity_top_k=args.k)),
+    ):
+        retrieved, samples, wall = timed([lambda q=q: retriever.retrieve(q.query) for q in queries])
+        texts = [[n.node.get_content() for n in nodes] for nodes in retrieved]
+        results[label] = {**latency_stats(samples, wall), f"recall@{args.k}": recall_at_k(texts, queries)}
+    return results
+
+
+def _query_engine(fake: FakeOllama, args, state: dict):
+    from llama_index.llms.ollama import Ollama
+    from context_packing import ContextPacker
+    from llm_pdf_functions import MultimodalQueryEngine
+    from retrievers import HybridRetriever
+
+    return MultimodalQueryEngine(
+        multi_modal_llm=Ollama(model="fake-vision", base_url=fake.url, request_timeout=120),
+        retriever=HybridRetriever(state["index"], state["bm25"], similarity_top_k=args.k),
+        context_packer=ContextPacker(),
+    )
+
+
+async def bench_custom_query(corpus: Corpus, workdir: str, args, fake: FakeOllama, state: dict) -> dict:
+    if "index" not in state:
+        await bench_retrievers(corpus, workdir, args, state)
+    engine = _query_engine(fake, args, state)
+    queries = corpus.queries[: args.llm_queries]
+    responses, samples, wall = timed([lambda q=q: engine.query(q.query) for q in queries])
+    prompt_tokens = [r.metadata["context"]["prompt_tokens"] for r in responses]
+    return {"query": {**latency_stats(samples, wall), "mean_prompt_tokens": statistics.fmean(prompt_tokens)}}
+
+
+async def bench_batch(corpus: Corpus, workdir: str, args, fake: FakeOllama, state: dict) -> dict:
+    from batch_qa import LlmPdfPipeline, Question, ResultWriter, run_batch
+
+    if "index" not in state:
+        await bench_retrievers(corpus, workdir, args, state)
+    questions = [Question(str(i), q.query, {"question": q.query}) for i, q in enumerate(corpus.queries[: args.llm_queries])]
+    output = os.path.join(workdir, "batch_answers.jsonl")
+    if os.path.exists(output):
+        os.remove(output)
+    with ResultWriter(output) as writer:
+        stats = await run_batch(questions, LlmPdfPipeline(_query_engine(fake, args, state)), writer, concurrency=args.batch_concurrency)
+    summary = stats.summary()
+    return {"run": {"throughput_per_s": summary["answers_per_s"], "wall_s": summary["wall_s"], "retrieval_s": summary["retrieval_s"], "groups": summary["groups"]}}
+
+
+# -- reporting -----------------------------------------------------------------------------------
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = float(value)
+    return flat
+
+
+def _worse(name: str, current: float, baseline: float, tolerance: float) -> bool:
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf.startswith("recall@"):
+        return current < baseline - 0.02
+    if leaf.endswith("per_s"):
+        return current < baseline * (1 - tolerance)
+    if leaf.endswith("_ms") or leaf.endswith("_s") or leaf in ("peak_rss_mb", "mean_prompt_tokens"):
+        return current > baseline * (1 + tolerance)
+    return False
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (recall: more than 2 points)."""
+    current, before = flatten(results), flatten(baseline)
+    return [
+        f"{name}: {before[name]:.4g} -> {value:.4g}"
+        for name, value in current.items()
+        if name in before and _worse(name, value, before[name], tolerance)
+    ]
+
+
+def print_results(results: dict) -> None:
+    for scenario, metrics in results.items():
+        print(f"\n{scenario}")
+        for label, values in metrics.items():
+            if isinstance(values, dict):
+                print(f"  {label:<26} " + "  ".join(f"{k} {v:.4g}" for k, v in values.items()))
+            else:
+                print(f"  {label:<26} {values:.4g}")
+
+
+async def run(args) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ybocs_bench_")
+    corpus_dir = os.path.join(workdir, "corpus")
+    corpus = generate_corpus(corpus_dir, docs=args.docs, pages=args.pages, seed=args.seed)
+    scenarios = SCENARIOS if "all" in args.scenarios else args.scenarios
+    results, state = {}, {}
+    if args.stages:
+        import telemetry
+
+        telemetry.configure(enabled=True)
+    with FakeOllama(latency=args.latency, tokens_per_second=args.tokens_per_second) as fake:
+        for scenario in scenarios:
+            if scenario == "index":
+                results[scenario] = await bench_index(corpus, workdir, args)
+            elif scenario == "memory":
+                if "index" not in results:
+                    await bench_index(corpus, workdir, args)
+                results[scenario] = await bench_memory(corpus, workdir, args)
+            elif scenario == "retrievers":
+                results[scenario] = await bench_retrievers(corpus, workdir, args, state)
+            elif scenario == "custom_query":
+                results[scenario] = await bench_custom_query(corpus, workdir, args, fake, state)
+            elif scenario == "batch":
+                results[scenario] = await bench_batch(corpus, workdir, args, fake, state)
+            elif scenario == "orchestrate":
+                if "index" not in results:
+                    await bench_index(corpus, workdir, args)
+                results[scenario] = await bench_orchestrate(corpus, workdir, args, fake)
+            results[scenario]["peak_rss_mb"] = peak_rss_mb()
+    if args.stages:
+        # per-stage timings and cache hit rates over all scenarios, from the telemetry module
+        results["stages"] = telemetry.metrics.summary()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=[*SCENARIOS, "all"], default=["all"])
+    parser.add_argument("--docs", type=int, default=20, help="synthetic documents")
+    parser.add_argument("--pages", type=int, default=5, help="pages per document")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100, help="labeled queries for the retrieval scenarios")
+    parser.add_argument("--llm-queries", type=int, default=10, help="queries for the scenarios that call the model")
+    parser.add_argument("--batch-concurrency", type=int, default=4, help="model calls in flight in the batch scenario")
+    parser.add_argument("--k", type=int, default=5, help="top-k for retrieval and recall@k")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="fake model generation speed")
+    parser.add_argument("--embed-model", default="BAAI/bge-small-en-v1.5")
+    parser.add_argument("--embed-backend", default="torch", choices=["torch", "torch-int8", "onnx", "onnx-int8"])
+    parser.add_argument("--vector-backend", default="hnsw", choices=["hnsw", "flat"])
+    parser.add_argument("--vector-dtype", default="float32", choices=["float32", "float16", "int8"])
+    parser.add_argument("--rerank", action="store_true", help="cross-encoder rerank with adaptive cutoff in the autogen memory")
+    parser.add_argument("--stages", action="store_true", help="also report per-stage timings (enables telemetry)")
+    parser.add_argument("--workdir", help="keep the corpus and indexes here instead of a temporary directory")
+    parser.add_argument("--save", help="write the results to this JSON file (e.g. as a new baseline)")
+    parser.add_argument("--baseline", help="compare against this results JSON and flag regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        flagged = regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if flagged:
+            print("\nRegressions against the baseline:")
+            for line in flagged:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Startup-time benchmark for the agents and llm_pdf modules.
+
+Each target is measured in a fresh interpreter: the module import, then every lazy
+accessor twice - once cold (it loads the model/index/client) and once warm (it should be
+served from the process-wide registry). Run from the repository root:
+
+    python -m benchmarks.startup --target all --repeat 3 --json startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# target -> (module to import, extra sys.path entry, [(step label, expression using `m`)])
+TARGETS = {
+    "agents": (
+        "autogen_ybocs_rag.agents",
+        ROOT,
+        [
+            ("get_model_client", "m.get_model_client()"),
+            ("get_rag_memory", "m.get_rag_memory()"),
+            ("first memory query", "asyncio.run(m.get_rag_memory().query('What is Y-BOCS?'))"),
+            ("teamConfig", "m.teamConfig()"),
+        ],
+    ),
+    "llm_pdf": (
+        "llm_pdf",
+        ROOT / "llm-multimodal-rag",
+        [
+            ("get_llm", "m.get_llm()"),
+            ("get_embed_model", "m.get_embed_model()"),
+            ("get_index", "m.get_index()"),
+            ("get_query_engine", "m.get_query_engine()"),
+            ("get_agent", "m.get_agent()"),
+        ],
+    ),
+}
+
+_SNIPPET = """
+import asyncio, importlib, json, time
+t0 = time.perf_counter()
+m = importlib.import_module({module!r})
+result = {{"import_s": time.perf_counter() - t0, "steps": {{}}}}
+for label, expr in {steps!r}:
+    timings = []
+    for _ in range(2):  # cold, then warm
+        t = time.perf_counter()
+        eval(expr)
+        timings.append(time.perf_counter() - t)
+    result["steps"][label] = {{"cold_s": timings[0], "warm_s": timings[1]}}
+result["total_s"] = time.perf_counter() - t0
+print("__RESULT__" + json.dumps(result))
+"""
+
+
+def run_once(target: str) -> dict:
+    module, path, steps = TARGETS[target]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT), str(path), env.get("PYTHONPATH", "")])
+    proc = subprocess.run(
+        [sys.executable, "-c", _SNIPPET.format(module=module, steps=steps)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("__RESULT__"):
+            return json.loads(line[len("__RESULT__"):])
+    raise RuntimeError(f"{target} startup run failed:\n{proc.stderr[-2000:]}")
+
+
+def summarize(runs: list) -> dict:
+    """Median over runs of every timing."""
+    median = lambda values: statistics.median(values)
+    return {
+        "import_s": median([r["import_s"] for r in runs]),
+        "total_s": median([r["total_s"] for r in runs]),
+        "steps": {
+            label: {key: median([r["steps"][label][key] for r in runs]) for key in ("cold_s", "warm_s")}
+            for label in runs[0]["steps"]
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=[*TARGETS, "all"], default="all")
+    parser.add_argument("--repeat", type=int, default=1, help="fresh interpreters per target (median is reported)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for target in TARGETS if args.target == "all" else [args.target]:
+        results[target] = summarize([run_once(target) for _ in range(args.repeat)])
+        summary = results[target]
+        print(f"\n{target}: import {summary['import_s']:.2f}s, total {summary['total_s']:.2f}s")
+        for label, timing in summary["steps"].items():
+            print(f"  {label:<22} cold {timing['cold_s']:8.3f}s   warm {timing['warm_s']:8.4f}s")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
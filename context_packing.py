@@ -0,0 +1,127 @@
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Generic, List, Optional, Sequence, Set, TypeVar
+
+T = TypeVar("T")
+
+_WORD = re.compile(r"\w+")
+
+
+def _load_token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        # no tokenizer available (or no network to fetch its vocabulary): ~4 characters per token
+        return lambda text: (len(text) + 3) // 4
+
+
+_count_tokens: Optional[Callable[[str], int]] = None
+
+
+def count_tokens(text: str) -> int:
+    """Approximate prompt tokens for `text`; close enough to budget Llama prompts."""
+    global _count_tokens
+    if _count_tokens is None:
+        _count_tokens = _load_token_counter()
+    return _count_tokens(text)
+
+
+def shingles(text: str, size: int = 5) -> Set[int]:
+    """Hashed word n-grams of the normalized text, used to spot near-duplicate chunks."""
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {hash(" ".join(words))}
+    return {hash(" ".join(words[i : i + size])) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class PackedContext(Generic[T]):
+    """The chunks that made it into the prompt, and what was left out."""
+
+    items: List[T]
+    texts: List[str]
+    tokens: int
+    budget: int
+    duplicates: int = 0
+    over_budget: int = 0
+    candidates: int = 0
+    separator: str = field(default="\n\n", repr=False)
+
+    @property
+    def text(self) -> str:
+        return self.separator.join(self.texts)
+
+    def stats(self) -> dict:
+        return {
+            "tokens": self.tokens,
+            "budget": self.budget,
+            "chunks": len(self.items),
+            "candidates": self.candidates,
+            "duplicates": self.duplicates,
+            "over_budget": self.over_budget,
+        }
+
+
+class ContextPacker:
+    """Assemble retrieved chunks into a prompt context under a token budget.
+
+    Candidates are taken best score first. A chunk whose word 5-grams overlap an already
+    selected chunk by at least `dedup_threshold` (Jaccard) is dropped as a near-duplicate,
+    and a chunk that no longer fits the remaining budget is skipped in favour of smaller,
+    lower-scored ones. The selected chunks keep their score order.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2048,
+        dedup_threshold: float = 0.85,
+        max_chunks: Optional[int] = None,
+        separator: str = "\n\n",
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.max_chunks = max_chunks
+        self.separator = separator
+
+    def pack(
+        self,
+        items: Sequence[T],
+        text: Callable[[T], str],
+        score: Optional[Callable[[T], Optional[float]]] = None,
+    ) -> PackedContext[T]:
+        order = list(range(len(items)))
+        if score is not None:
+            # stable: ties (and unscored items) keep their retrieval order
+            order.sort(key=lambda i: -(score(items[i]) or 0.0))
+
+        packed = PackedContext(items=[], texts=[], tokens=0, budget=self.max_tokens, candidates=len(items), separator=self.separator)
+        seen: List[Set[int]] = []
+        separator_tokens = count_tokens(self.separator)
+        for i in order:
+            if self.max_chunks is not None and len(packed.items) >= self.max_chunks:
+                break
+            chunk = text(items[i]).strip()
+            if not chunk:
+                continue
+            grams = shingles(chunk)
+            if any(jaccard(grams, other) >= self.dedup_threshold for other in seen):
+                packed.duplicates += 1
+                continue
+            cost = count_tokens(chunk) + (separator_tokens if packed.items else 0)
+            if packed.tokens + cost > self.max_tokens:
+                packed.over_budget += 1
+                continue
+            packed.items.append(items[i])
+            packed.texts.append(chunk)
+            packed.tokens += cost
+            seen.append(grams)
+        return packed
@@ -0,0 +1,346 @@
+"""CPU embedding backends shared by both pipelines.
+
+    backend = get_backend("all-MiniLM-L6-v2", backend="onnx-int8", threads=4)
+    vectors = backend.embed(texts)  # (n, dim) float32, L2-normalized
+
+Backends:
+  torch       the Hugging Face model in PyTorch (the fp32 baseline)
+  torch-int8  the same model with its Linear layers dynamically quantized to int8
+  onnx        the model exported to ONNX and run by ONNX Runtime
+  onnx-int8   the ONNX model with int8 dynamically quantized weights
+
+The ONNX export (and its quantized copy) is written once to ~/.cache/ybocs_onnx. Without
+onnxruntime installed the ONNX backends fall back to their torch equivalent with a warning.
+Every backend tokenizes a whole call up front, sorts the texts by token length and cuts
+batches by a padded-token budget, so short chunks are not padded to the longest chunk in
+the call. Texts are truncated at the model's own max_seq_length (256 tokens for
+all-MiniLM-L6-v2), as SentenceTransformer does, so vectors match the ones already indexed.
+Pick the default with YBOCS_EMBED_BACKEND and YBOCS_EMBED_THREADS.
+
+`compare_backends()` (or `python embedding_backends.py --model ... --backend onnx-int8`)
+measures a backend's speed and its agreement with the fp32 baseline before you switch.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import importlib.util
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_cache import VECTOR_DTYPES, from_storage, to_storage
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+DEFAULT_BACKEND = os.environ.get("YBOCS_EMBED_BACKEND", "torch")
+DEFAULT_THREADS = int(os.environ.get("YBOCS_EMBED_THREADS", "0")) or None  # None: the runtime's default
+ONNX_CACHE_DIR = os.path.join(str(Path.home()), ".cache", "ybocs_onnx")
+
+# sentence-transformers models mean-pool token states; bge uses the [CLS] state
+POOLING = {"BAAI/bge-small-en-v1.5": "cls"}
+# instruction prepended to queries (not documents), as HuggingFaceEmbedding does for bge
+QUERY_INSTRUCTIONS = {"BAAI/bge-small-en-v1.5": "Represent this question for searching relevant passages: "}
+
+
+def configured_max_length(model_name: str, tokenizer) -> int:
+    """The truncation length the model was trained and is served with.
+
+    sentence-transformers models record it as `max_seq_length` in sentence_bert_config.json
+    (256 for all-MiniLM-L6-v2, below its tokenizer's 512), and SentenceTransformer truncates
+    there; embedding with a longer window yields different vectors for long chunks.
+    """
+    try:
+        from huggingface_hub import hf_hub_download
+
+        with open(hf_hub_download(model_name, "sentence_bert_config.json")) as f:
+            return int(json.load(f)["max_seq_length"])
+    except Exception:
+        # not a sentence-transformers model (or offline without it cached): the tokenizer's limit
+        return min(int(tokenizer.model_max_length), 512)
+
+
+def length_batches(lengths: Sequence[int], batch_tokens: int = 8192, max_batch_size: int = 64) -> List[List[int]]:
+    """Group indices into batches of similar length, each padding to at most `batch_tokens` tokens.
+
+    Indices are sorted by length, so every batch pads to a length close to its own texts'
+    rather than to the longest text of the whole call.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, batch = [], []
+    for i in order:
+        # sorted ascending, so the text being added is the longest in the batch
+        if batch and ((len(batch) + 1) * lengths[i] > batch_tokens or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EmbeddingBackend:
+    """Tokenizes, length-buckets, pools and normalizes; subclasses run the model on a padded batch."""
+
+    name = "base"
+
+    def __init__(
+        self,
+        model_name: str,
+        threads: Optional[int] = DEFAULT_THREADS,
+        max_length: Optional[int] = None,
+        batch_tokens: int = 8192,
+        max_batch_size: int = 64,
+        pooling: Optional[str] = None,
+    ) -> None:
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.threads = threads
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.pooling = pooling or POOLING.get(model_name, "mean")
+        self.query_instruction = QUERY_INSTRUCTIONS.get(model_name, "")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.default_max_length = configured_max_length(model_name, self.tokenizer)
+        self.max_length = max_length or self.default_max_length
+        self.dim: Optional[int] = None
+
+    @property
+    def model_id(self) -> str:
+        """Key for the embedding cache: quantized vectors must not be mixed with fp32 ones."""
+        return self._model_id(quantized=False)
+
+    def _model_id(self, quantized: bool) -> str:
+        model_id = f"{self.model_name}#int8" if quantized else self.model_name
+        # a non-default truncation length changes the vectors of long chunks
+        if self.max_length != self.default_max_length:
+            model_id += f"#len{self.max_length}"
+        return model_id
+
+    def _forward(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Last hidden state, (batch, seq, dim), for padded int64 inputs."""
+        raise NotImplementedError
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / weights.sum(axis=1).clip(min=1e-9)
+        return pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(min=1e-12)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        input_names = [name for name in self.tokenizer.model_input_names if name in encoded]
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        out: Optional[np.ndarray] = None
+        for batch in length_batches(lengths, self.batch_tokens, self.max_batch_size):
+            width = max(lengths[i] for i in batch)
+            inputs = {name: np.zeros((len(batch), width), dtype=np.int64) for name in input_names}
+            if "input_ids" in inputs and self.tokenizer.pad_token_id:
+                inputs["input_ids"][:] = self.tokenizer.pad_token_id
+            for row, i in enumerate(batch):
+                for name in input_names:
+                    inputs[name][row, : lengths[i]] = encoded[name][i]
+            vectors = self._pool(self._forward(inputs), inputs["attention_mask"])
+            if out is None:
+                self.dim = vectors.shape[1]
+                out = np.empty((len(texts), self.dim), dtype=np.float32)
+            out[batch] = vectors
+        return out
+
+    def embed_queries(self, queries: Sequence[str]) -> np.ndarray:
+        return self.embed([self.query_instruction + query for query in queries])
+
+
+class TorchBackend(EmbeddingBackend):
+    name = "torch"
+
+    def __init__(self, model_name: str, quantize: bool = False, **kwargs) -> None:
+        import torch
+        from transformers import AutoModel
+
+        super().__init__(model_name, **kwargs)
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.quantize = quantize
+        if quantize:
+            self.name = "torch-int8"
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @property
+    def model_id(self) -> str:
+        return self._model_id(self.quantize)
+
+    def _forward(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode():
+            output = self.model(**{name: torch.from_numpy(array) for name, array in inputs.items()})
+        return output.last_hidden_state.float().numpy()
+
+
+def export_onnx(model_name: str, cache_dir: str = ONNX_CACHE_DIR, quantize: bool = False) -> str:
+    """Export a Hugging Face encoder to ONNX (and quantize it) once; returns the model path."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    model_dir = Path(cache_dir) / model_name.replace("/", "__")
+    model_dir.mkdir(parents=True, exist_ok=True)
+    fp32_path = model_dir / "model.onnx"
+    if not fp32_path.exists():
+        logger.info(f"Exporting {model_name} to {fp32_path}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = tokenizer(["an example sentence"], return_tensors="pt")
+        names = [name for name in tokenizer.model_input_names if name in sample]
+        tmp_path = model_dir / "model.onnx.tmp"
+        with torch.inference_mode():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in names),
+                str(tmp_path),
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in names}, "last_hidden_state": {0: "batch", 1: "sequence"}},
+                opset_version=17,
+            )
+        os.replace(tmp_path, fp32_path)
+    if not quantize:
+        return str(fp32_path)
+    int8_path = model_dir / "model.int8.onnx"
+    if not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info(f"Quantizing {fp32_path} to int8")
+        tmp_path = model_dir / "model.int8.onnx.tmp"
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return str(int8_path)
+
+
+class OnnxBackend(EmbeddingBackend):
+    name = "onnx"
+
+    def __init__(self, model_name: str, quantize: bool = False, cache_dir: str = ONNX_CACHE_DIR, **kwargs) -> None:
+        import onnxruntime as ort
+
+        super().__init__(model_name, **kwargs)
+        self.quantize = quantize
+        if quantize:
+            self.name = "onnx-int8"
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            export_onnx(model_name, cache_dir, quantize), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def model_id(self) -> str:
+        # fp32 ONNX matches the torch model to ~1e-6, so the two share cached vectors
+        return self._model_id(self.quantize)
+
+    def _forward(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        feed = {name: array for name, array in inputs.items() if name in self._input_names}
+        return self.session.run(["last_hidden_state"], feed)[0]
+
+
+def get_backend(model_name: str, backend: str = DEFAULT_BACKEND, threads: Optional[int] = DEFAULT_THREADS, **kwargs) -> EmbeddingBackend:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    quantize = backend.endswith("-int8")
+    if backend.startswith("onnx"):
+        if importlib.util.find_spec("onnxruntime") is None:
+            logger.warning("onnxruntime is not installed (pip install onnxruntime), falling back to the torch backend")
+        else:
+            return OnnxBackend(model_name, quantize=quantize, threads=threads, **kwargs)
+    return TorchBackend(model_name, quantize=quantize, threads=threads, **kwargs)
+
+
+def compare_backends(
+    candidate: EmbeddingBackend,
+    baseline: EmbeddingBackend,
+    texts: Sequence[str],
+    queries: Sequence[str] = (),
+    k: int = 10,
+    storage_dtype: str = "float32",
+) -> dict:
+    """Speed and agreement of `candidate` (with vectors stored as `storage_dtype`) against the fp32 `baseline`.
+
+    `cosine_*` compares each text's two vectors; `recall_at_k` is the share of the baseline's
+    top-k texts for each query that the candidate also ranks in its top k.
+    """
+    timings, vectors = {}, {}
+    for label, backend in (("baseline", baseline), ("candidate", candidate)):
+        start = time.perf_counter()
+        vectors[label] = backend.embed(texts)
+        timings[label] = time.perf_counter() - start
+    stored = from_storage(to_storage(vectors["candidate"], storage_dtype))
+    cosine = (stored * vectors["baseline"]).sum(axis=1) / np.linalg.norm(stored, axis=1).clip(min=1e-12)
+    report = {
+        "texts": len(texts),
+        "baseline_texts_per_s": len(texts) / timings["baseline"],
+        "candidate_texts_per_s": len(texts) / timings["candidate"],
+        "speedup": timings["baseline"] / timings["candidate"],
+        "bytes_per_vector": stored.shape[1] * np.dtype(storage_dtype).itemsize,
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+    }
+    if queries:
+        k = min(k, len(texts))
+        top = {}
+        for label, backend, matrix in (("baseline", baseline, vectors["baseline"]), ("candidate", candidate, stored)):
+            scores = backend.embed_queries(queries) @ matrix.T
+            top[label] = np.argsort(-scores, axis=1)[:, :k]
+        overlap = [len(set(a) & set(b)) / k for a, b in zip(top["baseline"], top["candidate"])]
+        report[f"recall_at_{k}"] = float(np.mean(overlap))
+    return report
+
+
+def _sample_texts(path: Optional[str], limit: int) -> Tuple[List[str], List[str]]:
+    """Paragraphs of a text/markdown file (or a small built-in sample) and queries made from their openings."""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            texts = [p.strip() for p in f.read().split("\n\n") if len(p.strip()) > 40][:limit]
+    else:
+        texts = [
+            f"Item {i}: repeated checking of doors and appliances, driven by fear of harm, rated on time, distress and control."
+            if i % 2 else f"Item {i}: excessive washing and cleaning to remove contamination; severity is scored from zero to four."
+            for i in range(limit)
+        ]
+    queries = [" ".join(text.split()[:8]) for text in texts[: max(1, len(texts) // 10)]]
+    return texts, queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare an embedding backend with the fp32 torch baseline")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", choices=BACKENDS, default="onnx-int8")
+    parser.add_argument("--storage", choices=VECTOR_DTYPES, default="float32", help="dtype the vectors are stored as")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--texts", help="text or markdown file; paragraphs are embedded")
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    model = args.model if "/" in args.model else f"sentence-transformers/{args.model}"
+    texts, queries = _sample_texts(args.texts, args.limit)
+    baseline = get_backend(model, "torch", threads=args.threads)
+    candidate = get_backend(model, args.backend, threads=args.threads)
+    for name, value in compare_backends(candidate, baseline, texts, queries, storage_dtype=args.storage).items():
+        print(f"{name:>22}: {value:.4g}" if isinstance(value, float) else f"{name:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# shared by both pipelines, so re-chunking or rebuilding either index reuses the same vectors
+DEFAULT_CACHE_DIR = os.path.join(str(Path.home()), ".cache", "ybocs_embeddings")
+# storage dtypes for L2-normalized vectors: int8 keeps round(x * 127), a quarter of float32's size
+VECTOR_DTYPES = ("float32", "float16", "int8")
+INT8_SCALE = 127.0
+
+
+def to_storage(vectors: np.ndarray, dtype: str) -> np.ndarray:
+    """Encode unit vectors (every component within [-1, 1]) for storage as `dtype`."""
+    if dtype == "int8":
+        return np.clip(np.rint(np.asarray(vectors, dtype=np.float32) * INT8_SCALE), -127, 127).astype(np.int8)
+    return np.asarray(vectors, dtype=dtype)
+
+
+def from_storage(vectors: np.ndarray) -> np.ndarray:
+    """Decode stored vectors back to float32."""
+    if vectors.dtype == np.int8:
+        return vectors.astype(np.float32) / INT8_SCALE
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text before hashing, so whitespace-only differences hit the same entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    """Persistent, size-capped embedding cache for one embedding model.
+
+    Vectors live in a memory-mapped float32/float16/int8 file (one row per slot) and an SQLite index
+    maps sha256(model id + normalized text) to its slot and last-use time. When `max_entries` is
+    reached, the least recently used slots are overwritten. int8 assumes normalized vectors,
+    which every embedding backend in this repo returns.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_entries: int = 200_000,
+        dtype: str = "float32",
+    ) -> None:
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"dtype must be one of {', '.join(VECTOR_DTYPES)}, not {dtype}")
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", model_id)
+        # each dtype gets its own directory, so switching dtype starts a new cache instead of failing
+        self.path = Path(cache_dir) / (name if dtype == "float32" else f"{name}.{dtype}")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.path / f"vectors.{dtype}.bin"
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()  # chroma calls embedding functions from worker threads
+
+        self._db = sqlite3.connect(self.path / "index.sqlite", check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        stored = dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+        if stored.get("dtype", dtype) != dtype:
+            raise ValueError(f"Cache at {self.path} stores {stored['dtype']} vectors, not {dtype}")
+        self.dim: Optional[int] = int(stored["dim"]) if "dim" in stored else None
+
+    def _key(self, text: str, namespace: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\0{namespace}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def _meta(self, name: str, default: str) -> str:
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _open_vectors(self, min_slots: int = 0) -> Optional[np.memmap]:
+        """(Re)open the vector file, growing it to hold at least `min_slots` rows."""
+        if self.dim is None:
+            return None
+        row_bytes = self.dim * self.dtype.itemsize
+        size = self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+        if size < min_slots * row_bytes:
+            # grow geometrically rather than preallocating max_entries rows up front
+            slots = min(self.max_entries, max(min_slots, 2 * size // row_bytes, 1024))
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(slots * row_bytes)
+            size = slots * row_bytes
+        if self._vectors is None or self._vectors.shape[0] != size // row_bytes:
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(size // row_bytes, self.dim))
+        return self._vectors
+
+    def _lookup(self, keys: Sequence[str]) -> dict:
+        found = {}
+        for start in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+            part = keys[start : start + 500]
+            rows = self._db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            found.update(rows)
+        return found
+
+    def get_many(self, texts: Sequence[str], namespace: str = "") -> List[Optional[np.ndarray]]:
+        """Look up cached vectors; misses come back as None."""
+        keys = [self._key(text, namespace) for text in texts]
+        with self._lock:
+            found = self._lookup(keys)
+            vectors = None
+            if found:
+                vectors = self._vectors
+                if vectors is None or max(found.values()) >= vectors.shape[0]:
+                    # another process may have grown the file since we mapped it
+                    vectors = self._open_vectors()
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._db.commit()
+            results = [from_storage(np.array(vectors[found[key]])) if key in found else None for key in keys]
+        hits = len([r for r in results if r is not None])
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]], namespace: str = "") -> None:
+        """Store vectors, evicting least recently used entries once the cache is full."""
+        array = np.asarray(vectors, dtype=np.float32)
+        if array.ndim != 2 or len(array) != len(texts):
+            raise ValueError("Expected one vector per text")
+        rows = {self._key(text, namespace): i for i, text in enumerate(texts)}
+        with self._lock:
+            # take the write lock up front so concurrent processes don't hand out the same slot
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self.dim is None:
+                    self.dim = array.shape[1]
+                    self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?), ('dtype', ?)", (str(self.dim), self.dtype.name))
+                elif array.shape[1] != self.dim:
+                    raise ValueError(f"Cache for {self.model_id} holds {self.dim}-d vectors, got {array.shape[1]}-d")
+
+                existing = self._lookup(list(rows))
+                new_keys = [key for key in rows if key not in existing]
+                next_slot = int(self._meta("next_slot", "0"))
+                fresh = min(len(new_keys), self.max_entries - next_slot)
+                slots = {key: next_slot + i for i, key in enumerate(new_keys[:fresh])}
+                next_slot += fresh
+                if len(new_keys) > fresh:
+                    evicted = self._db.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (len(new_keys) - fresh,)
+                    ).fetchall()
+                    self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    slots.update((key, slot) for key, (_, slot) in zip(new_keys[fresh:], evicted))
+                    logger.debug(f"Evicted {len(evicted)} entries from embedding cache {self.path}")
+
+                mapped = self._open_vectors(min_slots=next_slot)
+                encoded = to_storage(array, self.dtype.name)
+                for key, slot in slots.items():
+                    mapped[slot] = encoded[rows[key]]
+                # vectors hit the disk before the index points at them
+                mapped.flush()
+                now = time.time()
+                self._db.executemany(
+                    "INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                    [(key, slot, now) for key, slot in slots.items()],
+                )
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('next_slot', ?)", (str(next_slot),))
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+        namespace: str = "",
+    ) -> List[np.ndarray]:
+        """Return vectors for `texts`, calling `embed_fn` only on the texts not in the cache."""
+        cached = self.get_many(texts, namespace)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        misses = sum(vector is None for vector in cached)
+        telemetry.cache_lookup("embedding", hit=True, n=len(texts) - misses)
+        telemetry.cache_lookup("embedding", hit=False, n=misses)
+        if missing:
+            with telemetry.span("embed", texts=len(missing)):
+                computed = dict(zip(missing, np.asarray(embed_fn(missing), dtype=np.float32)))
+            self.put_many(list(computed), list(computed.values()), namespace)
+            cached = [vector if vector is not None else computed[text] for text, vector in zip(texts, cached)]
+        return cached
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.executescript("DELETE FROM entries; DELETE FROM meta;")
+            self._db.commit()
+            self._vectors = None
+            self._vectors_path.unlink(missing_ok=True)
+            self.dim = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._db.close()
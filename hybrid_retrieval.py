@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import math
+import heapq
+import asyncio
+import threading
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# small on purpose: item numbers, scale terms and short clinical words must stay searchable
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which with".split()
+)
+
+_TOKEN = re.compile(r"\w+(?:[-.']\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; keeps hyphenated/dotted terms like 'y-bocs' or '1.2' together."""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Incrementally updatable Okapi BM25 inverted index over chunk IDs.
+
+    Only term statistics are kept; callers map the returned IDs back to their own chunks
+    (a llama-index docstore, a ChromaDB collection, ...).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._doc_terms: Dict[str, Dict[str, int]] = {}  # doc id -> term frequencies
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term -> {doc id: tf}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_terms
+
+    def ids(self) -> List[str]:
+        return list(self._doc_terms)
+
+    def _add_terms(self, doc_id: str, terms: Dict[str, int]) -> None:
+        self._doc_terms[doc_id] = terms
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+        length = sum(terms.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Add a chunk, replacing any earlier version with the same ID."""
+        with self._lock:
+            self.remove(doc_id)
+            self._add_terms(doc_id, dict(Counter(tokenize(text))))
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        with self._lock:
+            for doc_id, text in items:
+                self.add(doc_id, text)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (doc id, BM25 score) pairs for the query."""
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = {"k1": self.k1, "b": self.b, "docs": self._doc_terms}
+        # the directory may not exist yet, e.g. PERSIST_DIR when the index is served from a snapshot
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        for doc_id, terms in data["docs"].items():
+            index._add_terms(doc_id, terms)
+        return index
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[str]], k: int = 60, weights: Optional[Sequence[float]] = None
+) -> List[Tuple[str, float]]:
+    """Fuse ranked ID lists with RRF: score(d) = sum_i w_i / (k + rank_i(d))."""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+async def hybrid_search(
+    query: str,
+    bm25: BM25Index,
+    dense_search: Callable[[str], Awaitable[List[str]]],
+    top_k: int,
+    candidate_k: int = 20,
+    rrf_k: int = 60,
+) -> List[Tuple[str, float]]:
+    """Run lexical and dense search concurrently and fuse their ID rankings with RRF.
+
+    `dense_search` returns up to `candidate_k` IDs, best first.
+    """
+    lexical, dense = await asyncio.gather(asyncio.to_thread(bm25.search, query, candidate_k), dense_search(query))
+    return reciprocal_rank_fusion([dense, [doc_id for doc_id, _ in lexical]], k=rrf_k)[:top_k]
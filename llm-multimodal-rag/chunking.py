@@ -0,0 +1,198 @@
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List
+
+from context_packing import count_tokens
+from parsing import ParsedPage
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_TABLE_ROW = re.compile(r"^\s*\|")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+@dataclass
+class Block:
+    """A unit of markdown that is never split unless it is larger than a whole chunk."""
+
+    kind: str  # "heading", "table", "code" or "text"
+    text: str
+    page: int
+    level: int = 0  # heading level
+
+
+@dataclass
+class Chunk:
+    text: str
+    pages: List[int]
+    section: str
+    tokens: int
+    image_paths: List[str] = field(default_factory=list)
+
+
+def iter_blocks(markdown: str, page: int) -> Iterator[Block]:
+    """Split one page of markdown into headings, tables, code blocks and paragraphs.
+
+    Horizontal rules are separators only: they end a paragraph but never a page.
+    """
+    lines: List[str] = []
+    kind = "text"
+
+    def flush():
+        text = "\n".join(lines).strip()
+        lines.clear()
+        return Block(kind, text, page) if text else None
+
+    for line in markdown.splitlines():
+        if kind == "code":
+            lines.append(line)
+            if line.strip().startswith("```"):
+                if block := flush():
+                    yield block
+                kind = "text"
+            continue
+        if line.strip().startswith("```"):
+            if block := flush():
+                yield block
+            kind = "code"
+            lines.append(line)
+            continue
+        if _TABLE_ROW.match(line):
+            if kind != "table" and (block := flush()):
+                yield block
+            kind = "table"
+            lines.append(line)
+            continue
+        if kind == "table":
+            if block := flush():
+                yield block
+            kind = "text"
+        if heading := _HEADING.match(line):
+            if block := flush():
+                yield block
+            yield Block("heading", line.strip(), page, level=len(heading.group(1)))
+        elif not line.strip() or _RULE.match(line):
+            if block := flush():
+                yield block
+        else:
+            lines.append(line)
+    if block := flush():
+        yield block
+
+
+class MarkdownChunker:
+    """Streaming, structure-aware chunker over parsed pages.
+
+    Chunks never cross a heading of `section_level` or above, keep tables and code blocks
+    whole where they fit (oversized tables are split by rows, repeating the header), and
+    hold at most `chunk_tokens` tokens (plus the headings that open a section). Consecutive chunks within a section share about
+    `overlap_tokens` tokens of trailing text. Each chunk records every page it spans, so
+    page numbers and page images stay accurate however the text is split.
+
+    Pages are consumed lazily and chunks are yielded as soon as they are complete.
+    """
+
+    def __init__(self, chunk_tokens: int = 384, overlap_tokens: int = 48, section_level: int = 2) -> None:
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.section_level = section_level
+
+    def _split_block(self, block: Block) -> Iterator[Block]:
+        """Cut a block larger than a chunk into pieces that fit a chunk along with its overlap."""
+        limit = self.chunk_tokens - self.overlap_tokens
+        if block.kind == "table":
+            rows = block.text.splitlines()
+            header = rows[:2] if len(rows) > 1 and _TABLE_SEPARATOR.match(rows[1]) else rows[:1]
+            budget = limit - count_tokens("\n".join(header))
+            piece: List[str] = []
+            size = 0
+            for row in rows[len(header):]:
+                row_tokens = count_tokens(row) + 1
+                if piece and size + row_tokens > budget:
+                    yield Block("table", "\n".join(header + piece), block.page)
+                    piece, size = [], 0
+                piece.append(row)
+                size += row_tokens
+            if piece:
+                yield Block("table", "\n".join(header + piece), block.page)
+            return
+        # prose and code: by sentence, and by words for sentences that are still too long
+        units = _SENTENCE_END.split(block.text) if block.kind == "text" else block.text.splitlines()
+        piece, size = [], 0
+        for unit in units:
+            unit_tokens = count_tokens(unit)
+            if unit_tokens > limit:
+                words = unit.split()
+                step = max(1, len(words) * limit // (2 * unit_tokens))
+                units_of_words = [" ".join(words[i : i + step]) for i in range(0, len(words), step)]
+            else:
+                units_of_words = [unit]
+            for text in units_of_words:
+                text_tokens = count_tokens(text) if len(units_of_words) > 1 else unit_tokens
+                if piece and size + text_tokens > limit:
+                    yield Block(block.kind, (" " if block.kind == "text" else "\n").join(piece), block.page)
+                    piece, size = [], 0
+                piece.append(text)
+                size += text_tokens
+        if piece:
+            yield Block(block.kind, (" " if block.kind == "text" else "\n").join(piece), block.page)
+
+    def _overlap(self, blocks: List[Block]) -> List[Block]:
+        """Trailing prose of a finished chunk, carried into the next one."""
+        if not self.overlap_tokens or not blocks or blocks[-1].kind != "text":
+            return []
+        words = blocks[-1].text.split()
+        tail: List[str] = []
+        while words and count_tokens(" ".join(tail)) < self.overlap_tokens:
+            tail.insert(0, words.pop())
+        return [Block("text", " ".join(tail), blocks[-1].page)] if words else []
+
+    def chunk_pages(self, pages: Iterable[ParsedPage]) -> Iterator[Chunk]:
+        """Yield the chunks of one document, given its pages in order."""
+        headings: List[Block] = []  # the current heading path
+        current: List[Block] = []
+        size = 0
+        has_content = False  # the chunk holds more than headings and overlap
+        page_images: dict = {}  # only for pages the current chunk may still reach
+
+        def emit() -> Chunk:
+            pages_spanned = sorted({b.page for b in current})
+            return Chunk(
+                text="\n\n".join(b.text for b in current),
+                pages=pages_spanned,
+                section=" > ".join(_HEADING.match(h.text).group(2) for h in headings),
+                tokens=size,
+                image_paths=[path for p in pages_spanned for path in page_images.get(p, [])],
+            )
+
+        for page in pages:
+            page_images = {p: paths for p, paths in page_images.items() if any(b.page == p for b in current)}
+            page_images[page.page_number] = page.image_paths
+            for block in iter_blocks(page.markdown or page.text, page.page_number):
+                if block.kind == "heading":
+                    if block.level <= self.section_level and has_content:
+                        yield emit()
+                        current, size, has_content = [], 0, False
+                    headings = [h for h in headings if h.level < block.level] + [block]
+                    # a heading stays with the content that follows it
+                    current.append(block)
+                    size += count_tokens(block.text)
+                    continue
+                block_tokens = count_tokens(block.text)
+                pieces = [block] if block_tokens <= self.chunk_tokens else list(self._split_block(block))
+                for piece in pieces:
+                    piece_tokens = block_tokens if piece is block else count_tokens(piece.text)
+                    if has_content and size + piece_tokens > self.chunk_tokens:
+                        yield emit()
+                        current = self._overlap(current)
+                        size = sum(count_tokens(b.text) for b in current)
+                        if size + piece_tokens > self.chunk_tokens:
+                            current, size = [], 0
+                    current.append(piece)
+                    size += piece_tokens
+                    has_content = True
+        if has_content:
+            yield emit()
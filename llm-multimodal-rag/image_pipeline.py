@@ -0,0 +1,134 @@
+import os
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+from llama_index.core.schema import ImageNode, NodeWithScore
+
+logger = logging.getLogger(__name__)
+
+
+def _dhash(image: Image.Image, size: int = 16) -> int:
+    """Difference hash: size*size bits saying whether each pixel is brighter than its right neighbour."""
+    pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+class ImagePipeline:
+    """Prepares the images of retrieved nodes before they are sent to the vision model.
+
+    Images are deduplicated across nodes by file content, and also by perceptual hash when
+    `max_hash_distance` is set (a Hamming distance out of `hash_size`**2 bits). Perceptual
+    dedupe is off by default: full-page renders of different text pages shrink to nearly the
+    same hash, so it would keep one page per query and drop the others. Images are then
+    optionally ranked by the best retrieval score of the nodes that reference them, capped
+    at `max_images`, and downscaled/re-encoded so that their longest side is at most
+    `max_side` pixels. Re-encoded files are cached in `cache_dir`.
+    """
+
+    def __init__(
+        self,
+        max_images: int = 4,
+        max_side: int = 768,
+        quality: int = 85,
+        cache_dir: str = "llm_images_cache",
+        max_hash_distance: Optional[int] = None,
+        hash_size: int = 16,
+        rank_by_score: bool = True,
+    ) -> None:
+        self.max_images = max_images
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_dir = Path(cache_dir)
+        self.max_hash_distance = max_hash_distance
+        self.hash_size = hash_size
+        self.rank_by_score = rank_by_score
+        # (path, size, mtime) -> (content hash, perceptual hash); images are hashed once per process
+        self._hashes: Dict[Tuple[str, int, float], Tuple[str, Optional[int]]] = {}
+
+    def _hash(self, path: str) -> Tuple[str, Optional[int]]:
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            content_hash = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+            perceptual_hash = None
+            if self.max_hash_distance is not None:
+                with Image.open(path) as image:
+                    perceptual_hash = _dhash(image, self.hash_size)
+            self._hashes[key] = (content_hash, perceptual_hash)
+        return self._hashes[key]
+
+    def _candidates(self, nodes: List[NodeWithScore]) -> List[Tuple[str, float]]:
+        """Unique image paths with the best score of any node referencing them, in retrieval order."""
+        scores: Dict[str, float] = {}
+        for n in nodes:
+            for image_path in n.metadata.get("image_paths", []):
+                scores[image_path] = max(scores.get(image_path, float("-inf")), n.score or 0.0)
+        candidates = list(scores.items())
+        if self.rank_by_score:
+            candidates.sort(key=lambda item: item[1], reverse=True)
+        return candidates
+
+    def _resize(self, path: str, content_hash: str) -> str:
+        """Downscale and re-encode an image as JPEG, reusing an earlier result from the cache."""
+        target = self.cache_dir / f"{content_hash[:24]}_{self.max_side}_q{self.quality}.jpg"
+        if not target.exists():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+                image.thumbnail((self.max_side, self.max_side), Image.Resampling.LANCZOS)
+                # per-thread temporary name: concurrent queries may resize the same image
+                tmp = target.with_suffix(f".{threading.get_ident()}.tmp")
+                image.save(tmp, format="JPEG", quality=self.quality, optimize=True)
+            os.replace(tmp, target)
+        return str(target)
+
+    def prefetch(self, nodes: List[NodeWithScore], limit: Optional[int] = None) -> None:
+        """Hash and downscale the images of candidate nodes ahead of process().
+
+        Meant to run while the candidates are still being reranked and packed; covers the
+        images of the first `limit` candidates (twice `max_images` by default), so that
+        process() on the final nodes mostly finds them hashed and on disk already.
+        Unreadable images are left for process() to report.
+        """
+        for image_path, _ in self._candidates(nodes)[: limit or 2 * self.max_images]:
+            try:
+                content_hash, _ = self._hash(image_path)
+                self._resize(image_path, content_hash)
+            except (OSError, Image.UnidentifiedImageError):
+                continue
+
+    def process(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """Turn the image paths of retrieved nodes into at most `max_images` ImageNodes."""
+        selected: List[NodeWithScore] = []
+        seen_content = set()
+        seen_perceptual: List[int] = []
+        for image_path, score in self._candidates(nodes):
+            if len(selected) >= self.max_images:
+                break
+            try:
+                content_hash, perceptual_hash = self._hash(image_path)
+            except (OSError, Image.UnidentifiedImageError) as e:
+                logger.warning(f"Skipping unreadable image {image_path}: {e}")
+                continue
+            if content_hash in seen_content:
+                continue
+            if perceptual_hash is not None and any(
+                (perceptual_hash ^ other).bit_count() <= self.max_hash_distance for other in seen_perceptual
+            ):
+                continue
+            seen_content.add(content_hash)
+            if perceptual_hash is not None:
+                seen_perceptual.append(perceptual_hash)
+            image_node = ImageNode(image_path=self._resize(image_path, content_hash), metadata={"source_image": image_path})
+            selected.append(NodeWithScore(node=image_node, score=score))
+        return selected
@@ -1,113 +1,274 @@
 import os
+import asyncio
+import logging
 # import torch
 # import requests
-import nest_asyncio
-from tqdm import tqdm
 from dotenv import load_dotenv
 
-from llama_parse import LlamaParse
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
-from llama_index.core.tools import QueryEngineTool
-from llama_index.core.agent import FunctionCallingAgentWorker
-
-from llm_pdf_functions import get_text_nodes, MultimodalQueryEngine
+from registry import shared
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 LLM_MODEL = "llama3.2-vision:11b" # # set LLama3.2-11b-visions as Ollama model
 LLAMA_CLOUD_API_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
 DOCS_PATH = "data/documents" # specify file path of docs
 VECTOR_MODEL = "BAAI/bge-small-en-v1.5" # set BAAI/bge-small-en-v1.5 as vector store embedding model 
+TOOL_CALLING_MODEL = "llama3.2:1b"
+# "hnsw" (approximate, needs hnswlib) or "flat" use the memory-mapped MmapVectorStore;
+# "simple" is llama-index's default in-memory store persisted as JSON;
+# "snapshot" serves read-only from the memory-mapped INDEX_SNAPSHOT file (see export_snapshot)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "hnsw")
+INDEX_SNAPSHOT = os.getenv("INDEX_SNAPSHOT", "storage_nodes.arrow")
+PERSIST_DIR = "storage_nodes" if VECTOR_STORE_BACKEND == "simple" else f"storage_nodes_{VECTOR_STORE_BACKEND}"
+# The local pymupdf backend works offline; set PARSE_BACKEND=llamaparse to use LlamaParse instead.
+PARSE_BACKEND = os.getenv("PARSE_BACKEND", "local")
+HYBRID_RETRIEVAL = True # fuse BM25 and dense results, helps with exact item numbers and scale terms
+CHUNK_TOKENS = 384 # chunk size for text nodes; smaller chunks give more precision per retrieved token
+CHUNK_OVERLAP_TOKENS = 48
+CONTEXT_TOKEN_BUDGET = 1500 # max tokens of retrieved text per prompt; prompt size drives the vision model's latency
+SIMILARITY_TOP_K = 5
+# over-fetch RERANK_CANDIDATES nodes, rescore them with a CPU cross-encoder and keep 1..SIMILARITY_TOP_K,
+# cut where the scores drop off; fewer chunks also means fewer page images for the vision model
+RERANK = True
+RERANK_CANDIDATES = 20
+# CPU embedding backend: "torch" (fp32 baseline), "torch-int8", "onnx" or "onnx-int8" (see embedding_backends.py)
+EMBED_BACKEND = os.getenv("YBOCS_EMBED_BACKEND", "torch")
+# dtype of vectors in the MmapVectorStore: "float32", "float16" or "int8"; fixed when the index is built
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
 
 # replace PDF file of interest
 # pdf_file = "RatingScales_YBOCS_m.pdf"
 
-print("Creating LLM Model")
-llm_model=Ollama(model=LLM_MODEL, request_timeout=500)
+# Everything below is created lazily, once per process, on first use (see registry.py):
+# importing this module no longer loads models, parses PDFs or builds the index.
 
-print("Creating Vector Model")
-vector_store_embedding = HuggingFaceEmbedding(model_name=VECTOR_MODEL)
+@shared("vision_llm")
+def get_llm():
+    from llama_index.llms.ollama import Ollama
 
-# llama-parse is async-first, running the async code in a notebook requires the use of nest_asyncio
-nest_asyncio.apply()
+    logger.info("Creating LLM Model")
+    return Ollama(model=LLM_MODEL, request_timeout=500)
 
-# Parsing raw pdf using LlamaParse for getting Json Structured Output
-print("Creating LlamaParse objects")
-not_from_cache = False
-parser_txt = LlamaParse(verbose=True, invalidate_cache=not_from_cache, result_type="text") # type: ignore
-parser_md = LlamaParse(verbose=True, invalidate_cache=not_from_cache, result_type="markdown") # type: ignore
+@shared("vector_store_embedding")
+def get_embed_model():
+    from embedding_backends import get_backend
+    from llm_pdf_functions import BackendEmbedding, CachedEmbedding
 
-# for file in DOCS_PATH:
-#     print(f"Parsing {file}")
-#     docs_text = parser_txt.load_data(file)
-#     print(f"Parsing PDF file...")
-#     md_json_objs = parser_md.get_json_result(file)
-#     md_json_list = md_json_objs[0]["pages"]
+    logger.info(f"Creating Vector Model ({EMBED_BACKEND} backend)")
+    # wrapped in the shared embedding cache, so rebuilding the index only embeds new text
+    return CachedEmbedding(BackendEmbedding(get_backend(VECTOR_MODEL, EMBED_BACKEND)))
 
-#     # extract images as a dict from parser
-#     image_dicts = parser_md.get_images(md_json_objs, download_path="llm_images")
+def build_text_nodes():
+    """Parse every PDF in DOCS_PATH and split it into text nodes with image metadata."""
+    import nest_asyncio
+    from chunking import MarkdownChunker
+    from llm_pdf_functions import get_text_nodes
+    from parsing import parse_documents
 
-docs_text = []
-md_json_objs =[]
-image_dicts = []
+    # llama-parse is async-first, running the async code in a notebook requires the use of nest_asyncio
+    nest_asyncio.apply()
 
-for file in tqdm(os.listdir(DOCS_PATH)):
-    if file.endswith(".pdf"):
-        print(f"Parsing text from {file}...")
-        docs_text += parser_txt.load_data(os.path.join(DOCS_PATH, file))
-        print(f"Parsing PDF file {file}...")
-        md_json_objs += parser_md.get_json_result(os.path.join(DOCS_PATH, file))
-        image_dicts += parser_md.get_images(md_json_objs[-1], download_path="llm_images")
+    # Parse every PDF in one pass (text, markdown and images together), in parallel worker processes.
+    # Results are cached per file hash in ./parse_cache, so re-runs only parse new or changed documents.
+    logger.info(f"Parsing documents with the {PARSE_BACKEND} backend")
+    pdf_files = [os.path.join(DOCS_PATH, file) for file in os.listdir(DOCS_PATH) if file.endswith(".pdf")]
+    parsed_docs = parse_documents(pdf_files, backend=PARSE_BACKEND)
 
-# this will split into pages
-text_nodes = get_text_nodes(docs_text, json_dicts=md_json_objs, image_dicts=image_dicts)
+    # split by headings, tables and token counts, keeping page numbers and page images accurate
+    return get_text_nodes(parsed_docs, chunker=MarkdownChunker(chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS))
 
 ## Build Index
 # Once the text nodes are ready, we feed into our vector store index abstraction, which will index these nodes into a simple in-memory vector store
-print("Creating index")
-index = None
-if not os.path.exists("storage_nodes"):
-    index = VectorStoreIndex(text_nodes, embed_model=vector_store_embedding) # type: ignore
-    # save index to disk
-    index.set_index_id("vector_index")
-    index.storage_context.persist("./storage_nodes")
-else:
+def _vector_store():
+    if VECTOR_STORE_BACKEND == "simple":
+        return None
+    from vector_store import MmapVectorStore
+
+    # vectors, node metadata and the ANN graph live in their own binary files, no JSON docstore to parse
+    return MmapVectorStore(os.path.join(PERSIST_DIR, "vectors"), backend=VECTOR_STORE_BACKEND, dtype=VECTOR_STORE_DTYPE)
+
+@shared("vector_index")
+def get_index():
+    from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+
+    logger.info("Creating index")
+    if VECTOR_STORE_BACKEND == "snapshot":
+        from vector_store import SnapshotVectorStore
+
+        # a replica: queries are answered from the mapped snapshot, nothing is parsed, embedded or loaded
+        vector_store = SnapshotVectorStore(INDEX_SNAPSHOT)
+        vector_store.snapshot.check_model(VECTOR_MODEL)
+        return VectorStoreIndex.from_vector_store(vector_store, embed_model=get_embed_model())
+    vector_store = _vector_store()
+    if not os.path.exists(os.path.join(PERSIST_DIR, "index_store.json")):
+        # documents are only parsed when there is no persisted index to load
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        index = VectorStoreIndex(build_text_nodes(), storage_context=storage_context, embed_model=get_embed_model()) # type: ignore
+        # save index to disk
+        index.set_index_id("vector_index")
+        index.storage_context.persist(PERSIST_DIR)
+        return index
     # rebuild storage context
-    storage_context = StorageContext.from_defaults(persist_dir="storage_nodes")
+    storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR, vector_store=vector_store)
     # load index
-    index = load_index_from_storage(storage_context, index_id="vector_index", embed_model=vector_store_embedding)
+    return load_index_from_storage(storage_context, index_id="vector_index", embed_model=get_embed_model())
+
+## Snapshots
+# One checksummed file with every node and its embedding: copy it to other nodes and either import it
+# (import_snapshot) or serve it directly with VECTOR_STORE_BACKEND=snapshot, without parsing or re-embedding
+def export_snapshot(path=INDEX_SNAPSHOT, dtype="float32"):
+    from vector_store import export_index_snapshot
+
+    info = export_index_snapshot(get_index(), path, model_id=VECTOR_MODEL, dtype=dtype)
+    logger.info(f"Exported {info.summary()}")
+    return info
+
+def import_snapshot(path=INDEX_SNAPSHOT):
+    """Build the persisted index in PERSIST_DIR from a snapshot instead of parsing and embedding the documents."""
+    from llama_index.core import StorageContext, VectorStoreIndex
+    from registry import registry
+    from snapshots import Snapshot
+    from vector_store import iter_snapshot_nodes
+
+    if os.path.exists(os.path.join(PERSIST_DIR, "index_store.json")):
+        raise FileExistsError(f"An index already exists in {PERSIST_DIR}; remove it before importing {path}")
+    snapshot = Snapshot.open(path, verify=True)
+    try:
+        snapshot.check_model(VECTOR_MODEL)
+        storage_context = StorageContext.from_defaults(vector_store=_vector_store())
+        index = VectorStoreIndex([], storage_context=storage_context, embed_model=get_embed_model())
+        rows = 0
+        for nodes in iter_snapshot_nodes(snapshot):
+            index.insert_nodes(nodes)  # nodes carry their embeddings, nothing is embedded
+            rows += len(nodes)
+        index.set_index_id("vector_index")
+        index.storage_context.persist(PERSIST_DIR)
+    finally:
+        snapshot.close()
+    logger.info(f"Imported {rows} nodes from {path} into {PERSIST_DIR}")
+    registry.reset("vector_index")
+    return index
 
 ### Build Multimodal Query Engine
 # We now use LlamaIndex abstractions to build a custom query engine. In contrast to a standard RAG query engine that will retrieve the text node and only put that into the prompt 
 # (response synthesis module), this custom query engine will also load the image document, and put both the text and image document into the response synthesis module.
 
-query_engine = MultimodalQueryEngine(
-    retriever=index.as_retriever(similarity_top_k=5), multi_modal_llm=llm_model
-)
+# BM25 index over the same nodes, persisted next to the vector index and topped up incrementally
+@shared("bm25_index")
+def get_bm25():
+    from hybrid_retrieval import BM25Index
+    from retrievers import sync_bm25
+
+    path = os.path.join(PERSIST_DIR, "bm25.json")
+    bm25 = BM25Index.load(path) if os.path.exists(path) else BM25Index()
+    if sync_bm25(bm25, get_index()):
+        bm25.save(path)
+    return bm25
+
+@shared("query_reranker")
+def get_reranker():
+    from reranking import AdaptiveReranker
+
+    logger.info("Creating Reranker")
+    return AdaptiveReranker(candidates=RERANK_CANDIDATES, max_k=SIMILARITY_TOP_K)
+
+def get_retriever(similarity_top_k=SIMILARITY_TOP_K):
+    if not HYBRID_RETRIEVAL:
+        return get_index().as_retriever(similarity_top_k=similarity_top_k)
+    from retrievers import HybridRetriever
+
+    return HybridRetriever(get_index(), get_bm25(), similarity_top_k=similarity_top_k)
+
+@shared("query_engine_parts")
+def _query_engine_parts():
+    from context_packing import ContextPacker
+    from image_pipeline import ImagePipeline
+    from query_cache import QueryCache
+
+    index = get_index()
+    return {
+        # repeated questions reuse the retrieved nodes and the LLM answer; cleared whenever the index changes
+        "query_cache": QueryCache(index),
+        # send at most 4 distinct, downscaled page images per query to the vision model
+        "image_pipeline": ImagePipeline(max_images=4, max_side=768),
+        # drop near-duplicate chunks and keep the best-scored ones that fit the token budget
+        "context_packer": ContextPacker(max_tokens=CONTEXT_TOKEN_BUDGET),
+        "reranker": get_reranker() if RERANK else None,
+        "retriever": get_retriever(similarity_top_k=RERANK_CANDIDATES if RERANK else SIMILARITY_TOP_K),
+    }
+
+@shared("query_engine")
+def get_query_engine():
+    from llm_pdf_functions import MultimodalQueryEngine
+
+    return MultimodalQueryEngine(multi_modal_llm=get_llm(), **_query_engine_parts())
+
+# same engine, but yields the answer token by token (use response.response_gen / response.print_response_stream())
+@shared("streaming_query_engine")
+def get_streaming_query_engine():
+    from llm_pdf_functions import MultimodalQueryEngine
+
+    return MultimodalQueryEngine(multi_modal_llm=get_llm(), streaming=True, **_query_engine_parts())
+
+@shared("multimodal_agent_worker")
+def get_agent_worker():
+    from llama_index.llms.ollama import Ollama
+    from llama_index.core.tools import QueryEngineTool
+    from llama_index.core.agent import FunctionCallingAgentWorker
+
+    logger.info("Building a Multimodal Agent")
+    llm_model_tool_calling=Ollama(model=TOOL_CALLING_MODEL)
+
+    # Tool for querying the engine to retrieve contextual information around user query
+    query_engine_tool = QueryEngineTool.from_defaults(
+        query_engine=get_query_engine(),
+        name="query_engine_tool",
+        description=(
+            "Useful for retrieving specific context from the data. Do NOT select if question asks for a summary of the data. "
+            "For a question with several independent parts, call it once per part."
+        ),
+    )
+
+    # Set-up the agent worker for calling query engine tools; with the async API (aquery/achat)
+    # the tool calls of one step are dispatched concurrently, each through the engine's acustom_query
+    return FunctionCallingAgentWorker.from_tools(
+            [query_engine_tool], llm=llm_model_tool_calling, verbose=True, allow_parallel_tool_calls=True
+            )
+
+@shared("multimodal_agent")
+def get_agent():
+    return get_agent_worker().as_agent()
+
+async def aquery_agent(query):
+    """Answer a question with the agent without blocking the event loop.
 
-print("Building a Multimodal Agent")
-llm_model_tool_calling=Ollama(model="llama3.2:1b")
+    Every call gets its own agent (and chat memory) over the shared worker, so concurrent
+    queries in one process never see each other's history.
+    """
+    return await get_agent_worker().as_agent().aquery(query)
 
-# Tool for querying the engine to retrieve contextual information around user query
-query_engine_tool = QueryEngineTool.from_defaults(
-    query_engine=query_engine,
-    name="query_engine_tool",
-    description=(
-        "Useful for retrieving specific context from the data. Do NOT select if question asks for a summary of the data."
-    ),
-)
+_LAZY_ATTRIBUTES = {
+    "llm_model": get_llm,
+    "vector_store_embedding": get_embed_model,
+    "index": get_index,
+    "query_engine": get_query_engine,
+    "streaming_query_engine": get_streaming_query_engine,
+    "agent": get_agent,
+}
 
-# Set-up the agent for calling query engine tools
-agent = FunctionCallingAgentWorker.from_tools(
-        [query_engine_tool], llm=llm_model_tool_calling, verbose=True
-        ).as_agent()
+def __getattr__(name):
+    # keeps `from llm_pdf import query_engine` etc. working, loading the object on first access
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     query = (
         "What are compulsions?"
     )
-    response = agent.query(query)
+    response = asyncio.run(aquery_agent(query))
     print(response)
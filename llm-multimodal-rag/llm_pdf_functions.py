@@ -1,15 +1,33 @@
-from typing import Optional
+import os
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
 from llama_index.llms.ollama import Ollama
 from pathlib import Path
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
 from llama_index.core.schema import TextNode
 from llama_index.core.query_engine import CustomQueryEngine
 from llama_index.core.retrievers import BaseRetriever
 from llama_index.core.prompts import PromptTemplate
-from llama_index.core.base.response.schema import Response
+from llama_index.core.base.response.schema import AsyncStreamingResponse, Response, StreamingResponse
 from llama_index.core.schema import ImageNode, NodeWithScore, MetadataMode
 
+from chunking import MarkdownChunker
+from context_packing import ContextPacker, count_tokens
+from embedding_backends import EmbeddingBackend
+from embedding_cache import DEFAULT_CACHE_DIR, EmbeddingCache
+from image_pipeline import ImagePipeline
+from query_cache import QueryCache
+from reranking import AdaptiveReranker
+from retrievers import retrieve_batch
 from system_prompt import QA_PROMPT
+import telemetry
+
+# copies of the node text (and file paths) kept in metadata for the UI; never useful to the LLM or the embedding
+REDUNDANT_METADATA_KEYS = ["parsed_text", "parsed_text_markdown", "image_paths"]
 
 def create_image_index(image_dicts):
     """
@@ -32,71 +50,403 @@ def create_image_index(image_dicts):
 
     return image_index
 
-# attach image metadata to the text nodes
-def get_text_nodes(docs, json_dicts=None, image_dicts=None):
-    """Split docs into nodes, by separator and attach image metadata to the text nodes"""
-    nodes = []
-    image_index = create_image_index(image_dicts) if image_dicts is not None else {}
-    print("Image index: ", image_index)
-    md_texts = [d["md"] for d in json_dicts] if (json_dicts is not None or json_dicts != {}) else None
-
-    doc_chunks = [c for d in docs for c in d.text.split("---")]
-    page_num = 0
-    chunk_index = 0
-    while chunk_index < len(doc_chunks):
-        page_num += 1
-        chunk_metadata = {"page_num": page_num, "image_paths": []}
-        if image_index.get(page_num):
-            for image in image_index[page_num]:
-                chunk_metadata["image_paths"].append(str(image))
-        if md_texts is not None:
-            chunk_metadata["parsed_text_markdown"] = md_texts[chunk_index]
-        chunk_metadata["parsed_text"] = doc_chunks[chunk_index]
-        node = TextNode(text=doc_chunks[chunk_index], metadata=chunk_metadata)
-        nodes.append(node)
-        chunk_index += 1
-    return nodes
+def iter_text_nodes(parsed_docs, chunker=None):
+    """Chunk parsed documents into text nodes, one document and one page at a time.
+
+    Each node carries the pages it spans (`page_num` to `page_end`), its section heading
+    path and the images of those pages.
+    """
+    chunker = chunker or MarkdownChunker()
+    for parsed in parsed_docs:
+        start = time.perf_counter()
+        for chunk_index, chunk in enumerate(chunker.chunk_pages(parsed.pages)):
+            yield TextNode(
+                text=chunk.text,
+                metadata={
+                    "file_name": os.path.basename(parsed.file_path),
+                    "page_num": chunk.pages[0],
+                    "page_end": chunk.pages[-1],
+                    "section": chunk.section,
+                    "chunk_index": chunk_index,
+                    "image_paths": chunk.image_paths,
+                },
+                excluded_llm_metadata_keys=REDUNDANT_METADATA_KEYS + ["chunk_index"],
+                excluded_embed_metadata_keys=REDUNDANT_METADATA_KEYS + ["chunk_index", "page_end"],
+            )
+        # includes time spent by the consumer between chunks when it embeds as it goes
+        telemetry.record_stage("chunk", time.perf_counter() - start, source=parsed.file_path)
+
+def get_text_nodes(parsed_docs, chunker=None):
+    """Split parsed documents into page-accurate text nodes with image metadata attached"""
+    return list(iter_text_nodes(parsed_docs, chunker))
+
+class BackendEmbedding(BaseEmbedding):
+    """llama-index embedding model running one of the CPU backends in embedding_backends.py.
+
+    Texts of a batch are length-bucketed by the backend, so `embed_batch_size` can be large.
+    """
+
+    _backend: EmbeddingBackend = PrivateAttr()
+
+    def __init__(self, backend: EmbeddingBackend, embed_batch_size: int = 256, **kwargs) -> None:
+        super().__init__(model_name=backend.model_id, embed_batch_size=embed_batch_size, **kwargs)
+        self._backend = backend
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BackendEmbedding"
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._backend.embed(texts).tolist()
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._backend.embed_queries([query])[0].tolist()
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[Embedding]:
+        """Embed many queries in one length-bucketed backend call (llama-index only batches texts)."""
+        return self._backend.embed_queries(list(queries)).tolist()
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Wraps a llama-index embedding model with the shared on-disk embedding cache.
+
+    Only text that is not already cached for this model gets embedded, so rebuilding or
+    re-chunking the index is cheap. Queries are cached separately, since models such as
+    bge embed queries with an instruction prefix.
+    """
+
+    embed_model: BaseEmbedding
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache_dir: str = DEFAULT_CACHE_DIR, cache_dtype: str = "float32", **kwargs) -> None:
+        super().__init__(
+            embed_model=embed_model,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._cache = EmbeddingCache(model_id=embed_model.model_name, cache_dir=cache_dir, dtype=cache_dtype)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        vectors = self._cache.embed(texts, self.embed_model.get_text_embedding_batch)
+        return [vector.tolist() for vector in vectors]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self.get_query_embedding_batch([query])[0]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[Embedding]:
+        """Embed many queries at once; the ones not cached go to the wrapped model in a single batch if it supports that."""
+        embed = getattr(self.embed_model, "get_query_embedding_batch", None) or (
+            lambda queries: [self.embed_model.get_query_embedding(q) for q in queries]
+        )
+        return [vector.tolist() for vector in self._cache.embed(list(queries), embed, namespace="query")]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        # the cache lookup and a miss's forward pass both run in a worker thread, off the event loop
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+@dataclass
+class PreparedContext:
+    """The packed text context and the images of a set of retrieved nodes, ready to be put into prompts."""
+
+    nodes: List[NodeWithScore]
+    context_str: str
+    stats: dict
+    image_nodes: List[NodeWithScore]
+
 
 class MultimodalQueryEngine(CustomQueryEngine):
     """Custom multimodal Query Engine.
 
     Takes in a retriever to retrieve a set of document nodes.
     Also takes in a prompt template and multimodal model.
+    With `streaming=True` queries return a StreamingResponse whose `response_gen`
+    yields the answer token by token as the model produces it. An optional
+    ImagePipeline dedups, ranks, caps and downscales images before the model call.
+    An optional ContextPacker drops near-duplicate chunks and fits the context into a
+    token budget; the tokens sent are reported in the response metadata.
+    An optional AdaptiveReranker rescores the retrieved candidates with a cross-encoder
+    and keeps only the clearly relevant ones (give the retriever a larger top k to over-fetch).
+    `aquery()` runs the same pipeline without blocking the event loop: the candidates'
+    images are loaded while they are reranked and packed, and the model is called through
+    Ollama's async client (streaming engines return an AsyncStreamingResponse).
 
     """
 
     qa_prompt: PromptTemplate
     retriever: BaseRetriever
     multi_modal_llm: Ollama
+    query_cache: Optional[QueryCache] = None
+    streaming: bool = False
+    image_pipeline: Optional[ImagePipeline] = None
+    context_packer: Optional[ContextPacker] = None
+    reranker: Optional[AdaptiveReranker] = None
 
     def __init__(self, qa_prompt: Optional[PromptTemplate] = None, **kwargs) -> None:
         """Initialize."""
         super().__init__(qa_prompt=qa_prompt or QA_PROMPT, **kwargs)
 
-    def custom_query(self, query_str: str):
-        # retrieve text nodes
+    def _retrieve(self, query_str: str):
+        """Retrieve (and rerank) text nodes, or reuse the node IDs kept for the same query earlier."""
+        nodes = self.query_cache.get_nodes(query_str) if self.query_cache else None
+        if nodes is not None:
+            return nodes, True
         nodes = self.retriever.retrieve(query_str)
-        # create ImageNode items from text nodes
-        image_nodes = [
+        if self.reranker is not None:
+            nodes = self._rerank(query_str, nodes)
+        if self.query_cache:
+            self.query_cache.put_nodes(query_str, nodes)
+        return nodes, False
+
+    async def _aretrieve(self, query_str: str) -> Tuple[List[NodeWithScore], bool, Optional[asyncio.Task]]:
+        """Async _retrieve, which also starts loading the candidates' images in the background.
+
+        Returns the nodes, whether they came from the query cache, and the image prefetch task
+        (None without an image pipeline), which runs while the candidates are reranked.
+        """
+        nodes = self.query_cache.get_nodes(query_str) if self.query_cache else None
+        if nodes is not None:
+            return nodes, True, self._prefetch_images(nodes)
+        nodes = await self.retriever.aretrieve(query_str)
+        prefetch = self._prefetch_images(nodes)
+        if self.reranker is not None:
+            nodes = await asyncio.to_thread(self._rerank, query_str, nodes)
+        if self.query_cache:
+            self.query_cache.put_nodes(query_str, nodes)
+        return nodes, False, prefetch
+
+    def _rerank(self, query_str: str, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        with telemetry.span("rerank", pipeline="llm_pdf") as span:
+            reranked = self.reranker.rerank(
+                query_str, nodes, lambda n: n.node.get_content(metadata_mode=MetadataMode.NONE)
+            )
+            span.set(**reranked.stats())
+        return [NodeWithScore(node=n.node, score=score) for n, score in zip(reranked.items, reranked.scores)]
+
+    def _prefetch_images(self, nodes: List[NodeWithScore]) -> Optional[asyncio.Task]:
+        if self.image_pipeline is None:
+            return None
+        return asyncio.create_task(asyncio.to_thread(self.image_pipeline.prefetch, nodes))
+
+    @staticmethod
+    def _node_context(node: NodeWithScore) -> str:
+        """The node as the LLM sees it, without the redundant text copies in its metadata
+        (nodes indexed before those keys were excluded still carry them)."""
+        excluded = set(node.node.excluded_llm_metadata_keys) | set(REDUNDANT_METADATA_KEYS)
+        if excluded.issubset(node.node.excluded_llm_metadata_keys):
+            return node.node.get_content(metadata_mode=MetadataMode.LLM)
+        return node.node.model_copy(update={"excluded_llm_metadata_keys": list(excluded)}).get_content(
+            metadata_mode=MetadataMode.LLM
+        )
+
+    def _pack(self, nodes):
+        """Pack the text nodes into the context string.
+
+        Returns the text nodes actually used, the context string and the context stats.
+        """
+        if self.context_packer is not None:
+            packed = self.context_packer.pack(nodes, self._node_context, score=lambda n: n.score)
+            return packed.items, packed.text, packed.stats()
+        texts = [self._node_context(n) for n in nodes]
+        context_str = "\n\n".join(texts)
+        return nodes, context_str, {"tokens": count_tokens(context_str), "chunks": len(nodes)}
+
+    def _format_prompt(self, query_str: str, context_str: str, context_stats: dict):
+        # dump the context string into the prompt
+        fmt_prompt = self.qa_prompt.format(context_str=context_str, query_str=query_str)
+        return fmt_prompt, {**context_stats, "prompt_tokens": count_tokens(fmt_prompt)}
+
+    def _image_nodes(self, nodes) -> List[NodeWithScore]:
+        """Create ImageNode items from the text nodes' images."""
+        if self.image_pipeline is not None:
+            return self.image_pipeline.process(nodes)
+        return [
             NodeWithScore(node=ImageNode(image_path=image_path))
             for n in nodes for image_path in n.metadata.get("image_paths", [])
         ]
 
-        # create context string from text nodes, dump into the prompt
-        context_str = "\n\n".join(
-            [r.get_content(metadata_mode=MetadataMode.LLM) for r in nodes]
-        )
-        fmt_prompt = self.qa_prompt.format(context_str=context_str, query_str=query_str)
+    def _build_prompt(self, query_str: str, nodes):
+        """Format the QA prompt from the text nodes and collect their images.
+
+        Returns the prompt, the image nodes, the text nodes actually used and the context stats.
+        """
+        nodes, context_str, context_stats = self._pack(nodes)
+        fmt_prompt, context_stats = self._format_prompt(query_str, context_str, context_stats)
+        return fmt_prompt, self._image_nodes(nodes), nodes, context_stats
+
+    def _stream_answer(self, fmt_prompt: str, image_docs, cached: Optional[str]):
+        """Yield answer tokens as they arrive, caching the full answer once the stream ends."""
+        if cached is not None:
+            yield cached
+            return
+        image_paths = [image_doc.image_path for image_doc in image_docs]
+        tokens = []
+        start = time.perf_counter()
+        for chunk in self.multi_modal_llm.stream_complete(prompt=fmt_prompt, image_documents=image_docs):
+            if not tokens:
+                telemetry.record_stage("llm_ttft", time.perf_counter() - start, pipeline="llm_pdf")
+            tokens.append(chunk.delta or "")
+            yield chunk.delta or ""
+        telemetry.record_stage("llm_total", time.perf_counter() - start, pipeline="llm_pdf")
+        if self.query_cache:
+            self.query_cache.put_answer(fmt_prompt, image_paths, self.multi_modal_llm.model, "".join(tokens))
+
+    async def _astream_answer(self, fmt_prompt: str, image_docs, cached: Optional[str]):
+        """Async _stream_answer."""
+        if cached is not None:
+            yield cached
+            return
+        image_paths = [image_doc.image_path for image_doc in image_docs]
+        tokens = []
+        start = time.perf_counter()
+        async for chunk in await self.multi_modal_llm.astream_complete(prompt=fmt_prompt, image_documents=image_docs):
+            if not tokens:
+                telemetry.record_stage("llm_ttft", time.perf_counter() - start, pipeline="llm_pdf")
+            tokens.append(chunk.delta or "")
+            yield chunk.delta or ""
+        telemetry.record_stage("llm_total", time.perf_counter() - start, pipeline="llm_pdf")
+        if self.query_cache:
+            self.query_cache.put_answer(fmt_prompt, image_paths, self.multi_modal_llm.model, "".join(tokens))
+
+    def custom_query(self, query_str: str):
+        with telemetry.span("retrieve", pipeline="llm_pdf") as span:
+            nodes, retrieval_hit = self._retrieve(query_str)
+            span.set(nodes=len(nodes), cache_hit=retrieval_hit)
+        with telemetry.span("context_build", pipeline="llm_pdf") as span:
+            fmt_prompt, image_nodes, nodes, context_stats = self._build_prompt(query_str, nodes)
+            span.set(images=len(image_nodes), **context_stats)
+        telemetry.count("llm_tokens_total", context_stats["prompt_tokens"], pipeline="llm_pdf", kind="prompt")
+        telemetry.count("llm_images_total", len(image_nodes), pipeline="llm_pdf")
 
         image_docs = [image_node.node for image_node in image_nodes]
-        # synthesize an answer from formatted text and images
-        llm_response = self.multi_modal_llm.complete(
-            prompt=fmt_prompt,
-            image_documents=image_docs
+        image_paths = [image_doc.image_path for image_doc in image_docs]
+        answer = (
+            self.query_cache.get_answer(fmt_prompt, image_paths, self.multi_modal_llm.model)
+            if self.query_cache else None
         )
-        return Response(
-            response=str(llm_response),
-            source_nodes=nodes,
-            metadata={"text_nodes": text_nodes, "image_nodes": image_nodes},
+        metadata = {
+            "text_nodes": nodes,
+            "image_nodes": image_nodes,
+            "cache": {"retrieval_hit": retrieval_hit, "answer_hit": answer is not None},
+            "context": context_stats,
+        }
+        if self.streaming:
+            return StreamingResponse(
+                response_gen=self._stream_answer(fmt_prompt, image_docs, answer),
+                source_nodes=nodes,
+                metadata=metadata,
+            )
+
+        if answer is None:
+            # synthesize an answer from formatted text and images
+            with telemetry.span("llm_total", pipeline="llm_pdf"):
+                llm_response = self.multi_modal_llm.complete(
+                    prompt=fmt_prompt,
+                    image_documents=image_docs
+                )
+            answer = str(llm_response)
+            telemetry.count("llm_tokens_total", count_tokens(answer), pipeline="llm_pdf", kind="completion")
+            if self.query_cache:
+                self.query_cache.put_answer(fmt_prompt, image_paths, self.multi_modal_llm.model, answer)
+        return Response(response=answer, source_nodes=nodes, metadata=metadata)
+
+    async def acustom_query(self, query_str: str):
+        with telemetry.span("retrieve", pipeline="llm_pdf") as span:
+            nodes, retrieval_hit, prefetch = await self._aretrieve(query_str)
+            span.set(nodes=len(nodes), cache_hit=retrieval_hit)
+        context = await self.aprepare(nodes, prefetch)
+        return await self.aanswer(query_str, context, retrieval_hit)
+
+    def retrieve_batch(self, query_strs: List[str]) -> List[Tuple[List[NodeWithScore], bool]]:
+        """_retrieve for many queries at once.
+
+        Queries in the query cache reuse their nodes; the rest are embedded in one batch and
+        searched in one vectorized pass (see retrievers.retrieve_batch), then reranked one by one.
+        """
+        results: List[Optional[Tuple[List[NodeWithScore], bool]]] = [None] * len(query_strs)
+        if self.query_cache:
+            for i, query_str in enumerate(query_strs):
+                nodes = self.query_cache.get_nodes(query_str)
+                if nodes is not None:
+                    results[i] = (nodes, True)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            with telemetry.span("retrieve_batch", pipeline="llm_pdf", queries=len(missing)):
+                retrieved = retrieve_batch(self.retriever, [query_strs[i] for i in missing])
+            for i, nodes in zip(missing, retrieved):
+                if self.reranker is not None:
+                    nodes = self._rerank(query_strs[i], nodes)
+                if self.query_cache:
+                    self.query_cache.put_nodes(query_strs[i], nodes)
+                results[i] = (nodes, False)
+        return results
+
+    async def aprepare(self, nodes: List[NodeWithScore], prefetch: Optional[asyncio.Task] = None) -> PreparedContext:
+        """Pack the retrieved nodes and load their images, off the event loop.
+
+        The result only depends on the nodes, so queries that retrieved the same nodes can share it.
+        """
+        with telemetry.span("context_build", pipeline="llm_pdf") as span:
+            nodes, context_str, context_stats = await asyncio.to_thread(self._pack, nodes)
+            if prefetch is not None:
+                await prefetch
+            image_nodes = await asyncio.to_thread(self._image_nodes, nodes)
+            span.set(images=len(image_nodes), **context_stats)
+        return PreparedContext(nodes, context_str, context_stats, image_nodes)
+
+    async def aanswer(self, query_str: str, context: PreparedContext, retrieval_hit: bool = False):
+        """Answer a query from a prepared context with Ollama's async client."""
+        fmt_prompt, context_stats = self._format_prompt(query_str, context.context_str, context.stats)
+        nodes, image_nodes = context.nodes, context.image_nodes
+        telemetry.count("llm_tokens_total", context_stats["prompt_tokens"], pipeline="llm_pdf", kind="prompt")
+        telemetry.count("llm_images_total", len(image_nodes), pipeline="llm_pdf")
+
+        image_docs = [image_node.node for image_node in image_nodes]
+        image_paths = [image_doc.image_path for image_doc in image_docs]
+        answer = (
+            self.query_cache.get_answer(fmt_prompt, image_paths, self.multi_modal_llm.model)
+            if self.query_cache else None
         )
-    
\ No newline at end of file
+        metadata = {
+            "text_nodes": nodes,
+            "image_nodes": image_nodes,
+            "cache": {"retrieval_hit": retrieval_hit, "answer_hit": answer is not None},
+            "context": context_stats,
+        }
+        if self.streaming:
+            return AsyncStreamingResponse(
+                response_gen=self._astream_answer(fmt_prompt, image_docs, answer),
+                source_nodes=nodes,
+                metadata=metadata,
+            )
+
+        if answer is None:
+            with telemetry.span("llm_total", pipeline="llm_pdf"):
+                llm_response = await self.multi_modal_llm.acomplete(
+                    prompt=fmt_prompt,
+                    image_documents=image_docs
+                )
+            answer = str(llm_response)
+            telemetry.count("llm_tokens_total", count_tokens(answer), pipeline="llm_pdf", kind="completion")
+            if self.query_cache:
+                self.query_cache.put_answer(fmt_prompt, image_paths, self.multi_modal_llm.model, answer)
+        return Response(response=answer, source_nodes=nodes, metadata=metadata)
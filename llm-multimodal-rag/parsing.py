@@ -0,0 +1,168 @@
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pymupdf
+import pymupdf4llm
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+# bump when the parsed output changes shape, so stale cache entries are ignored
+PARSER_VERSION = 1
+DEFAULT_CACHE_DIR = "parse_cache"
+
+
+@dataclass
+class ParsedPage:
+    page_number: int  # 1-based, within its document
+    text: str
+    markdown: str
+    image_paths: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ParsedDocument:
+    file_path: str
+    file_hash: str
+    backend: str
+    pages: List[ParsedPage] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ParsedDocument":
+        pages = [ParsedPage(**page) for page in data.pop("pages")]
+        return cls(pages=pages, **data)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _save_image(doc: pymupdf.Document, xref: int, path: Path) -> None:
+    pix = pymupdf.Pixmap(doc, xref)
+    if pix.n - pix.alpha >= 4:  # CMYK: convert to RGB first
+        pix = pymupdf.Pixmap(pymupdf.csRGB, pix)
+    pix.save(str(path))
+
+
+def _parse_local(file_path: str, image_dir: Path, render_dpi: Optional[int]) -> List[ParsedPage]:
+    """Parse a PDF with pymupdf in one pass: plain text, markdown and images for every page."""
+    pages = []
+    image_dir.mkdir(parents=True, exist_ok=True)
+    with pymupdf.open(file_path) as doc:
+        md_pages = pymupdf4llm.to_markdown(doc, page_chunks=True, show_progress=False)
+        for page, md_page in zip(doc, md_pages):
+            image_paths = []
+            if render_dpi:
+                # a full-page render also captures vector diagrams and tables
+                path = image_dir / f"page{page.number + 1}.png"
+                page.get_pixmap(dpi=render_dpi).save(str(path))
+                image_paths.append(str(path))
+            else:
+                for i, image in enumerate(page.get_images(full=True)):
+                    path = image_dir / f"page{page.number + 1}_{i}.png"
+                    try:
+                        _save_image(doc, image[0], path)
+                    except Exception as e:
+                        logger.warning(f"Could not extract image {i} on page {page.number + 1} of {file_path}: {e}")
+                        continue
+                    image_paths.append(str(path))
+            pages.append(ParsedPage(page.number + 1, page.get_text(), md_page["text"], image_paths))
+    return pages
+
+
+def _parse_llamaparse(file_path: str, image_dir: Path) -> List[ParsedPage]:
+    """Parse a PDF with LlamaParse; one JSON result carries both the text and markdown of each page."""
+    from llama_parse import LlamaParse
+
+    parser = LlamaParse(verbose=False, result_type="markdown")  # type: ignore
+    json_objs = parser.get_json_result(file_path)
+    image_dicts = parser.get_images(json_objs, download_path=str(image_dir))
+    pages = []
+    for page in json_objs[0]["pages"]:
+        image_paths = [d["path"] for d in image_dicts if d.get("page_number") == page["page"]]
+        pages.append(ParsedPage(page["page"], page.get("text", ""), page.get("md", ""), image_paths))
+    return pages
+
+
+def parse_file(
+    file_path: str,
+    backend: str = "local",
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    render_dpi: Optional[int] = None,
+) -> ParsedDocument:
+    """Parse one PDF, or load it from the on-disk cache if this exact file was parsed before."""
+    digest = file_hash(file_path)
+    key = hashlib.sha256(f"{digest}:{backend}:{render_dpi}:{PARSER_VERSION}".encode()).hexdigest()[:32]
+    cache_path = Path(cache_dir) / f"{key}.json"
+    telemetry.cache_lookup("parse", hit=cache_path.exists())
+    if cache_path.exists():
+        with open(cache_path, "r", encoding="utf-8") as f:
+            parsed = ParsedDocument.from_dict(json.load(f))
+        # the cache is keyed by content, so the same file may have moved
+        parsed.file_path = file_path
+        return parsed
+
+    image_dir = Path(cache_dir) / key
+    with telemetry.span("parse", source=file_path, backend=backend) as span:
+        if backend == "local":
+            pages = _parse_local(file_path, image_dir, render_dpi)
+        elif backend == "llamaparse":
+            pages = _parse_llamaparse(file_path, image_dir)
+        else:
+            raise ValueError(f"Unknown parsing backend {backend!r}, expected 'local' or 'llamaparse'")
+        span.set(pages=len(pages))
+    parsed = ParsedDocument(file_path=file_path, file_hash=digest, backend=backend, pages=pages)
+
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(asdict(parsed), f)
+    os.replace(tmp_path, cache_path)
+    return parsed
+
+
+def parse_documents(
+    file_paths: List[str],
+    backend: str = "local",
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    workers: Optional[int] = None,
+    render_dpi: Optional[int] = None,
+) -> List[ParsedDocument]:
+    """Parse PDFs in parallel: worker processes for the local backend, threads for LlamaParse (network bound).
+
+    A file that fails to parse is logged and left out of the result, whether it was parsed in
+    a worker or (with one worker or one file) in this process.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    parsed: List[ParsedDocument] = []
+
+    def collect(path: str, result: Callable[[], ParsedDocument]) -> None:
+        try:
+            parsed.append(result())
+        except Exception as e:
+            logger.error(f"Error parsing {path}: {e}")
+
+    if workers == 1 or len(file_paths) <= 1:
+        for path in file_paths:
+            collect(path, partial(parse_file, path, backend, cache_dir, render_dpi))
+        return parsed
+
+    executor: Executor = ProcessPoolExecutor(workers) if backend == "local" else ThreadPoolExecutor(workers)
+    with executor:
+        futures = [executor.submit(parse_file, path, backend, cache_dir, render_dpi) for path in file_paths]
+        for path, future in zip(file_paths, futures):
+            collect(path, future.result)
+    return parsed
+
@@ -0,0 +1,97 @@
+import re
+import hashlib
+import logging
+import unicodedata
+from typing import Iterable, List, Optional
+
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.schema import NodeWithScore
+
+import telemetry
+from ttl_cache import TTLCache
+from vector_store import get_nodes_by_id
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query_str: str) -> str:
+    """Normalize a query so trivial variations (case, spacing, trailing punctuation) share a cache entry."""
+    query_str = unicodedata.normalize("NFC", query_str).casefold()
+    return re.sub(r"\s+", " ", query_str).strip().rstrip("?!. ")
+
+
+def index_fingerprint(index: BaseIndex) -> str:
+    """Cheap O(1) fingerprint of the index contents.
+
+    Inserting or deleting nodes changes either the node count or the last inserted node ID
+    (the index struct keeps nodes in insertion order), and loading another index changes the index ID.
+    Vector stores that keep the nodes themselves provide their own fingerprint.
+    """
+    fingerprint = getattr(getattr(index, "vector_store", None), "fingerprint", None)
+    if fingerprint is not None:
+        return f"{index.index_id}:{fingerprint()}"
+    nodes = getattr(index.index_struct, "nodes_dict", {})
+    last = next(reversed(nodes), "") if nodes else ""
+    return f"{index.index_id}:{len(nodes)}:{last}"
+
+
+class QueryCache:
+    """Two-level cache for MultimodalQueryEngine.
+
+    Level 1 maps a normalized query to the retrieved node IDs and scores, level 2 maps
+    (prompt, image set, model) to the LLM answer. Both levels are LRU with a TTL and are
+    cleared as soon as the index fingerprint changes.
+    """
+
+    def __init__(
+        self,
+        index: BaseIndex,
+        max_queries: int = 1024,
+        max_answers: int = 1024,
+        retrieval_ttl: Optional[float] = 3600.0,
+        answer_ttl: Optional[float] = 3600.0,
+    ) -> None:
+        self.index = index
+        self.retrievals = TTLCache(max_size=max_queries, ttl=retrieval_ttl)
+        self.answers = TTLCache(max_size=max_answers, ttl=answer_ttl)
+        self._fingerprint = index_fingerprint(index)
+
+    def _check_index(self) -> None:
+        fingerprint = index_fingerprint(self.index)
+        if fingerprint != self._fingerprint:
+            logger.info("Index changed, invalidating query cache")
+            self.invalidate()
+            self._fingerprint = fingerprint
+
+    def invalidate(self) -> None:
+        self.retrievals.clear()
+        self.answers.clear()
+
+    def get_nodes(self, query_str: str) -> Optional[List[NodeWithScore]]:
+        self._check_index()
+        hit = self.retrievals.get(normalize_query(query_str))
+        nodes = get_nodes_by_id(self.index, [node_id for node_id, _ in hit]) if hit is not None else None
+        if nodes is None or len(nodes) != len(hit) or any(node is None for node in nodes):
+            telemetry.cache_lookup("retrieval", hit=False)
+            return None
+        telemetry.cache_lookup("retrieval", hit=True)
+        return [NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, hit)]
+
+    def put_nodes(self, query_str: str, nodes: List[NodeWithScore]) -> None:
+        self.retrievals.put(normalize_query(query_str), [(n.node.node_id, n.score) for n in nodes])
+
+    @staticmethod
+    def _answer_key(prompt: str, image_paths: Iterable[str], model: str) -> tuple:
+        return hashlib.sha256(prompt.encode()).hexdigest(), tuple(sorted(set(image_paths))), model
+
+    def get_answer(self, prompt: str, image_paths: Iterable[str], model: str) -> Optional[str]:
+        self._check_index()
+        answer = self.answers.get(self._answer_key(prompt, image_paths, model))
+        telemetry.cache_lookup("answer", hit=answer is not None)
+        return answer
+
+    def put_answer(self, prompt: str, image_paths: Iterable[str], model: str, answer: str) -> None:
+        self.answers.put(self._answer_key(prompt, image_paths, model), answer)
+
+    def stats(self) -> dict:
+        return {"retrieval": self.retrievals.stats(), "answer": self.answers.stats()}
@@ -0,0 +1,111 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from hybrid_retrieval import BM25Index, reciprocal_rank_fusion
+from vector_store import get_nodes_by_id, iter_all_nodes
+
+
+def sync_bm25(bm25: BM25Index, index: BaseIndex) -> bool:
+    """Bring the BM25 index in line with the index's nodes; returns True if anything changed."""
+    live = set()
+    missing = []
+    for node in iter_all_nodes(index):
+        live.add(node.node_id)
+        if node.node_id not in bm25:
+            missing.append((node.node_id, node.get_content(metadata_mode=MetadataMode.NONE)))
+    stale = [doc_id for doc_id in bm25.ids() if doc_id not in live]
+    for doc_id in stale:
+        bm25.remove(doc_id)
+    bm25.add_many(missing)
+    return bool(stale or missing)
+
+
+def dense_retrieve_batch(retriever: VectorIndexRetriever, query_strs: Sequence[str]) -> List[List[NodeWithScore]]:
+    """VectorIndexRetriever.retrieve for many queries: the queries are embedded in one batch and, when
+    the vector store has `query_batch` (MmapVectorStore, SnapshotVectorStore), searched in one pass."""
+    embed_model = retriever._embed_model
+    if hasattr(embed_model, "get_query_embedding_batch"):
+        embeddings = embed_model.get_query_embedding_batch(list(query_strs))
+    else:
+        embeddings = [embed_model.get_query_embedding(query_str) for query_str in query_strs]
+    vector_store = retriever._vector_store
+    if hasattr(vector_store, "query_batch"):
+        results = vector_store.query_batch(embeddings, retriever._similarity_top_k)
+    else:
+        results = [
+            vector_store.query(VectorStoreQuery(query_embedding=embedding, similarity_top_k=retriever._similarity_top_k))
+            for embedding in embeddings
+        ]
+    return [retriever._build_node_list_from_query_result(result) for result in results]
+
+
+def retrieve_batch(retriever: BaseRetriever, query_strs: Sequence[str]) -> List[List[NodeWithScore]]:
+    """Retrieve for many queries at once, sharing the embedding and search work where the retriever allows it."""
+    if isinstance(retriever, HybridRetriever):
+        return retriever.retrieve_batch(query_strs)
+    if isinstance(retriever, VectorIndexRetriever):
+        return dense_retrieve_batch(retriever, query_strs)
+    return [retriever.retrieve(query_str) for query_str in query_strs]
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense retrieval plus BM25 over the same nodes, fused with reciprocal-rank fusion.
+
+    Both searches fetch `candidate_k` candidates and run concurrently; the `similarity_top_k`
+    best fused nodes are returned, scored by their RRF score.
+    """
+
+    def __init__(
+        self,
+        index: BaseIndex,
+        bm25: BM25Index,
+        similarity_top_k: int = 5,
+        candidate_k: int = 20,
+        rrf_k: int = 60,
+    ) -> None:
+        self._index = index
+        self._bm25 = bm25
+        self._dense = index.as_retriever(similarity_top_k=candidate_k)
+        self._similarity_top_k = similarity_top_k
+        self._candidate_k = candidate_k
+        self._rrf_k = rrf_k
+        super().__init__()
+
+    def _fuse(self, dense: List[NodeWithScore], lexical: List[Tuple[str, float]]) -> List[NodeWithScore]:
+        nodes = {n.node.node_id: n.node for n in dense}
+        fused = reciprocal_rank_fusion(
+            [[n.node.node_id for n in dense], [doc_id for doc_id, _ in lexical]], k=self._rrf_k
+        )[: self._similarity_top_k]
+        lexical_only = [doc_id for doc_id, _ in fused if doc_id not in nodes]
+        nodes.update(zip(lexical_only, get_nodes_by_id(self._index, lexical_only)))
+        results = []
+        for doc_id, score in fused:
+            node = nodes.get(doc_id)
+            if node is not None:
+                results.append(NodeWithScore(node=node, score=score))
+        return results
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            lexical = pool.submit(self._bm25.search, query_bundle.query_str, self._candidate_k)
+            dense = pool.submit(self._dense.retrieve, query_bundle)
+            return self._fuse(dense.result(), lexical.result())
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        lexical, dense = await asyncio.gather(
+            asyncio.to_thread(self._bm25.search, query_bundle.query_str, self._candidate_k),
+            self._dense.aretrieve(query_bundle),
+        )
+        return self._fuse(dense, lexical)
+
+    def retrieve_batch(self, query_strs: Sequence[str]) -> List[List[NodeWithScore]]:
+        """Dense candidates for all queries in one batch (see dense_retrieve_batch), then BM25 and fusion per query."""
+        dense = dense_retrieve_batch(self._dense, query_strs)
+        return [self._fuse(nodes, self._bm25.search(query_str, self._candidate_k)) for query_str, nodes in zip(query_strs, dense)]
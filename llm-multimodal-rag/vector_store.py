@@ -0,0 +1,422 @@
+import os
+import json
+import asyncio
+import sqlite3
+import importlib.util
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+import telemetry
+from embedding_cache import INT8_SCALE, VECTOR_DTYPES, from_storage, to_storage
+from snapshots import ReadOnlySnapshotError, Snapshot, SnapshotInfo, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+VECTOR_FILES = {"float32": "vectors.f32", "float16": "vectors.f16", "int8": "vectors.i8"}
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """Vector store with memory-mapped vectors, SQLite metadata and an optional HNSW index.
+
+    Layout of `path`:
+      vectors.f32   - float32 rows (L2-normalized, so inner product = cosine similarity), memory-mapped;
+                      vectors.f16 / vectors.i8 with dtype="float16" / "int8" (half / a quarter of the size)
+      nodes.sqlite  - row -> node ID, ref doc ID, serialized node, deleted flag
+      hnsw.bin      - hnswlib graph over the rows (backend="hnsw")
+
+    Opening the store maps the vector file and loads the HNSW graph; nothing is parsed from
+    JSON. Queries are approximate and sub-linear with the "hnsw" backend, and an exact scan
+    of the mapped vectors with "flat" (also the fallback when hnswlib is not installed).
+    The dtype is fixed when the store is created; the HNSW graph keeps its own float32 copy.
+    """
+
+    stores_text: bool = True
+    is_embedding_query: bool = True
+    path: str
+    backend: str = "hnsw"
+    ef_search: int = 64
+    dtype: str = "float32"
+
+    _db: sqlite3.Connection = PrivateAttr()
+    _vectors: Optional[np.memmap] = PrivateAttr(default=None)
+    _dim: Optional[int] = PrivateAttr(default=None)
+    _rows: int = PrivateAttr(default=0)
+    _live: int = PrivateAttr(default=0)
+    _hnsw: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    def __init__(self, path: str, backend: str = "hnsw", ef_search: int = 64, dtype: str = "float32", **kwargs: Any) -> None:
+        if backend == "hnsw" and importlib.util.find_spec("hnswlib") is None:
+            logger.warning("hnswlib is not installed (pip install hnswlib), falling back to exact flat search")
+            backend = "flat"
+        if backend not in ("hnsw", "flat"):
+            raise ValueError(f"Unknown vector store backend {backend!r}, expected 'hnsw' or 'flat'")
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"dtype must be one of {', '.join(VECTOR_DTYPES)}, not {dtype}")
+        super().__init__(path=path, backend=backend, ef_search=ef_search, dtype=dtype, **kwargs)
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "nodes.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS nodes (
+                row INTEGER PRIMARY KEY, node_id TEXT NOT NULL, ref_doc_id TEXT, node TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS nodes_node_id ON nodes (node_id);
+            CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        meta = dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+        if meta.get("dtype", "float32" if "dim" in meta else dtype) != dtype:
+            raise ValueError(f"Vector store at {path} stores {meta.get('dtype', 'float32')} vectors, not {dtype}")
+        if "dim" in meta:
+            self._dim = int(meta["dim"])
+            self._rows = self._db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM nodes").fetchone()[0]
+            self._live = self._db.execute("SELECT COUNT(*) FROM nodes WHERE deleted = 0").fetchone()[0]
+            self._open_vectors()
+            if self.backend == "hnsw":
+                self._load_hnsw()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _open_vectors(self, min_rows: int = 0) -> np.memmap:
+        vectors_path = os.path.join(self.path, VECTOR_FILES[self.dtype])
+        row_bytes = self._dim * np.dtype(self.dtype).itemsize
+        size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        if size < min_rows * row_bytes:
+            # grow geometrically so appends don't remap the file every time
+            with open(vectors_path, "ab") as f:
+                f.truncate(max(min_rows, 2 * size // row_bytes, 1024) * row_bytes)
+            size = os.path.getsize(vectors_path)
+        if self._vectors is None or self._vectors.shape[0] != size // row_bytes:
+            self._vectors = np.memmap(vectors_path, dtype=self.dtype, mode="r+", shape=(size // row_bytes, self._dim))
+        return self._vectors
+
+    def _load_hnsw(self) -> None:
+        import hnswlib
+
+        self._hnsw = hnswlib.Index(space="ip", dim=self._dim)
+        hnsw_path = os.path.join(self.path, "hnsw.bin")
+        if os.path.exists(hnsw_path):
+            self._hnsw.load_index(hnsw_path, max_elements=max(self._rows, 1024))
+            indexed = self._hnsw.get_current_count()
+        else:
+            self._hnsw.init_index(max_elements=max(self._rows, 1024), ef_construction=200, M=16)
+            indexed = 0
+        # rows written after the graph was last saved (e.g. a crash before persist) are added back
+        if indexed < self._rows:
+            self._hnsw.add_items(from_storage(self._vectors[indexed : self._rows]), np.arange(indexed, self._rows))
+        # deletions after the last save are not in the saved graph either
+        for (row,) in self._db.execute("SELECT row FROM nodes WHERE deleted = 1").fetchall():
+            try:
+                self._hnsw.mark_deleted(row)
+            except RuntimeError:  # already marked in the saved graph
+                pass
+        self._hnsw.set_ef(self.ef_search)
+
+    def fingerprint(self) -> str:
+        """Changes whenever nodes are added or deleted; used to invalidate query caches."""
+        return f"{self._rows}:{self._live}"
+
+    @telemetry.traced("vector_write")
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        with self._lock:
+            if self._dim is None:
+                self._dim = embeddings.shape[1]
+                self._db.execute("INSERT INTO meta VALUES ('dim', ?), ('dtype', ?)", (str(self._dim), self.dtype))
+                if self.backend == "hnsw":
+                    self._vectors = self._open_vectors(len(nodes))
+                    self._load_hnsw()
+            start = self._rows
+            rows = np.arange(start, start + len(nodes))
+            vectors = self._open_vectors(start + len(nodes))
+            vectors[start : start + len(nodes)] = to_storage(embeddings, self.dtype)
+            vectors.flush()
+            self._db.executemany(
+                "INSERT INTO nodes (row, node_id, ref_doc_id, node) VALUES (?, ?, ?, ?)",
+                [
+                    (int(row), node.node_id, node.ref_doc_id, json.dumps(node_to_metadata_dict(node, remove_text=False, flat_metadata=False)))
+                    for row, node in zip(rows, nodes)
+                ],
+            )
+            self._db.commit()
+            if self._hnsw is not None:
+                if self._hnsw.get_max_elements() < start + len(nodes):
+                    self._hnsw.resize_index(max(2 * self._hnsw.get_max_elements(), start + len(nodes)))
+                self._hnsw.add_items(embeddings, rows)
+            self._rows += len(nodes)
+            self._live += len(nodes)
+        return [node.node_id for node in nodes]
+
+    def _mark_deleted(self, where: str, params: tuple) -> None:
+        with self._lock:
+            rows = [row for (row,) in self._db.execute(f"SELECT row FROM nodes WHERE deleted = 0 AND {where}", params)]
+            if not rows:
+                return
+            self._db.executemany("UPDATE nodes SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+            self._db.commit()
+            if self._hnsw is not None:
+                for row in rows:
+                    self._hnsw.mark_deleted(row)
+            self._live -= len(rows)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._mark_deleted("ref_doc_id = ?", (ref_doc_id,))
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        for node_id in node_ids or []:
+            self._mark_deleted("node_id = ?", (node_id,))
+
+    def _load_nodes(self, rows: List[int]) -> Dict[int, BaseNode]:
+        if not rows:
+            return {}
+        placeholders = ",".join("?" * len(rows))
+        found = self._db.execute(f"SELECT row, node FROM nodes WHERE row IN ({placeholders})", [int(r) for r in rows])
+        return {row: metadata_dict_to_node(json.loads(node)) for row, node in found}
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **kwargs: Any) -> List[BaseNode]:
+        """Nodes by ID, in the order requested (unknown or deleted IDs are skipped)."""
+        with self._lock:
+            rows = {}
+            for node_id in node_ids or []:
+                found = self._db.execute("SELECT row FROM nodes WHERE node_id = ? AND deleted = 0", (node_id,)).fetchone()
+                if found:
+                    rows[node_id] = found[0]
+            nodes = self._load_nodes(list(rows.values()))
+        return [nodes[rows[node_id]] for node_id in node_ids or [] if node_id in rows]
+
+    def iter_nodes(self, batch_size: int = 1000) -> Iterator[BaseNode]:
+        """Every live node, read from SQLite in batches."""
+        last_row = -1
+        while True:
+            with self._lock:
+                batch = self._db.execute(
+                    "SELECT row, node FROM nodes WHERE deleted = 0 AND row > ? ORDER BY row LIMIT ?", (last_row, batch_size)
+                ).fetchall()
+            if not batch:
+                return
+            for row, node in batch:
+                yield metadata_dict_to_node(json.loads(node))
+            last_row = batch[-1][0]
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[Tuple[List[BaseNode], np.ndarray]]:
+        """Every live node with its float32 vector, a batch at a time (used for snapshots)."""
+        last_row = -1
+        while True:
+            with self._lock:
+                batch = self._db.execute(
+                    "SELECT row, node FROM nodes WHERE deleted = 0 AND row > ? ORDER BY row LIMIT ?", (last_row, batch_size)
+                ).fetchall()
+                if not batch:
+                    return
+                vectors = from_storage(self._vectors[[row for row, _ in batch]])
+            yield [metadata_dict_to_node(json.loads(node)) for _, node in batch], vectors
+            last_row = batch[-1][0]
+
+    async def aquery(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        # the search is numpy/hnswlib work that releases the GIL; keep it off the event loop
+        return await asyncio.to_thread(self.query, query, **kwargs)
+
+    @telemetry.traced("vector_search")
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        return self._search([query.query_embedding], query.similarity_top_k)[0]
+
+    @telemetry.traced("vector_search")
+    def query_batch(self, embeddings: Sequence[Sequence[float]], k: int) -> List[VectorStoreQueryResult]:
+        """Top-k results for many query embeddings in one vectorized search (one matrix product, or one HNSW call)."""
+        return self._search(embeddings, k)
+
+    def _search(self, embeddings: Sequence[Sequence[float]], k: int) -> List[VectorStoreQueryResult]:
+        if self._dim is None or not self._live or not len(embeddings):
+            return [VectorStoreQueryResult(nodes=[], similarities=[], ids=[]) for _ in embeddings]
+        q = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        k = min(k, self._live)
+        with self._lock:
+            if self._hnsw is not None:
+                self._hnsw.set_ef(max(self.ef_search, k))
+                labels, distances = self._hnsw.knn_query(q, k=k)
+                rows, similarities = labels.tolist(), (1.0 - distances).tolist()
+            else:
+                scores = (q @ self._vectors[: self._rows].T).astype(np.float32)
+                if self.dtype == "int8":
+                    scores /= INT8_SCALE
+                deleted = [row for (row,) in self._db.execute("SELECT row FROM nodes WHERE deleted = 1")]
+                scores[:, deleted] = -np.inf
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+                rows, similarities = top.tolist(), np.take_along_axis(scores, top, axis=1).tolist()
+            nodes = self._load_nodes(sorted({row for query_rows in rows for row in query_rows}))
+        results = []
+        for query_rows, query_similarities in zip(rows, similarities):
+            result_nodes = [nodes[row] for row in query_rows if row in nodes]
+            results.append(VectorStoreQueryResult(
+                nodes=result_nodes,
+                similarities=[similarity for row, similarity in zip(query_rows, query_similarities) if row in nodes],
+                ids=[node.node_id for node in result_nodes],
+            ))
+        return results
+
+    def persist(self, persist_path: str = None, fs: Any = None) -> None:
+        """Flush vectors and save the HNSW graph (metadata is committed on every write)."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            if self._hnsw is not None:
+                tmp_path = os.path.join(self.path, "hnsw.bin.tmp")
+                self._hnsw.save_index(tmp_path)
+                os.replace(tmp_path, os.path.join(self.path, "hnsw.bin"))
+
+
+class SnapshotVectorStore(BasePydanticVectorStore):
+    """Read-only vector store served straight from a memory-mapped snapshot file (see snapshots.py).
+
+    Replicas build an index over it with `VectorStoreIndex.from_vector_store(...)` and answer
+    queries at once: nothing is parsed into memory, re-embedded or re-indexed. Search is an
+    exact scan of the mapped vectors; writes raise, import the snapshot into an
+    MmapVectorStore (import_index_snapshot) to modify it.
+    """
+
+    stores_text: bool = True
+    is_embedding_query: bool = True
+    path: str
+
+    _snapshot: Snapshot = PrivateAttr()
+
+    def __init__(self, path: str, verify: bool = True, **kwargs: Any) -> None:
+        super().__init__(path=path, **kwargs)
+        self._snapshot = Snapshot.open(path, verify=verify)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SnapshotVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def fingerprint(self) -> str:
+        return self._snapshot.fingerprint()
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        raise ReadOnlySnapshotError("SnapshotVectorStore is read-only")
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        raise ReadOnlySnapshotError("SnapshotVectorStore is read-only")
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **kwargs: Any) -> List[BaseNode]:
+        rows = [row for row in (self._snapshot.row_of(node_id) for node_id in node_ids or []) if row is not None]
+        return [metadata_dict_to_node(metadata) for _, _, metadata in self._snapshot.rows(rows)]
+
+    def iter_nodes(self, batch_size: int = 1000) -> Iterator[BaseNode]:
+        for _, _, metadatas, _ in self._snapshot.iter_batches():
+            for metadata in metadatas:
+                yield metadata_dict_to_node(metadata)
+
+    async def aquery(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        # the search is numpy/hnswlib work that releases the GIL; keep it off the event loop
+        return await asyncio.to_thread(self.query, query, **kwargs)
+
+    @telemetry.traced("vector_search")
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None or not len(self._snapshot):
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        return self._result(self._snapshot.search(query.query_embedding, query.similarity_top_k))
+
+    @telemetry.traced("vector_search")
+    def query_batch(self, embeddings: Sequence[Sequence[float]], k: int) -> List[VectorStoreQueryResult]:
+        """Top-k results for many query embeddings, one matrix product per snapshot batch."""
+        if not len(embeddings) or not len(self._snapshot):
+            return [VectorStoreQueryResult(nodes=[], similarities=[], ids=[]) for _ in embeddings]
+        return [self._result(hits) for hits in self._snapshot.search_batch(embeddings, k)]
+
+    def _result(self, hits: List[Tuple[int, float]]) -> VectorStoreQueryResult:
+        nodes = [metadata_dict_to_node(metadata) for _, _, metadata in self._snapshot.rows([row for row, _ in hits])]
+        return VectorStoreQueryResult(nodes=nodes, similarities=[score for _, score in hits], ids=[node.node_id for node in nodes])
+
+    def persist(self, persist_path: str = None, fs: Any = None) -> None:
+        """Nothing to write: the snapshot file is the store."""
+
+
+def _index_rows(index: BaseIndex, batch_size: int) -> Iterator[Tuple[List[BaseNode], np.ndarray]]:
+    """Nodes with their vectors from any vector store that can return stored embeddings by node ID."""
+    node_ids = list(index.index_struct.nodes_dict.values()) if hasattr(index.index_struct, "nodes_dict") else []
+    for start in range(0, len(node_ids), batch_size):
+        nodes = [node for node in index.docstore.get_nodes(node_ids[start : start + batch_size], raise_error=False) if node is not None]
+        yield nodes, np.asarray([index.vector_store.get(node.node_id) for node in nodes], dtype=np.float32)
+
+
+def export_index_snapshot(index: BaseIndex, path: str, model_id: str = "", dtype: str = "float32", batch_size: int = 1000) -> SnapshotInfo:
+    """Write an index's nodes and embeddings to a snapshot file."""
+    vector_store = getattr(index, "vector_store", None)
+    rows = vector_store.iter_rows(batch_size) if isinstance(vector_store, MmapVectorStore) else _index_rows(index, batch_size)
+    batches = (
+        (
+            [node.node_id for node in nodes],
+            [node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes],
+            [node_to_metadata_dict(node, remove_text=False, flat_metadata=False) for node in nodes],
+            vectors,
+        )
+        for nodes, vectors in rows
+        if nodes
+    )
+    return write_snapshot(path, batches, dtype=dtype, model_id=model_id, source=f"llama_index:{index.index_id}")
+
+
+def iter_snapshot_nodes(snapshot: Snapshot) -> Iterator[List[BaseNode]]:
+    """The snapshot's nodes, a batch at a time, with their embeddings set so they are not embedded again."""
+    for _, _, metadatas, embeddings in snapshot.iter_batches():
+        nodes = []
+        for metadata, embedding in zip(metadatas, embeddings):
+            node = metadata_dict_to_node(metadata)
+            node.embedding = embedding.tolist()
+            nodes.append(node)
+        yield nodes
+
+
+def get_nodes_by_id(index: BaseIndex, node_ids: List[str]) -> List[Optional[BaseNode]]:
+    """Look nodes up wherever the index keeps them: the vector store when it stores text, else the docstore."""
+    vector_store = getattr(index, "vector_store", None)
+    if vector_store is not None and vector_store.stores_text and hasattr(vector_store, "get_nodes"):
+        found = {node.node_id: node for node in vector_store.get_nodes(node_ids=node_ids)}
+        return [found.get(node_id) for node_id in node_ids]
+    return index.docstore.get_nodes(node_ids, raise_error=False)
+
+
+def iter_all_nodes(index: BaseIndex) -> Iterator[BaseNode]:
+    """Every node of the index, from the vector store or the docstore."""
+    vector_store = getattr(index, "vector_store", None)
+    if isinstance(vector_store, (MmapVectorStore, SnapshotVectorStore)):
+        yield from vector_store.iter_nodes()
+    else:
+        yield from index.docstore.docs.values()
@@ -0,0 +1,63 @@
+import time
+import logging
+import threading
+import functools
+from typing import Any, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Registry:
+    """Process-wide registry of lazily created, shared objects (models, indexes, clients).
+
+    Each factory runs at most once per process, on first use, and its result is shared by every
+    caller afterwards, including later Streamlit reruns of the same server process.
+    """
+
+    def __init__(self) -> None:
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.timings: Dict[str, float] = {}  # seconds each factory took
+
+    def get_or_create(self, name: str, factory: Callable[[], T]) -> T:
+        if name in self._instances:
+            return self._instances[name]
+        with self._guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        # one lock per name, so a slow model load doesn't block unrelated lookups
+        with lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = factory()
+                self.timings[name] = time.perf_counter() - start
+                logger.info(f"Loaded {name} in {self.timings[name]:.2f}s")
+        return self._instances[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def reset(self, name: str = None) -> None:
+        """Forget one (or every) instance, so the next lookup rebuilds it."""
+        with self._guard:
+            for key in [name] if name else list(self._instances):
+                self._instances.pop(key, None)
+                self.timings.pop(key, None)
+
+
+registry = Registry()
+
+
+def shared(name: str) -> Callable[[Callable[[], T]], Callable[[], T]]:
+    """Decorator turning a zero-argument factory into a lazy, process-wide accessor."""
+
+    def decorator(factory: Callable[[], T]) -> Callable[[], T]:
+        @functools.wraps(factory)
+        def accessor() -> T:
+            return registry.get_or_create(name, factory)
+
+        return accessor
+
+    return decorator
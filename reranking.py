@@ -0,0 +1,152 @@
+import os
+from dataclasses import dataclass
+from typing import Callable, Generic, List, Optional, Sequence, TypeVar
+
+import numpy as np
+
+from embedding_backends import DEFAULT_THREADS, length_batches
+from registry import shared
+
+T = TypeVar("T")
+
+DEFAULT_RERANK_MODEL = os.environ.get("YBOCS_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+
+class CrossEncoderScorer:
+    """Scores (query, passage) pairs with a small cross-encoder on CPU.
+
+    Pairs are length-bucketed into batches the same way as the embedding backends, and the
+    logits are squashed to relevance probabilities in [0, 1].
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        threads: Optional[int] = DEFAULT_THREADS,
+        max_length: int = 512,
+        batch_tokens: int = 8192,
+        max_batch_size: int = 32,
+    ) -> None:
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.max_length = max_length
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+    def score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        import torch
+
+        if not passages:
+            return np.zeros(0, dtype=np.float32)
+        encoded = self.tokenizer([query] * len(passages), list(passages), truncation="only_second", max_length=self.max_length)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        scores = np.empty(len(passages), dtype=np.float32)
+        for batch in length_batches(lengths, self.batch_tokens, self.max_batch_size):
+            features = self.tokenizer.pad({name: [encoded[name][i] for i in batch] for name in encoded}, return_tensors="pt")
+            with torch.inference_mode():
+                logits = self.model(**features).logits
+            # one logit per pair for ms-marco style models; the last class is "relevant" otherwise
+            scores[batch] = torch.sigmoid(logits[:, -1] if logits.shape[1] > 1 else logits[:, 0]).float().numpy()
+        return scores
+
+
+# one model per process, shared by both pipelines' rerankers
+@shared("cross_encoder")
+def get_cross_encoder() -> CrossEncoderScorer:
+    return CrossEncoderScorer()
+
+
+def adaptive_cutoff(
+    scores: Sequence[float],
+    min_k: int = 1,
+    max_k: Optional[int] = None,
+    max_gap: Optional[float] = 0.3,
+    cumulative: Optional[float] = 0.9,
+    min_score: Optional[float] = None,
+) -> int:
+    """How many of the descending `scores` to keep.
+
+    Stops at the first score below `min_score`, at the first drop of more than `max_gap`
+    from the previous score, or once the kept scores hold `cumulative` of the total score
+    mass, whichever comes first; never fewer than `min_k` nor more than `max_k`.
+    """
+    limit = len(scores) if max_k is None else min(max_k, len(scores))
+    total = float(sum(scores))
+    kept, mass = 0, 0.0
+    for i in range(limit):
+        if i >= min_k:
+            if min_score is not None and scores[i] < min_score:
+                break
+            if max_gap is not None and scores[i - 1] - scores[i] > max_gap:
+                break
+            if cumulative is not None and total > 0 and mass / total >= cumulative:
+                break
+        kept += 1
+        mass += scores[i]
+    return kept
+
+
+@dataclass
+class Reranked(Generic[T]):
+    """The candidates that survived reranking and the cutoff, best first."""
+
+    items: List[T]
+    scores: List[float]
+    candidates: int = 0
+
+    def stats(self) -> dict:
+        return {
+            "candidates": self.candidates,
+            "kept": len(self.items),
+            "top_score": round(self.scores[0], 4) if self.scores else None,
+            "cut_score": round(self.scores[-1], 4) if self.scores else None,
+        }
+
+
+class AdaptiveReranker:
+    """Rerank over-fetched candidates with a cross-encoder and keep only the clearly relevant ones.
+
+    Callers retrieve `candidates` items instead of their usual top k, pass them to `rerank()`
+    and get back between `min_k` and `max_k` of them, cut off by adaptive_cutoff(). When the
+    top hit is far ahead of the rest, only it is kept, so the prompt (and, in the multimodal
+    engine, the set of page images) shrinks accordingly.
+    """
+
+    def __init__(
+        self,
+        scorer: Optional[CrossEncoderScorer] = None,
+        candidates: int = 20,
+        min_k: int = 1,
+        max_k: int = 5,
+        max_gap: Optional[float] = 0.3,
+        cumulative: Optional[float] = 0.9,
+        min_score: Optional[float] = 0.05,
+    ) -> None:
+        self.scorer = scorer or get_cross_encoder()
+        self.candidates = candidates
+        self.min_k = min_k
+        self.max_k = max_k
+        self.max_gap = max_gap
+        self.cumulative = cumulative
+        self.min_score = min_score
+
+    def rerank(self, query: str, items: Sequence[T], text: Callable[[T], str], max_k: Optional[int] = None) -> Reranked[T]:
+        scores = self.scorer.score(query, [text(item) for item in items])
+        order = sorted(range(len(items)), key=lambda i: -scores[i])
+        ranked = [float(scores[i]) for i in order]
+        keep = adaptive_cutoff(
+            ranked,
+            min_k=self.min_k,
+            max_k=max_k or self.max_k,
+            max_gap=self.max_gap,
+            cumulative=self.cumulative,
+            min_score=self.min_score,
+        )
+        kept = [items[i] for i in order[:keep]]
+        return Reranked(items=kept, scores=ranked[:keep], candidates=len(items))
@@ -0,0 +1,370 @@
+"""Compact, checksummed snapshots of an embedded chunk collection, shared by both pipelines.
+
+A snapshot is one uncompressed Arrow IPC file with a row per chunk:
+
+    id         string
+    text       string
+    metadata   string (JSON)
+    embedding  fixed_size_list<float32 | float16 | int8>[dim]  (L2-normalized; int8 = round(x * 127))
+
+The schema metadata records the format version, embedding model, dimension, dtype and
+source; every record batch carries the sha256 of its contents, checked by `verify()`
+and by `Snapshot.open(..., verify=True)`. Because the file is not compressed, `Snapshot`
+memory-maps it and searches the embedding columns in place, so a replica can serve
+queries straight from a copied snapshot without loading a vector store or re-embedding.
+
+    python snapshots.py info ocd_docs.arrow
+    python snapshots.py verify ocd_docs.arrow
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_cache import INT8_SCALE, VECTOR_DTYPES, to_storage
+
+FORMAT = "ybocs-snapshot/1"
+ARROW_TYPES = {"float32": "float32", "float16": "float16", "int8": "int8"}
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot, or its contents do not match their checksums."""
+
+
+class ReadOnlySnapshotError(SnapshotError):
+    """A snapshot-backed store was asked to write; import the snapshot into a writable store instead."""
+
+
+def _unquantized(model_id: str) -> str:
+    # only the quantization suffix is dropped: other suffixes (e.g. "#len128") change the vectors
+    return "#".join(part for part in model_id.split("#") if part != "int8")
+
+
+@dataclass
+class SnapshotInfo:
+    path: str
+    rows: int
+    dim: int
+    dtype: str
+    model_id: str
+    source: str
+    created_at: float
+    batches: int
+    bytes: int
+
+    def summary(self) -> str:
+        return (
+            f"{self.path}: {self.rows} chunks, {self.dim}-d {self.dtype} vectors from {self.model_id or 'unknown model'}, "
+            f"source {self.source or 'unknown'}, {self.batches} batches, {self.bytes / 2**20:.1f} MB"
+        )
+
+
+def _checksum(ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[str], embeddings: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    for column in (ids, texts, metadatas):
+        digest.update("\0".join(column).encode("utf-8"))
+        digest.update(b"\1")
+    digest.update(np.ascontiguousarray(embeddings).tobytes())
+    return digest.hexdigest()
+
+
+class SnapshotWriter:
+    """Streams batches of chunks into a snapshot; the file only appears once `close()` succeeds."""
+
+    def __init__(self, path: str, dim: int, dtype: str = "float32", model_id: str = "", source: str = "") -> None:
+        import pyarrow as pa
+
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"dtype must be one of {', '.join(VECTOR_DTYPES)}, not {dtype}")
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        self.rows = 0
+        self._tmp_path = f"{path}.tmp"
+        self._schema = pa.schema(
+            [
+                ("id", pa.string()),
+                ("text", pa.string()),
+                ("metadata", pa.string()),
+                ("embedding", pa.list_(getattr(pa, ARROW_TYPES[dtype])(), dim)),
+            ],
+            metadata={
+                "format": FORMAT,
+                "dim": str(dim),
+                "dtype": dtype,
+                "model_id": model_id,
+                "source": source,
+                "created_at": str(time.time()),
+            },
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._writer = pa.ipc.new_file(self._tmp_path, self._schema)
+
+    def write(self, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[dict], embeddings) -> None:
+        import pyarrow as pa
+
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"Expected {len(ids)} {self.dim}-d embeddings, got shape {vectors.shape}")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+        stored = to_storage(vectors, self.dtype)
+        metadata_json = [json.dumps(metadata or {}, default=str) for metadata in metadatas]
+        texts = [text or "" for text in texts]
+        batch = pa.record_batch(
+            [
+                pa.array(list(ids), pa.string()),
+                pa.array(texts, pa.string()),
+                pa.array(metadata_json, pa.string()),
+                pa.FixedSizeListArray.from_arrays(pa.array(stored.reshape(-1)), self.dim),
+            ],
+            schema=self._schema,
+        )
+        self._writer.write_batch(batch, custom_metadata={"sha256": _checksum(ids, texts, metadata_json, stored)})
+        self.rows += len(ids)
+
+    def close(self) -> SnapshotInfo:
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+        snapshot = Snapshot.open(self.path)
+        try:
+            return snapshot.info
+        finally:
+            snapshot.close()
+
+    def abort(self) -> None:
+        self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file.
+
+    Embeddings are zero-copy views into the mapped file; `search()` scans them batch by
+    batch (exact inner-product search), and only the rows it returns are decoded.
+    """
+
+    def __init__(self, path: str, reader, source) -> None:
+        self.path = path
+        self._reader = reader
+        self._source = source  # the memory map; kept open for the views below
+        meta = {key.decode(): value.decode() for key, value in (reader.schema.metadata or {}).items()}
+        if meta.get("format") != FORMAT:
+            raise SnapshotError(f"{path} is not a {FORMAT} file")
+        self.dim = int(meta["dim"])
+        self.dtype = meta["dtype"]
+        self.model_id = meta.get("model_id", "")
+        self.source = meta.get("source", "")
+        self.created_at = float(meta.get("created_at", 0))
+        self._batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+        self._starts = np.cumsum([0] + [batch.num_rows for batch in self._batches])
+        self._vectors = [
+            batch.column("embedding").flatten().to_numpy(zero_copy_only=True).reshape(-1, self.dim) for batch in self._batches
+        ]
+        self._row_ids: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def open(cls, path: str, verify: bool = False) -> "Snapshot":
+        import pyarrow as pa
+
+        source = pa.memory_map(path, "r")
+        try:
+            snapshot = cls(path, pa.ipc.open_file(source), source)
+        except pa.ArrowInvalid as e:
+            source.close()
+            raise SnapshotError(f"{path} is not a readable snapshot: {e}") from e
+        if verify:
+            snapshot.verify()
+        return snapshot
+
+    @property
+    def info(self) -> SnapshotInfo:
+        return SnapshotInfo(
+            self.path, len(self), self.dim, self.dtype, self.model_id, self.source, self.created_at,
+            len(self._batches), os.path.getsize(self.path),
+        )
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def check_model(self, model_id: str) -> None:
+        """Raise unless the vectors come from `model_id` (quantized variants of one model are compatible)."""
+        if self.model_id and model_id and _unquantized(self.model_id) != _unquantized(model_id):
+            raise SnapshotError(f"{self.path} holds {self.model_id} vectors, not {model_id} vectors")
+
+    def fingerprint(self) -> str:
+        """Identifies the snapshot's contents (the checksum of its last batch and the row count)."""
+        if not self._batches:
+            return "0"
+        last = self._reader.get_batch_with_custom_metadata(len(self._batches) - 1).custom_metadata
+        return f"{len(self)}:{last[b'sha256'].decode()[:16]}"
+
+    def verify(self) -> SnapshotInfo:
+        """Recompute every batch checksum; raises SnapshotError on the first mismatch."""
+        for i in range(len(self._batches)):
+            batch, custom = self._reader.get_batch_with_custom_metadata(i)
+            expected = (custom or {}).get(b"sha256", b"").decode()
+            actual = _checksum(
+                batch.column("id").to_pylist(), batch.column("text").to_pylist(), batch.column("metadata").to_pylist(), self._vectors[i]
+            )
+            if actual != expected:
+                raise SnapshotError(f"Checksum mismatch in batch {i} of {self.path}")
+        return self.info
+
+    def _locate(self, row: int) -> Tuple[int, int]:
+        batch = int(np.searchsorted(self._starts, row, side="right")) - 1
+        return batch, row - int(self._starts[batch])
+
+    def rows(self, rows: Sequence[int]) -> List[Tuple[str, str, dict]]:
+        """(id, text, metadata) for the given row numbers, in order."""
+        found = []
+        for row in rows:
+            b, i = self._locate(int(row))
+            batch = self._batches[b]
+            found.append((batch.column("id")[i].as_py(), batch.column("text")[i].as_py(), json.loads(batch.column("metadata")[i].as_py())))
+        return found
+
+    def row_of(self, chunk_id: str) -> Optional[int]:
+        if self._row_ids is None:
+            self._row_ids = {}
+            for b, batch in enumerate(self._batches):
+                start = int(self._starts[b])
+                self._row_ids.update((chunk_id, start + i) for i, chunk_id in enumerate(batch.column("id").to_pylist()))
+        return self._row_ids.get(chunk_id)
+
+    def vectors(self, rows: Sequence[int]) -> np.ndarray:
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        for j, row in enumerate(rows):
+            b, i = self._locate(int(row))
+            out[j] = self._vectors[b][i]
+        return out / INT8_SCALE if self.dtype == "int8" else out
+
+    def iter_batches(self) -> Iterator[Tuple[List[str], List[str], List[dict], np.ndarray]]:
+        """Every chunk, a batch at a time, with float32 embeddings; used by the bulk importers."""
+        for batch, vectors in zip(self._batches, self._vectors):
+            embeddings = vectors.astype(np.float32)
+            if self.dtype == "int8":
+                embeddings /= INT8_SCALE
+            yield (
+                batch.column("id").to_pylist(),
+                batch.column("text").to_pylist(),
+                [json.loads(metadata) for metadata in batch.column("metadata").to_pylist()],
+                embeddings,
+            )
+
+    def search(self, query: Sequence[float], k: int = 5) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity) for a query embedding, best first."""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: Sequence[Sequence[float]], k: int = 5) -> List[List[Tuple[int, float]]]:
+        """search() for many query embeddings at once: one matrix product per record batch."""
+        q = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        best_rows = np.empty((len(q), 0), dtype=np.int64)
+        best_scores = np.empty((len(q), 0), dtype=np.float32)
+        for start, vectors in zip(self._starts, self._vectors):
+            scores = (q @ vectors.T).astype(np.float32)
+            if self.dtype == "int8":
+                scores /= INT8_SCALE
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return [
+            [(int(rows[i]), float(scores[i])) for i in ranking]
+            for rows, scores, ranking in zip(best_rows, best_scores, order)
+        ]
+
+    def close(self) -> None:
+        self._batches, self._vectors = [], []
+        self._source.close()
+
+
+def write_snapshot(
+    path: str,
+    batches: Iterable[Tuple[Sequence[str], Sequence[str], Sequence[dict], np.ndarray]],
+    dtype: str = "float32",
+    model_id: str = "",
+    source: str = "",
+) -> SnapshotInfo:
+    """Write (ids, texts, metadatas, embeddings) batches to a snapshot; the dimension comes from the first batch."""
+    writer = None
+    try:
+        for ids, texts, metadatas, embeddings in batches:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            if writer is None:
+                writer = SnapshotWriter(path, embeddings.shape[1], dtype, model_id, source)
+            writer.write(ids, texts, metadatas, embeddings)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is None:
+        raise ValueError(f"Nothing to export from {source or 'an empty source'}")
+    return writer.close()
+
+
+def export_collection(collection, path: str, model_id: str = "", dtype: str = "float32", batch_size: int = 1000) -> SnapshotInfo:
+    """Write a ChromaDB collection's chunks, metadata and stored embeddings to a snapshot."""
+
+    def batches():
+        for offset in range(0, collection.count(), batch_size):
+            batch = collection.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+            yield batch["ids"], batch["documents"], [m or {} for m in batch["metadatas"]], batch["embeddings"]
+
+    return write_snapshot(path, batches(), dtype, model_id, source=f"chromadb:{collection.name}")
+
+
+def import_collection(snapshot: Snapshot, collection, batch_size: int = 1000) -> int:
+    """Upsert a snapshot's chunks into a ChromaDB collection with their stored embeddings (nothing is re-embedded)."""
+    rows = 0
+    for ids, texts, metadatas, embeddings in snapshot.iter_batches():
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.upsert(
+                ids=ids[start:end],
+                documents=texts[start:end],
+                # chroma rejects empty metadata dicts
+                metadatas=[m or None for m in metadatas[start:end]],
+                embeddings=embeddings[start:end],
+            )
+        rows += len(ids)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or verify a vector snapshot")
+    parser.add_argument("command", choices=["info", "verify"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+    snapshot = Snapshot.open(args.path, verify=args.command == "verify")
+    print(snapshot.info.summary())
+    if args.command == "verify":
+        print("checksums OK")
+
+
+if __name__ == "__main__":
+    main()
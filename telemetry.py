@@ -0,0 +1,278 @@
+"""Per-stage tracing and metrics for both RAG pipelines.
+
+Off by default. Enable with YBOCS_TELEMETRY=1 (or `telemetry.configure(enabled=True)`);
+set YBOCS_TRACE_FILE to also append every finished span to a JSONL trace file.
+
+    with telemetry.span("retrieve", top_k=5) as s:
+        nodes = retriever.retrieve(query)
+        s.set(nodes=len(nodes))
+    telemetry.count("prompt_tokens", 812, pipeline="llm_pdf")
+    telemetry.cache_lookup("embedding", hit=True)
+
+Span durations go to the `ybocs_stage_seconds{stage=...}` histogram; counters and
+histograms are exported in Prometheus text format by `prometheus_text()` (served at
+/metrics by autogen_ybocs_rag.server). Spans opened inside another span share its
+trace ID, so one JSONL trace shows every stage of a request. When disabled, `span()`
+returns a shared no-op object and `count()`/`observe()` return immediately.
+"""
+import os
+import json
+import time
+import uuid
+import bisect
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# seconds; covers cache hits (sub-millisecond) up to slow vision-model answers
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_enabled = os.environ.get("YBOCS_TELEMETRY", "").lower() in ("1", "true", "yes", "on")
+_trace_path: Optional[str] = os.environ.get("YBOCS_TRACE_FILE") or None
+_current: contextvars.ContextVar = contextvars.ContextVar("ybocs_span", default=None)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    """Thread-safe counters and histograms keyed by name and label set."""
+
+    def __init__(self, buckets=BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], list] = {}  # [bucket counts..., sum, count]
+
+    def count(self, name: str, value: float, labels: Labels) -> None:
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        with self._lock:
+            hist = self.histograms.get((name, labels))
+            if hist is None:
+                hist = self.histograms[(name, labels)] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                hist[index] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def cache_hit_rates(self) -> Dict[str, float]:
+        with self._lock:
+            totals: Dict[str, list] = {}
+            for (name, labels), value in self.counters.items():
+                if name != "cache_lookups_total":
+                    continue
+                labels = dict(labels)
+                hits_total = totals.setdefault(labels["cache"], [0.0, 0.0])
+                hits_total[0] += value if labels["result"] == "hit" else 0.0
+                hits_total[1] += value
+        return {cache: hits / total if total else 0.0 for cache, (hits, total) in totals.items()}
+
+    def summary(self) -> dict:
+        """Mean and count per stage, plus cache hit rates; handy for logs and benchmarks."""
+        with self._lock:
+            stages = {
+                dict(labels).get("stage", name): {"count": hist[-1], "mean_s": hist[-2] / hist[-1] if hist[-1] else 0.0}
+                for (name, labels), hist in self.histograms.items()
+                if name == "stage_seconds"
+            }
+        return {"stages": stages, "cache_hit_rates": self.cache_hit_rates()}
+
+    def prometheus_text(self, prefix: str = "ybocs_") -> str:
+        def fmt(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{prefix}{name}{fmt(labels)} {value:g}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for (n, labels), hist in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip(self.buckets, hist):
+                        cumulative += bucket
+                        lines.append(f"{prefix}{name}_bucket{fmt(labels, (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{prefix}{name}_bucket{fmt(labels, (('le', '+Inf'),))} {hist[-1]}")
+                    lines.append(f"{prefix}{name}_sum{fmt(labels)} {hist[-2]:g}")
+                    lines.append(f"{prefix}{name}_count{fmt(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+_trace_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "start", "duration", "_token")
+
+    def __init__(self, name: str, attrs: dict) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.duration = 0.0
+
+    def set(self, **attrs) -> "Span":
+        """Attach counts or other details to the span (they end up in the JSONL trace)."""
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self) -> "Span":
+        parent = _current.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:8]
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration = time.perf_counter() - self.start
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # exited in another context (e.g. an async generator resumed by a different task)
+            pass
+        metrics.observe("stage_seconds", self.duration, (("stage", self.name),))
+        if exc_type is not None:
+            metrics.count("stage_errors_total", 1, (("stage", self.name),))
+        if _trace_path:
+            record = {
+                "trace": self.trace_id,
+                "span": self.span_id,
+                "parent": self.parent_id,
+                "name": self.name,
+                "time": time.time() - self.duration,
+                "duration_s": round(self.duration, 6),
+                "error": exc_type.__name__ if exc_type else None,
+                **self.attrs,
+            }
+            line = json.dumps(record, default=str) + "\n"
+            with _trace_lock, open(_trace_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class _NoopSpan:
+    __slots__ = ()
+    duration = 0.0
+
+    def set(self, **attrs) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def configure(enabled: Optional[bool] = None, trace_path: Optional[str] = None) -> None:
+    """Turn instrumentation on or off, and choose where JSONL traces go (None keeps the current file)."""
+    global _enabled, _trace_path
+    if enabled is not None:
+        _enabled = enabled
+    if trace_path is not None:
+        _trace_path = trace_path or None
+
+
+def span(name: str, **attrs):
+    """Time a stage; use as a context manager. A no-op when telemetry is disabled."""
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def traced(name: str):
+    """Decorator form of span() for plain and async functions."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with Span(name, {}):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    if _enabled and value:
+        metrics.count(name, value, _labels(labels))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    if _enabled:
+        metrics.observe(name, value, _labels(labels))
+
+
+def cache_lookup(cache: str, hit: bool, n: int = 1) -> None:
+    """Record `n` lookups in a named cache; hit rates come from cache_lookups_total."""
+    if _enabled and n:
+        metrics.count("cache_lookups_total", n, _labels({"cache": cache, "result": "hit" if hit else "miss"}))
+
+
+def record_stage(name: str, seconds: float, **attrs) -> None:
+    """Record a stage timed elsewhere (e.g. in a worker process, where spans are not collected)."""
+    if not _enabled:
+        return
+    metrics.observe("stage_seconds", seconds, (("stage", name),))
+    if _trace_path:
+        parent = _current.get()
+        record = {"trace": parent.trace_id if parent else None, "parent": parent.span_id if parent else None,
+                  "name": name, "time": time.time() - seconds, "duration_s": round(seconds, 6), **attrs}
+        with _trace_lock, open(_trace_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def prometheus_text() -> str:
+    return metrics.prometheus_text()
+
+
+def write_prometheus(path: str) -> None:
+    """Write the current metrics in Prometheus text format, e.g. for node_exporter's textfile collector."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
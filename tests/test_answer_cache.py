@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("autogen_ext.models.replay")
+
+from autogen_agentchat.agents import AssistantAgent  # noqa: E402
+from autogen_agentchat.conditions import TextMentionTermination  # noqa: E402
+from autogen_agentchat.teams import RoundRobinGroupChat  # noqa: E402
+from autogen_ext.models.replay import ReplayChatCompletionClient  # noqa: E402
+
+from autogen_ybocs_rag import agents  # noqa: E402
+from autogen_ybocs_rag.answer_cache import SemanticAnswerCache, has_history  # noqa: E402
+from registry import registry  # noqa: E402
+
+
+def embed(texts):
+    """Bag-of-words hashing embedding: identical questions get identical vectors."""
+    vectors = np.zeros((len(texts), 64), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+    return vectors
+
+
+def team(client):
+    agent = AssistantAgent("chatbot", model_client=client)
+    return RoundRobinGroupChat([agent], max_turns=2, termination_condition=TextMentionTermination("TERMINATE"))
+
+
+async def ask(team, task):
+    return [message async for message in agents.orchestrate(team, task)]
+
+
+@pytest.fixture
+def cache():
+    registry.reset("answer_cache")
+    cache = registry.get_or_create("answer_cache", lambda: SemanticAnswerCache(embed_fn=embed))
+    yield cache
+    registry.reset("answer_cache")
+
+
+def test_replayed_answer_becomes_team_history(cache):
+    async def run():
+        await ask(team(ReplayChatCompletionClient(["Y-BOCS is a rating scale. TERMINATE"])), "What is Y-BOCS?")
+        fresh_client = ReplayChatCompletionClient(["should not be called TERMINATE"])
+        fresh = team(fresh_client)
+        replayed = await ask(fresh, "What is Y-BOCS?")
+        return fresh, fresh_client, replayed, await fresh.save_state()
+
+    fresh, fresh_client, replayed, state = asyncio.run(run())
+    assert cache.hits == 1
+    assert fresh_client.create_calls == []  # answered from the cache
+    assert "chatbot: Y-BOCS is a rating scale. TERMINATE" in replayed
+    assert has_history(state)
+    assert "What is Y-BOCS?" in str(state) and "Y-BOCS is a rating scale." in str(state)
+
+
+def test_follow_up_in_a_conversation_bypasses_the_cache(cache):
+    async def run():
+        await ask(team(ReplayChatCompletionClient(["Y-BOCS is a rating scale. TERMINATE"])), "What is item 3?")
+        client = ReplayChatCompletionClient(["Y-BOCS has ten items. TERMINATE", "Item 3 is distress. TERMINATE"])
+        conversation = team(client)
+        await ask(conversation, "How many items does Y-BOCS have?")
+        return await ask(conversation, "What is item 3?")
+
+    answer = asyncio.run(run())
+    assert cache.hits == 0
+    assert "chatbot: Item 3 is distress. TERMINATE" in answer
+    assert len(cache) == 2  # only the first question of each conversation is stored
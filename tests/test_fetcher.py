@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from autogen_ybocs_rag.fetcher import Fetcher  # noqa: E402
+
+
+async def _serve(routes):
+    """Start a local server on a free port; returns its runner and base URL."""
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_backoff_is_capped_and_does_not_hold_a_slot(tmp_path):
+    calls = {"slow": 0}
+
+    async def slow(request):
+        calls["slow"] += 1
+        if calls["slow"] == 1:
+            return web.Response(status=503, headers={"Retry-After": "3600"})
+        return web.Response(text="slow")
+
+    async def fast(request):
+        return web.Response(text="fast")
+
+    async def run():
+        runner, base = await _serve([web.get("/slow", slow), web.get("/fast", fast)])
+        done = []
+        try:
+            async with Fetcher(cache_dir=str(tmp_path), concurrency=1, max_delay=0.5) as fetcher:
+
+                async def fetch(path):
+                    result = await fetcher.fetch(base + path)
+                    done.append(path)
+                    return result
+
+                started = time.perf_counter()
+                slow_result, _ = await asyncio.gather(fetch("/slow"), fetch("/fast"))
+                elapsed = time.perf_counter() - started
+        finally:
+            await runner.cleanup()
+        return done, elapsed, slow_result, fetcher.stats
+
+    done, elapsed, slow_result, stats = asyncio.run(run())
+    assert elapsed < 5  # Retry-After: 3600 was clamped to max_delay
+    assert done == ["/fast", "/slow"]  # the only slot was free while /slow backed off
+    assert slow_result.status == 200 and stats.retries == 1
+
+
+def test_not_modified_without_a_cache_is_an_error():
+    async def stale(request):
+        return web.Response(status=304)
+
+    async def run():
+        runner, base = await _serve([web.get("/", stale)])
+        try:
+            async with Fetcher(cache_dir=None) as fetcher:
+                with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+                    await fetcher.fetch(base + "/")
+        finally:
+            await runner.cleanup()
+        return excinfo.value, fetcher.stats
+
+    error, stats = asyncio.run(run())
+    assert error.status == 304
+    assert stats.failed and stats.not_modified == 0
+
+
+def test_revalidated_body_is_served_from_the_cache(tmp_path):
+    async def page(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(text="body", headers={"ETag": '"v1"'})
+
+    async def run():
+        runner, base = await _serve([web.get("/", page)])
+        try:
+            async with Fetcher(cache_dir=str(tmp_path)) as fetcher:
+                first = await fetcher.fetch(base + "/")
+                second = await fetcher.fetch(base + "/")
+                text = await second.text()
+        finally:
+            await runner.cleanup()
+        return first, second, text
+
+    first, second, text = asyncio.run(run())
+    assert not first.from_cache
+    assert second.from_cache and second.status == 304 and text == "body"
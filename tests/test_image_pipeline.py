@@ -0,0 +1,40 @@
+import random
+import shutil
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("llama_index.core")
+
+from PIL import Image, ImageDraw  # noqa: E402
+from llama_index.core.schema import NodeWithScore, TextNode  # noqa: E402
+
+from image_pipeline import ImagePipeline  # noqa: E402
+
+
+def _text_page(path, seed):
+    """A rendered page of random words, like a full-page render of a PDF text page."""
+    rng = random.Random(seed)
+    page = Image.new("L", (850, 1100), 255)
+    draw = ImageDraw.Draw(page)
+    for y in range(60, 1040, 18):
+        words = ("".join(rng.choice("abcdefghij") for _ in range(rng.randint(2, 9))) for _ in range(14))
+        draw.text((60, y), " ".join(words), fill=0)
+    page.save(path)
+    return str(path)
+
+
+def _node(image_path, score):
+    return NodeWithScore(node=TextNode(text="page", metadata={"image_paths": [image_path]}), score=score)
+
+
+def test_distinct_text_pages_both_survive(tmp_path):
+    first = _text_page(tmp_path / "p1.png", 1)
+    second = _text_page(tmp_path / "p2.png", 2)
+    copy = str(tmp_path / "p1_copy.png")
+    shutil.copy(first, copy)
+    pipeline = ImagePipeline(cache_dir=str(tmp_path / "cache"))
+
+    selected = pipeline.process([_node(first, 0.9), _node(second, 0.8), _node(copy, 0.7)])
+
+    assert [n.node.metadata["source_image"] for n in selected] == [first, second]
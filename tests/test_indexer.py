@@ -0,0 +1,112 @@
+import asyncio
+import random
+
+import pytest
+
+pytest.importorskip("pymupdf")
+pytest.importorskip("langchain.text_splitter")
+
+import autogen_ybocs_rag.indexer as indexer_module  # noqa: E402
+from autogen_ybocs_rag.indexer import IncrementalDocumentIndexer, SimpleDocumentIndexer  # noqa: E402
+
+
+class FakeMemory:
+    """Stores chunks by ID; `fail` makes every write raise, like an embedding outage."""
+
+    def __init__(self):
+        self.chunks = {}
+        self.fail = False
+
+    async def add_batch(self, contents, ids=None):
+        if self.fail:
+            raise RuntimeError("embedding service unavailable")
+        for content, chunk_id in zip(contents, ids):
+            self.chunks[chunk_id] = content.content
+
+    async def delete_ids(self, ids):
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+
+
+def _reindex(memory, tmp_path, sources):
+    indexer = IncrementalDocumentIndexer(memory, manifest_path=str(tmp_path / "manifest.json"), chunk_size=50)
+    report = asyncio.run(indexer.reindex(sources, parse_workers=1))
+    return indexer, report
+
+
+def test_changed_source_replaces_its_chunks(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("Obsessions are intrusive thoughts. " * 6)
+    memory = FakeMemory()
+    _reindex(memory, tmp_path, [str(doc)])
+
+    doc.write_text("Compulsions are repetitive behaviours.")
+    indexer, report = _reindex(memory, tmp_path, [str(doc)])
+
+    assert report.changed == [str(doc)]
+    assert set(memory.chunks) == set(indexer.manifest[str(doc)]["chunk_ids"])
+    assert list(memory.chunks.values()) == ["Compulsions are repetitive behaviours."]
+
+
+def test_failed_reindex_keeps_the_old_chunks_and_manifest_entry(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("Obsessions are intrusive thoughts. " * 6)
+    memory = FakeMemory()
+    indexer, _ = _reindex(memory, tmp_path, [str(doc)])
+    old_entry = indexer.manifest[str(doc)]
+    old_chunks = dict(memory.chunks)
+
+    doc.write_text("Compulsions are repetitive behaviours.")
+    memory.fail = True
+    indexer, report = _reindex(memory, tmp_path, [str(doc)])
+
+    assert report.ingest.failed_sources == [str(doc)]
+    assert memory.chunks == old_chunks
+    assert indexer.manifest[str(doc)] == old_entry
+
+
+def test_failed_rechunking_keeps_the_old_chunks(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_text("Obsessions are intrusive thoughts. " * 6)
+    memory = FakeMemory()
+    indexer, _ = _reindex(memory, tmp_path, [str(doc)])
+    old_entry = indexer.manifest[str(doc)]
+    old_chunks = dict(memory.chunks)
+
+    # same content, new chunking: the first batch is written, the second fails
+    writes = []
+    add_batch = memory.add_batch
+
+    async def fail_after_first_batch(contents, ids=None):
+        writes.append(ids)
+        if len(writes) > 1:
+            raise RuntimeError("embedding service unavailable")
+        await add_batch(contents, ids)
+
+    memory.add_batch = fail_after_first_batch
+    indexer = IncrementalDocumentIndexer(memory, manifest_path=str(tmp_path / "manifest.json"), chunk_size=40)
+    report = asyncio.run(indexer.reindex([str(doc)], parse_workers=1, batch_size=1))
+
+    assert report.changed == [str(doc)] and len(writes) > 1
+    assert memory.chunks == old_chunks
+    assert indexer.manifest[str(doc)] == old_entry
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_streamed_text_chunks_match_split_text(tmp_path, monkeypatch, seed):
+    rng = random.Random(seed)
+    pieces = ["<p>", "</p>", "<a href='x'>", "<", ">", " ", "  ", "\n", "\r\n", "\t", "word", "Y-BOCS", "é", "item 3"]
+    if seed % 4 == 0:
+        pieces = [p for p in pieces if p not in ("<p>", "</p>", "<a href='x'>", "<", ">")]  # plain text
+    doc = tmp_path / "doc.html"
+    doc.write_bytes("".join(rng.choice(pieces) for _ in range(rng.randint(0, 400))).encode())
+    monkeypatch.setattr(indexer_module, "STREAM_BLOCK_SIZE", rng.randint(1, 64))
+    indexer = SimpleDocumentIndexer(FakeMemory(), chunk_size=rng.randint(1, 40))
+
+    async def stream():
+        return [chunk async for chunk in indexer._iter_text_chunks(str(doc))]
+
+    content = doc.read_text(encoding="utf-8")
+    if "<" in content and ">" in content:
+        content = indexer._strip_html(content)
+    assert asyncio.run(stream()) == [chunk for chunk in indexer._split_text(content) if chunk]
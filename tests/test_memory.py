@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("autogen_ext.memory.chromadb")
+
+from autogen_ybocs_rag.memory import CollectionFingerprint, HybridMemory  # noqa: E402
+
+DOCS = {
+    "a": "The Y-BOCS is a clinician-rated scale for obsessive-compulsive symptoms.",
+    "b": "Item 3 rates the distress caused by obsessive thoughts.",
+}
+
+
+class FakeCollection:
+    """Dense search always returns chunk "a", so chunk "b" can only be found by BM25."""
+
+    distance = 0.2  # of chunk "a" from every query
+
+    def count(self):
+        return len(DOCS)
+
+    def get(self, ids=None, include=()):
+        ids = list(DOCS) if ids is None else [doc_id for doc_id in ids if doc_id in DOCS]
+        return {"ids": ids, "documents": [DOCS[i] for i in ids], "metadatas": [{"source": f"{i}.pdf"} for i in ids]}
+
+    def query(self, query_texts, n_results, include):
+        return {
+            "ids": [["a"] for _ in query_texts],
+            "documents": [[DOCS["a"]] for _ in query_texts],
+            "metadatas": [[{"source": "a.pdf"}] for _ in query_texts],
+            "distances": [[self.distance] for _ in query_texts],
+        }
+
+
+def _memory(tmp_path, score_threshold=None) -> HybridMemory:
+    chroma = SimpleNamespace(
+        _ensure_initialized=lambda: None,
+        _collection=FakeCollection(),
+        _config=SimpleNamespace(score_threshold=score_threshold),
+        _calculate_score=lambda distance: 1.0 - distance,
+    )
+    return HybridMemory(chroma, bm25_path=str(tmp_path / "bm25.json"), k=2)
+
+
+def test_query_returns_lexical_only_hits(tmp_path):
+    result = asyncio.run(_memory(tmp_path).query("distress item 3"))
+    by_id = {memory.metadata["id"]: memory for memory in result.results}
+    assert set(by_id) == {"a", "b"}
+    assert by_id["b"].content == DOCS["b"]
+    assert by_id["b"].metadata["source"] == "b.pdf"
+
+
+def test_query_batch_returns_lexical_only_hits(tmp_path):
+    results = asyncio.run(_memory(tmp_path).query_batch(["distress item 3", "clinician-rated scale"]))
+    assert {memory.metadata["id"] for memory in results[0].results} == {"a", "b"}
+    assert [memory.metadata["id"] for memory in results[1].results] == ["a"]
+
+
+def test_dense_hits_below_the_score_threshold_are_dropped(tmp_path):
+    memory = _memory(tmp_path, score_threshold=0.9)  # chunk "a" scores 0.8
+    result = asyncio.run(memory.query("distress item 3"))
+    assert [m.metadata["id"] for m in result.results] == ["b"]
+    results = asyncio.run(memory.query_batch(["distress item 3"]))
+    assert [m.metadata["id"] for m in results[0].results] == ["b"]
+
+
+def test_fingerprint_reads_the_ids_only_when_the_collection_may_have_changed():
+    collection = FakeCollection()
+    reads = []
+    get = collection.get
+    collection.get = lambda **kwargs: reads.append(kwargs) or get(**kwargs)
+    fingerprint = CollectionFingerprint(max_age=60)
+
+    first = fingerprint(collection)
+    assert [fingerprint(collection) for _ in range(5)] == [first] * 5
+    assert len(reads) == 1
+
+    fingerprint(collection, version=1)  # e.g. a write through the memory
+    assert len(reads) == 2
+
+    fingerprint.max_age = 0  # a same-size re-index elsewhere is caught once the digest is stale
+    fingerprint(collection, version=1)
+    assert len(reads) == 3
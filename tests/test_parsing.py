@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip("pymupdf4llm")
+
+from parsing import parse_documents  # noqa: E402
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_unparseable_files_are_skipped_with_any_worker_count(tmp_path, workers):
+    broken = tmp_path / "broken.pdf"
+    broken.write_text("not a pdf")
+    missing = tmp_path / "missing.pdf"
+
+    parsed = parse_documents([str(broken), str(missing)], cache_dir=str(tmp_path / "cache"), workers=workers)
+
+    assert parsed == []
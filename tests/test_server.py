@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from autogen_ybocs_rag.server import ChatService, SessionStore, chat, delete_session  # noqa: E402
+
+
+def _requests(tmp_path, send):
+    """Run `send(session, base_url)` against the chat routes, persisting sessions under tmp_path/sessions."""
+
+    async def run():
+        app = web.Application()
+        app["service"] = ChatService(SessionStore(persist_dir=str(tmp_path / "sessions")))
+        app.router.add_post("/chat", chat)
+        app.router.add_delete("/sessions/{session_id}", delete_session)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await send(session, f"http://127.0.0.1:{port}")
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("session_id", ["../x", "a/b", "", ["x"], "x" * 65])
+def test_chat_rejects_unsafe_session_ids(tmp_path, session_id):
+    async def send(session, base):
+        async with session.post(base + "/chat", json={"session_id": session_id, "message": "hi"}) as response:
+            return response.status
+
+    assert _requests(tmp_path, send) == 400
+    assert list(tmp_path.rglob("*.json")) == []
+
+
+def test_delete_rejects_path_traversal(tmp_path):
+    victim = tmp_path / "x.json"
+    victim.write_text("{}")
+
+    async def send(session, base):
+        async with session.delete(base + "/sessions/..%2Fx") as response:
+            return response.status
+
+    assert _requests(tmp_path, send) == 400
+    assert victim.exists()
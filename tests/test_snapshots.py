@@ -0,0 +1,36 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from snapshots import ReadOnlySnapshotError, Snapshot, SnapshotError, write_snapshot  # noqa: E402
+
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def _snapshot(tmp_path, model_id):
+    path = str(tmp_path / "docs.snapshot")
+    vectors = np.eye(2, dtype=np.float32)
+    write_snapshot(path, [(["a", "b"], ["first", "second"], [{}, {}], vectors)], model_id=model_id)
+    return Snapshot.open(path)
+
+
+def test_check_model_accepts_quantized_variants_only(tmp_path):
+    snapshot = _snapshot(tmp_path, MODEL)
+    snapshot.check_model(MODEL)
+    snapshot.check_model(f"{MODEL}#int8")
+    with pytest.raises(SnapshotError):
+        snapshot.check_model(f"{MODEL}#len128")  # truncated differently, so different vectors
+    with pytest.raises(SnapshotError):
+        snapshot.check_model("BAAI/bge-small-en-v1.5")
+
+
+def test_snapshot_memory_rejects_writes(tmp_path):
+    pytest.importorskip("autogen_ext.memory.chromadb")
+    from autogen_ybocs_rag.memory import SnapshotMemory
+
+    memory = SnapshotMemory(_snapshot(tmp_path, MODEL).path, lambda texts: [[1.0, 0.0] for _ in texts])
+    with pytest.raises(ReadOnlySnapshotError):
+        asyncio.run(memory.clear())